@@ -0,0 +1,3 @@
+"""
+AI GIS 检测核心包: 无界面依赖的检测引擎与命令行入口 (python -m aigis detect ...)
+"""
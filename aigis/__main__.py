@@ -0,0 +1,8 @@
+import multiprocessing
+import sys
+
+from .cli import main
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support() # 打包运行时多进程模式的子进程从这里进入
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""
+命令行批量检测 (无界面):
+    python -m aigis detect <影像或文件夹...> -m yolo11x.pt -o results/
+进度以 JSON Lines 输出到标准输出，便于容器与作业调度系统采集
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+
+from .core import IMAGE_EXTENSIONS, MERGE_METHODS, COARSE_FACTOR, BACKENDS, VECTOR_FORMATS, VIS_FORMATS, parse_bands, check_stride
+from .engine import DetectionEngine
+
+
+def collect_image_paths(inputs):
+    """ 展开输入: 文件直接加入，文件夹递归查找支持的影像格式 """
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, dirs, files in os.walk(item):
+                dirs.sort()
+                for file in sorted(files):
+                    if file.lower().endswith(IMAGE_EXTENSIONS):
+                        paths.append(os.path.join(root, file))
+        else:
+            paths.append(item)
+    # 保持顺序去重
+    return list(dict.fromkeys(paths))
+
+
+# JSON 事件输出流；detect 运行期间标准输出被独占，第三方库的打印转到标准错误
+_event_stream = None
+
+
+def reserve_stdout():
+    """ 复制一份标准输出专门用于 JSON 事件，并把文件描述符 1 重定向到标准错误 """
+    global _event_stream
+    try:
+        fd = sys.stdout.fileno()
+    except (AttributeError, OSError, ValueError):
+        return # 标准输出不是真实文件 (例如被测试框架捕获)，直接使用
+    sys.stdout.flush()
+    _event_stream = os.fdopen(os.dup(fd), 'w', encoding='utf-8', buffering=1)
+    os.dup2(sys.stderr.fileno(), fd)
+
+
+def emit(event, **fields):
+    """ 输出一行 JSON 事件 """
+    stream = _event_stream or sys.stdout
+    stream.write(json.dumps({'event': event, 'time': round(time.time(), 3), **fields}, ensure_ascii=False) + '\n')
+    stream.flush()
+
+
+def bands_arg(text):
+    try:
+        return parse_bands(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='aigis', description="AI GIS 遥感影像批量检测 (命令行)")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    detect = sub.add_parser('detect', help="批量检测影像并导出 Shapefile")
+    detect.add_argument('inputs', nargs='+', help="影像文件或包含影像的文件夹")
+    detect.add_argument('-m', '--model', default='yolo11x.pt', help="模型权重路径 (默认: yolo11x.pt)")
+    detect.add_argument('-o', '--output', required=True, help="结果保存目录")
+    detect.add_argument('--conf', type=float, default=0.25, help="置信度阈值 (默认: 0.25)")
+    detect.add_argument('--iou', type=float, default=0.45, help="NMS IoU 阈值 (默认: 0.45)")
+    detect.add_argument('--merge', choices=list(MERGE_METHODS), default='nms', help="切片结果合并方式")
+    detect.add_argument('--slice-size', type=int, default=640, help="切片尺寸 (像素)")
+    detect.add_argument('--stride', type=int, default=500, help="最大切片步长 (像素)，相邻切片至少重叠 slice-size - stride")
+    detect.add_argument('--batch-size', type=int, default=None, help="批量推理大小 (默认按实测吞吐与显存余量自动调节)")
+    detect.add_argument('--execution', choices=['thread', 'process'], default='thread',
+                        help="执行模式: thread 单模型流水线 (GPU/默认); process 多进程 (多核 CPU)")
+    detect.add_argument('--workers', type=int, default=None, help="多进程模式的进程数 (默认自动)")
+    detect.add_argument('--threads-per-worker', type=int, default=None, help="多进程模式下每个进程的 torch 线程数")
+    detect.add_argument('--no-skip-empty', action='store_true', help="不跳过无数据 (nodata / 掩膜) 的切片")
+    detect.add_argument('--skip-flat', action='store_true',
+                        help="同时跳过纹理均一的切片 (更快，但平静水面/均一地块上的单个小目标可能漏检)")
+    detect.add_argument('--no-cache', action='store_true', help="不复用结果缓存")
+    detect.add_argument('--keep-raw', action='store_true',
+                        help="保存原始预测旁车文件，便于事后快速调整阈值 (推理阶段放宽阈值，速度较慢)")
+    detect.add_argument('--resume', action='store_true', help="断点续跑: 跳过任务清单中已完成的影像")
+    detect.add_argument('--coarse-to-fine', action='store_true', help="粗到细检测: 先在降采样影像上找候选区域")
+    detect.add_argument('--coarse-factor', type=int, default=COARSE_FACTOR, help="粗扫描的降采样倍率")
+    detect.add_argument('--no-tensor-batching', action='store_true', help="关闭固定尺寸张量批处理 (交给 ultralytics 逐张预处理)")
+    detect.add_argument('--pad-mode', choices=['constant', 'reflect'], default='constant', help="边缘切片的填充方式")
+    detect.add_argument('--backend', choices=list(BACKENDS), default='auto',
+                        help="推理后端 (默认 auto: GPU 用 torch，纯 CPU 优先 OpenVINO/ONNX Runtime)")
+    detect.add_argument('--int8', action='store_true', help="导出后端使用 INT8 训练后量化 (以待测影像切片校准)")
+    detect.add_argument('--bands', type=bands_arg, default=None,
+                        help="R,G,B 对应的源波段 (从 1 开始，如 4,3,2)；默认按颜色解释或前三个波段")
+    detect.add_argument('--vector-format', choices=list(VECTOR_FORMATS), default='shp',
+                        help="矢量输出: shp 每幅影像一个 Shapefile; gpkg / fgb 整个任务汇总为一个带空间索引的 detections 图层")
+    detect.add_argument('--vis-format', choices=list(VIS_FORMATS), default='jpeg',
+                        help="可视化预览: jpeg 缩略图 (默认); cog 带地理参考与金字塔的 GeoTIFF; png 无损预览; none 不输出")
+    detect.add_argument('--coarse-conf', type=float, default=None, help="粗扫描的置信度阈值 (默认与 --conf 相同)")
+    return parser
+
+
+def run_detect(args):
+    reserve_stdout()
+    try:
+        check_stride(args.slice_size, args.stride)
+    except ValueError as e:
+        emit('error', message=str(e))
+        return 2
+    image_paths = collect_image_paths(args.inputs)
+    if not image_paths:
+        emit('error', message="未找到任何影像")
+        return 2
+
+    def on_finish(msg):
+        emit('finish', message=msg, status=engine.status)
+
+    engine = DetectionEngine(
+        args.model, image_paths, args.output, conf=args.conf, iou=args.iou, merge_method=args.merge,
+        slice_size=args.slice_size, stride=args.stride, batch_size=args.batch_size,
+        execution=args.execution, num_workers=args.workers, threads_per_worker=args.threads_per_worker,
+        skip_empty=not args.no_skip_empty, skip_flat=args.skip_flat, use_cache=not args.no_cache, keep_raw=args.keep_raw,
+        resume=args.resume, coarse_to_fine=args.coarse_to_fine,
+        coarse_factor=args.coarse_factor, coarse_conf=args.coarse_conf,
+        tensor_batching=not args.no_tensor_batching, pad_mode=args.pad_mode,
+        backend=args.backend, int8=args.int8, bands=args.bands, vector_format=args.vector_format,
+        vis_format=args.vis_format,
+        on_log=lambda msg: emit('log', message=msg),
+        on_progress=lambda percent, eta, usage: emit('progress', percent=percent, eta=eta, usage=usage),
+        on_result=lambda image_path, vis_path, stats, detections: emit(
+            'result', image=image_path, vis=vis_path, count=len(detections), stats=stats),
+        on_finish=on_finish,
+    )
+    # Ctrl+C (SIGINT) 与作业调度系统取消任务 (SIGTERM) 都按终止流程收尾 (写完结果、保存切片检查点与任务清单)
+    received = []
+
+    def on_signal(signum, frame):
+        received.append(signum)
+        engine.stop()
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+    emit('job', images=len(image_paths), model=args.model, output=args.output)
+    engine.run()
+    # 终止/失败时返回非零退出码，作业调度系统据此判断任务未完成
+    if engine.status == 'stopped':
+        return 128 + (received[0] if received else signal.SIGTERM) # 130: SIGINT, 143: SIGTERM
+    return 0 if engine.status == 'finished' else 1
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == 'detect':
+        return run_detect(args)
+    return 2
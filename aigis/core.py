@@ -0,0 +1,1910 @@
+"""
+AI GIS 检测核心 (无界面依赖)
+影像读取/切片规划、跨切片合并、模型池、结果缓存、任务清单与多进程工作函数
+"""
+import os
+import glob
+import time
+import json
+import shutil
+import sqlite3
+import struct
+import importlib.util
+import hashlib
+import heapq
+import math
+import threading
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import rasterio
+from rasterio.windows import Window
+from rasterio.enums import MaskFlags, ColorInterp
+from rasterio.crs import CRS
+from rasterio.warp import transform as warp_transform
+import numpy as np
+import shapely
+import pyogrio
+import pyogrio.raw
+import cv2
+import torch
+from torchvision.ops import batched_nms, box_iou
+from ultralytics import YOLO
+from ultralytics.utils import DEFAULT_CFG
+
+# Optional: psutil for system memory monitoring
+try:
+    import psutil
+    HAS_PSUTIL = True
+except ImportError:
+    HAS_PSUTIL = False
+
+# 支持的影像格式 (文件夹批量导入时递归查找)
+IMAGE_EXTENSIONS = ('.tif', '.tiff', '.jpg', '.png', '.jpeg')
+
+# 可视化结果图的最大边长 (大图按此降采样，避免整幅读入内存)
+VIS_MAX_SIZE = 4096
+# 可视化输出 (界面按检测结果动态重绘，不依赖该文件): 'jpeg' 缩略图; 'cog' 带地理参考与金字塔的分块压缩 GeoTIFF 预览;
+# 'png' 无损预览 (体积大、编码慢); 'none' 不输出
+VIS_FORMATS = {
+    'jpeg': "JPEG 缩略图",
+    'cog': "COG 预览 (带地理参考)",
+    'png': "PNG 预览",
+    'none': "不输出",
+}
+VIS_SUFFIXES = {'cog': '_vis.tif', 'jpeg': '_vis.jpg', 'png': '_vis.png'}
+VIS_THUMB_SIZE = 1024
+VIS_JPEG_QUALITY = 85
+VIS_COG_BLOCK = 512
+
+def parse_bands(text):
+    """ 解析波段映射 "4,3,2" -> (4, 3, 2) (R, G, B 对应的源波段，从 1 开始)；单个波段按灰度处理，空/auto 返回 None """
+    text = str(text or '').strip().lower()
+    if text in ('', 'auto'):
+        return None
+    try:
+        bands = tuple(int(b) for b in text.replace('，', ',').split(','))
+    except ValueError:
+        raise ValueError(f"无效的波段映射: {text} (示例: 4,3,2)") from None
+    if len(bands) not in (1, 3) or min(bands) < 1:
+        raise ValueError(f"波段映射需为 1 个或 3 个从 1 开始的波段号: {text}")
+    return bands
+
+def band_indexes(src, bands=None):
+    """ 需要读取的源波段号: 指定映射优先；否则按颜色解释 (ColorInterp) 匹配 R/G/B，再退回前三个波段，不足三个波段时按灰度读取第 1 波段 """
+    if bands:
+        if max(bands) > src.count:
+            raise ValueError(f"波段映射 {','.join(map(str, bands))} 超出范围: {os.path.basename(src.name)} 只有 {src.count} 个波段")
+        return list(bands)
+    interp = list(src.colorinterp)
+    rgb = [ColorInterp.red, ColorInterp.green, ColorInterp.blue]
+    if all(c in interp for c in rgb):
+        return [interp.index(c) + 1 for c in rgb]
+    return [1, 2, 3] if src.count >= 3 else [1]
+
+def read_rgb(src, window=None, out_shape=None, bands=None):
+    """ 从 rasterio 数据集读取 (h, w, 3) 数组，只读取所需波段 (见 band_indexes) 与窗口/降采样后的像素 """
+    indexes = band_indexes(src, bands)
+    unique = sorted(set(indexes))
+    if out_shape is not None:
+        out_shape = (len(unique),) + tuple(out_shape)
+    data = src.read(unique, window=window, out_shape=out_shape)
+    if unique != indexes:
+        data = data[[unique.index(i) for i in indexes]]
+    img_array = np.transpose(data, (1, 2, 0))
+
+    # Ensure 3 channels (RGB) for YOLO
+    if img_array.shape[2] == 1:
+        img_array = np.repeat(img_array, 3, axis=2)
+
+    return np.ascontiguousarray(img_array)
+
+def preview_shape(width, height, fmt):
+    """ 可视化预览的输出尺寸 (h, w)：缩略图与其余格式各自限制最大边长 """
+    max_size = VIS_THUMB_SIZE if fmt == 'jpeg' else VIS_MAX_SIZE
+    scale = min(1.0, max_size / max(height, width))
+    return max(1, int(height * scale)), max(1, int(width * scale))
+
+def to_uint8(img_array):
+    """ 非 8 位影像按 2%-98% 分位数线性拉伸到 uint8 (JPEG 编码只支持 8 位) """
+    if img_array.dtype == np.uint8:
+        return img_array
+    lo, hi = np.percentile(img_array, (2, 98))
+    scaled = (img_array.astype(np.float32) - lo) * (255.0 / max(hi - lo, 1e-6))
+    return np.clip(scaled, 0, 255).astype(np.uint8)
+
+def write_preview(path, fmt, img_array, transform=None, crs=None):
+    """ 写出 (h, w, 3) RGB 可视化预览；cog 写入地理参考 (transform 需已按预览尺寸缩放)，JPEG 压缩并自动生成金字塔 """
+    if fmt == 'cog':
+        img_array = to_uint8(img_array)
+        h, w = img_array.shape[:2]
+        georef = {'crs': crs, 'transform': transform} if crs is not None else {}
+        with rasterio.open(path, 'w', driver='COG', width=w, height=h, count=3, dtype='uint8',
+                           compress='JPEG', quality=VIS_JPEG_QUALITY, blocksize=VIS_COG_BLOCK,
+                           overview_resampling='AVERAGE', **georef) as dst:
+            dst.write(np.moveaxis(img_array, 2, 0))
+    elif fmt == 'jpeg':
+        cv2.imwrite(path, cv2.cvtColor(to_uint8(img_array), cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, VIS_JPEG_QUALITY])
+    else:
+        cv2.imwrite(path, cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR))
+
+def pixel_to_geo(transform, points):
+    """ 像素坐标 (..., 2) [x, y] 批量转换为地理坐标，等价于逐点调用 rasterio.transform.xy(offset='center') """
+    points = np.asarray(points, dtype=np.float64) + 0.5
+    matrix = np.array([[transform.a, transform.b], [transform.d, transform.e]])
+    return points @ matrix.T + np.array([transform.c, transform.f])
+
+def polygons_to_geometries(polygons, transform):
+    """ (N, K, 2) 像素顶点数组一次性转换为地理坐标的 shapely Polygon 数组 """
+    polygons = np.asarray(polygons, dtype=np.float64)
+    if len(polygons) == 0:
+        return np.empty(0, dtype=object)
+    return shapely.polygons(pixel_to_geo(transform, polygons))
+
+# --- 跨切片检测结果合并 ---
+# 切片之间有重叠，同一目标会在相邻切片中被重复检出，需要在整幅影像上统一合并
+MERGE_METHODS = {
+    'nms': "NMS (非极大值抑制)",
+    'soft-nms': "Soft-NMS (得分衰减)",
+    'wbf': "WBF (加权框融合)",
+}
+# 超过该数量时 torchvision 的稠密 NMS 明显变慢，改用网格分桶的稀疏 NMS
+DENSE_NMS_LIMIT = 8000
+
+def polygons_to_bboxes(polygons):
+    """ (N, 4, 2) 顶点数组 -> (N, 4) 外接框 [x1, y1, x2, y2] """
+    return np.concatenate([polygons.min(axis=1), polygons.max(axis=1)], axis=1)
+
+# 网格边长取框尺寸的该分位数；更大的框不参与分桶，单独与其覆盖范围内的框比较
+GRID_CELL_PERCENTILE = 95
+# 框数量不超过该值时直接两两比较
+BRUTE_FORCE_BOXES = 256
+# 每块最多展开的候选对数量，分块过滤外接框相交，限制峰值内存
+PAIR_CHUNK = 1 << 22
+
+def _bbox_overlap(bboxes, i, j):
+    """ 候选对 (i, j) 的外接框是否相交 """
+    a, b = bboxes[i], bboxes[j]
+    return (np.minimum(a[:, 2], b[:, 2]) > np.maximum(a[:, 0], b[:, 0])) & \
+           (np.minimum(a[:, 3], b[:, 3]) > np.maximum(a[:, 1], b[:, 1]))
+
+def _range_pairs(owner, lo, hi, sorted_idx, bboxes, ordered=False):
+    """ owner[k] 与排序数组区间 [lo[k], hi[k]) 内的框组成候选对，按块展开并只保留外接框相交的对
+    ordered: 同一网格内的对只保留 i < j，避免重复 """
+    counts = hi - lo
+    nonempty = counts > 0
+    owner, lo, counts = owner[nonempty], lo[nonempty], counts[nonempty]
+    ends = np.cumsum(counts)
+    out_i, out_j = [], []
+    start = 0
+    while start < len(owner):
+        # 累计候选对不超过 PAIR_CHUNK (单个 owner 的区间再大也至少处理一个)
+        stop = max(start + 1, int(np.searchsorted(ends, ends[start] - counts[start] + PAIR_CHUNK, side='right')))
+        c = counts[start:stop]
+        total = int(c.sum())
+        i = np.repeat(owner[start:stop], c)
+        j = sorted_idx[np.repeat(lo[start:stop] - (np.cumsum(c) - c), c) + np.arange(total)]
+        mask = _bbox_overlap(bboxes, i, j)
+        if ordered:
+            mask &= i < j
+        out_i.append(i[mask])
+        out_j.append(j[mask])
+        start = stop
+    return out_i, out_j
+
+def candidate_pairs(bboxes, classes=None):
+    """ 网格分桶查找外接框相交的候选对 (i < j)，只比较空间相邻的框而不是 O(N²) 两两比较；
+    个别大框不会拉大网格: 网格边长取框尺寸的分位数，大框单独查询其覆盖范围内的网格 """
+    n = len(bboxes)
+    empty = np.empty(0, dtype=np.int64)
+    if n < 2:
+        return empty, empty
+    cls = np.zeros(n, dtype=np.int64) if classes is None else np.asarray(classes, dtype=np.int64)
+    if n <= BRUTE_FORCE_BOXES:
+        i, j = np.triu_indices(n, k=1)
+        mask = _bbox_overlap(bboxes, i, j) & (cls[i] == cls[j])
+        return i[mask], j[mask]
+
+    # 尺寸不超过网格边长的框，相交的两个框中心必然落在相邻网格中
+    extent = (bboxes[:, 2:] - bboxes[:, :2]).max(axis=1)
+    cell = max(float(np.percentile(extent, GRID_CELL_PERCENTILE)), 1.0)
+    small = np.flatnonzero(extent <= cell)
+    big = np.flatnonzero(extent > cell)
+    cx = np.floor((bboxes[:, 0] + bboxes[:, 2]) / 2 / cell).astype(np.int64)
+    cy = np.floor((bboxes[:, 1] + bboxes[:, 3]) / 2 / cell).astype(np.int64)
+    ox = cx[small].min() - 1
+    oy = cy[small].min() - 1
+    gx = cx[small] - ox
+    gy = cy[small] - oy
+    ncols = int(gx.max()) + 2
+    nrows = int(gy.max()) + 2
+    # 不同类别放入不同的网格平面，天然实现类别感知
+    plane = nrows * ncols
+    key = cls[small] * plane + gy * ncols + gx
+
+    order = np.argsort(key, kind='stable')
+    sorted_key = key[order]
+    sorted_idx = small[order]
+    all_i, all_j = [], []
+    # 只需扫描半个邻域即可覆盖所有相邻网格对
+    for dx, dy in ((0, 0), (1, 0), (-1, 1), (0, 1), (1, 1)):
+        nkey = key + dy * ncols + dx
+        lo = np.searchsorted(sorted_key, nkey, side='left')
+        hi = np.searchsorted(sorted_key, nkey, side='right')
+        i, j = _range_pairs(small, lo, hi, sorted_idx, bboxes, ordered=(dx == 0 and dy == 0))
+        all_i += i
+        all_j += j
+
+    if len(big):
+        # 大框: 逐行查询外接框 (外扩一个网格) 覆盖的网格区间
+        b = bboxes[big]
+        c0 = np.clip(np.floor(b[:, 0] / cell).astype(np.int64) - 1 - ox, 0, ncols - 1)
+        c1 = np.clip(np.floor(b[:, 2] / cell).astype(np.int64) + 1 - ox, 0, ncols - 1)
+        r0 = np.clip(np.floor(b[:, 1] / cell).astype(np.int64) - 1 - oy, 0, nrows - 1)
+        r1 = np.clip(np.floor(b[:, 3] / cell).astype(np.int64) + 1 - oy, 0, nrows - 1)
+        rows = r1 - r0 + 1
+        owner = np.repeat(big, rows)
+        row = np.repeat(r0, rows) + np.arange(int(rows.sum())) - np.repeat(np.cumsum(rows) - rows, rows)
+        base = cls[owner] * plane + row * ncols
+        lo = np.searchsorted(sorted_key, base + np.repeat(c0, rows), side='left')
+        hi = np.searchsorted(sorted_key, base + np.repeat(c1, rows), side='right')
+        i, j = _range_pairs(owner, lo, hi, sorted_idx, bboxes)
+        all_i += i
+        all_j += j
+        # 大框之间递归处理 (数量不超过总数的 1 - 分位数)
+        i, j = candidate_pairs(bboxes[big], cls[big])
+        all_i.append(big[i])
+        all_j.append(big[j])
+
+    i = np.concatenate(all_i)
+    j = np.concatenate(all_j)
+    return np.minimum(i, j), np.maximum(i, j)
+
+def box_iou_pairs(bboxes, i, j):
+    """ 计算候选对 (i, j) 的水平框 IoU """
+    a, b = bboxes[i], bboxes[j]
+    iw = np.clip(np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0]), 0, None)
+    ih = np.clip(np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]), 0, None)
+    inter = iw * ih
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a + area_b - inter, 1e-9)
+
+def _cross(a, b):
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+
+def _polygon_area(polygons):
+    """ 鞋带公式计算 (..., K, 2) 多边形面积 """
+    return 0.5 * np.abs(_cross(polygons, np.roll(polygons, -1, axis=-2)).sum(axis=-1))
+
+def _points_in_quads(points, quads, eps=1e-6):
+    """ 判断 (M, K, 2) 点是否落在 (M, 4, 2) 凸四边形内 (顺/逆时针均可) """
+    edges = np.roll(quads, -1, axis=1) - quads
+    rel = points[:, :, None, :] - quads[:, None, :, :]
+    side = _cross(edges[:, None, :, :], rel)
+    return np.all(side >= -eps, axis=2) | np.all(side <= eps, axis=2)
+
+def _quad_intersection_area(a, b):
+    """ 批量计算两组凸四边形 (M, 4, 2) 的相交面积 """
+    m = len(a)
+    # 1. 两组顶点中落在对方内部的点
+    a_in_b = _points_in_quads(a, b)
+    b_in_a = _points_in_quads(b, a)
+
+    # 2. 4x4 条边两两求交点
+    p, r = a, np.roll(a, -1, axis=1) - a
+    q, s = b, np.roll(b, -1, axis=1) - b
+    p, r = p[:, :, None, :], r[:, :, None, :]
+    q, s = q[:, None, :, :], s[:, None, :, :]
+    denom = _cross(r, s)
+    safe = np.where(np.abs(denom) < 1e-9, 1.0, denom)
+    t = _cross(q - p, s) / safe
+    u = _cross(q - p, r) / safe
+    edge_valid = (np.abs(denom) >= 1e-9) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+    edge_pts = (p + t[..., None] * r).reshape(m, 16, 2)
+
+    # 3. 所有候选点按极角排序后用鞋带公式求面积
+    pts = np.concatenate([a, b, edge_pts], axis=1)
+    valid = np.concatenate([a_in_b, b_in_a, edge_valid.reshape(m, 16)], axis=1)
+    count = valid.sum(axis=1)
+    center = (pts * valid[..., None]).sum(axis=1) / np.maximum(count, 1)[:, None]
+    angle = np.arctan2(pts[..., 1] - center[:, None, 1], pts[..., 0] - center[:, None, 0])
+    angle = np.where(valid, angle, np.inf)
+    order = np.argsort(angle, axis=1)
+    pts = np.take_along_axis(pts, order[..., None], axis=1)
+    valid = np.take_along_axis(valid, order, axis=1)
+    # 无效点折叠到第一个有效点上，对面积没有贡献
+    pts = np.where(valid[..., None], pts, pts[:, :1, :])
+    area = _polygon_area(pts)
+    return np.where(count >= 3, area, 0.0)
+
+def rotated_intersection_pairs(polygons, i, j, chunk_size=65536):
+    """ 计算候选对 (i, j) 的旋转框 (OBB) 相交面积，按块处理以限制内存 """
+    polygons = polygons.astype(np.float64)
+    inter = np.empty(len(i), dtype=np.float64)
+    for start in range(0, len(i), chunk_size):
+        ci, cj = i[start:start + chunk_size], j[start:start + chunk_size]
+        inter[start:start + chunk_size] = _quad_intersection_area(polygons[ci], polygons[cj])
+    return inter
+
+def rotated_iou_pairs(polygons, i, j):
+    """ 计算候选对 (i, j) 的旋转框 (OBB) IoU """
+    areas = _polygon_area(polygons.astype(np.float64))
+    inter = rotated_intersection_pairs(polygons, i, j)
+    return inter / np.maximum(areas[i] + areas[j] - inter, 1e-9)
+
+def _adjacency(n, i, j, values):
+    """ 将对称的候选对转换为 CSR 邻接表 (indptr, neighbors, values) """
+    src = np.concatenate([i, j])
+    dst = np.concatenate([j, i])
+    vals = np.concatenate([values, values])
+    order = np.argsort(src, kind='stable')
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+    return indptr, dst[order], vals[order]
+
+def _greedy_clusters(scores, indptr, neighbors):
+    """ 按得分从高到低贪心聚类，返回每个框所属簇头的索引 (簇头即 NMS 保留的框) """
+    head = np.full(len(scores), -1, dtype=np.int64)
+    for i in np.argsort(-scores, kind='stable'):
+        if head[i] >= 0:
+            continue
+        head[i] = i
+        nb = neighbors[indptr[i]:indptr[i + 1]]
+        nb = nb[head[nb] < 0]
+        head[nb] = i
+    return head
+
+def _soft_nms(scores, indptr, neighbors, ious, sigma, score_thr):
+    """ 高斯 Soft-NMS：只衰减与已保留框相交的邻居得分 """
+    current = scores.astype(np.float64).copy()
+    done = np.zeros(len(scores), dtype=bool)
+    heap = [(-s, i) for i, s in enumerate(current)]
+    heapq.heapify(heap)
+    keep = []
+    while heap:
+        s, i = heapq.heappop(heap)
+        if done[i] or -s != current[i]:
+            continue  # 过期条目
+        if -s < score_thr:
+            break
+        done[i] = True
+        keep.append(i)
+        nb = neighbors[indptr[i]:indptr[i + 1]]
+        iv = ious[indptr[i]:indptr[i + 1]]
+        mask = ~done[nb]
+        nb, iv = nb[mask], iv[mask]
+        current[nb] *= np.exp(-(iv ** 2) / sigma)
+        for k in nb:
+            heapq.heappush(heap, (-current[k], k))
+    keep = np.array(keep, dtype=np.int64)
+    return keep, current[keep]
+
+def _fit_to_bboxes(polygons, src_bboxes, dst_bboxes):
+    """ 将多边形从原外接框线性映射到新外接框 """
+    src_min, src_size = src_bboxes[:, None, :2], src_bboxes[:, None, 2:] - src_bboxes[:, None, :2]
+    dst_min, dst_size = dst_bboxes[:, None, :2], dst_bboxes[:, None, 2:] - dst_bboxes[:, None, :2]
+    return (polygons - src_min) * (dst_size / np.maximum(src_size, 1e-9)) + dst_min
+
+def merge_detections(polygons, scores, classes, method='nms', iou_thr=0.45, score_thr=0.0, sigma=0.5, rotated=False):
+    """
+    跨切片检测结果合并 (类别感知)，整幅影像的全部结果一次性处理。
+    polygons: (N, 4, 2) 像素坐标顶点, scores: (N,), classes: (N,)
+    rotated: OBB 模型使用旋转框 IoU，否则使用外接水平框 IoU
+    返回合并后的 (polygons, scores, classes)
+    """
+    polygons = np.asarray(polygons, dtype=np.float32).reshape(-1, 4, 2)
+    scores = np.asarray(scores, dtype=np.float32)
+    classes = np.asarray(classes, dtype=np.int64)
+    if len(scores) < 2:
+        return polygons, scores, classes
+
+    bboxes = polygons_to_bboxes(polygons)
+
+    if method == 'nms' and not rotated and len(scores) <= DENSE_NMS_LIMIT:
+        keep = batched_nms(torch.from_numpy(bboxes), torch.from_numpy(scores),
+                           torch.from_numpy(classes), iou_thr).numpy()
+        return polygons[keep], scores[keep], classes[keep]
+
+    # 旋转框必然落在其外接框内，外接框不相交的对无需计算旋转 IoU
+    i, j = candidate_pairs(bboxes, classes)
+    ious = rotated_iou_pairs(polygons, i, j) if rotated else box_iou_pairs(bboxes, i, j)
+
+    if method == 'nms':
+        mask = ious > iou_thr
+        indptr, neighbors, _ = _adjacency(len(scores), i[mask], j[mask], ious[mask])
+        head = _greedy_clusters(scores, indptr, neighbors)
+        keep = np.flatnonzero(head == np.arange(len(scores)))
+        keep = keep[np.argsort(-scores[keep], kind='stable')]
+        return polygons[keep], scores[keep], classes[keep]
+
+    if method == 'soft-nms':
+        indptr, neighbors, values = _adjacency(len(scores), i, j, ious)
+        keep, new_scores = _soft_nms(scores, indptr, neighbors, values, sigma, score_thr)
+        return polygons[keep], new_scores.astype(np.float32), classes[keep]
+
+    if method == 'wbf':
+        mask = ious > iou_thr
+        indptr, neighbors, _ = _adjacency(len(scores), i[mask], j[mask], ious[mask])
+        head = _greedy_clusters(scores, indptr, neighbors)
+        heads, cluster = np.unique(head, return_inverse=True)
+        weights = scores.astype(np.float64)
+        weight_sum = np.bincount(cluster, weights=weights)
+        fused = np.stack([np.bincount(cluster, weights=bboxes[:, k] * weights) for k in range(4)], axis=1)
+        fused /= weight_sum[:, None]
+        fused_scores = weight_sum / np.bincount(cluster)
+        if rotated:
+            # 旋转框的顶点顺序不一定一致，保留簇头形状，仅平移到加权中心
+            centers = (fused[:, :2] + fused[:, 2:]) / 2
+            head_centers = (bboxes[heads, :2] + bboxes[heads, 2:]) / 2
+            fused_polygons = polygons[heads] + (centers - head_centers)[:, None, :]
+        else:
+            fused_polygons = _fit_to_bboxes(polygons[heads], bboxes[heads], fused)
+        return fused_polygons.astype(np.float32), fused_scores.astype(np.float32), classes[heads]
+
+    raise ValueError(f"未知的合并方式: {method}")
+
+def _seam_limits(tiles):
+    """ 跨接缝拼接后目标的最大尺寸 (宽, 高): 每个方向为切片尺寸 + 相邻切片重叠 """
+    limits = []
+    for axis in (0, 1):
+        starts, inverse = np.unique(tiles[:, axis], return_inverse=True)
+        sizes = np.zeros(len(starts), dtype=np.int64)
+        np.maximum.at(sizes, inverse.reshape(-1), tiles[:, axis + 2])
+        overlap = max(0, int(((starts + sizes)[:-1] - starts[1:]).max())) if len(starts) > 1 else 0
+        limits.append(int(sizes.max()) + overlap)
+    return limits
+
+def _bounded_components(n, i, j, bboxes, limits, priority):
+    """ 按优先级依次合并候选对 (并查集)，合并后外接框超过 limits (宽, 高) 的候选对跳过，
+    避免截断框经多条接缝传递连成远大于单个目标的框；返回每个节点的根节点 (分量内最小索引) """
+    parent = list(range(n))
+    extent = bboxes.tolist()
+
+    def find(a):
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return a
+
+    max_w, max_h = limits
+    for k in np.argsort(-priority, kind='stable').tolist():
+        a, b = find(int(i[k])), find(int(j[k]))
+        if a == b:
+            continue
+        ea, eb = extent[a], extent[b]
+        box = [min(ea[0], eb[0]), min(ea[1], eb[1]), max(ea[2], eb[2]), max(ea[3], eb[3])]
+        if box[2] - box[0] > max_w or box[3] - box[1] > max_h:
+            continue
+        a, b = min(a, b), max(a, b)
+        parent[b] = a
+        extent[a] = box
+    return np.array([find(a) for a in range(n)], dtype=np.int64)
+
+def stitch_tile_edges(polygons, scores, classes, tiles, image_size, margin=4, contain_thr=0.6, merge_thr=0.2, rotated=False):
+    """
+    切片边界感知拼接：处理被切片内部边界截断的目标 (在 merge_detections 之前调用)。
+    tiles: (N, 4) 每个检测来源切片窗口 [x, y, w, h], image_size: (w, h)
+    - 截断框大部分落在相邻切片的完整检测内 -> 丢弃
+    - 同一目标在多个切片中均被截断 -> 合并为一个框 (外接框不超过切片尺寸 + 相邻切片重叠)
+    返回拼接后的 (polygons, scores, classes)
+    """
+    polygons = np.asarray(polygons, dtype=np.float32).reshape(-1, 4, 2)
+    scores = np.asarray(scores, dtype=np.float32)
+    classes = np.asarray(classes, dtype=np.int64)
+    tiles = np.asarray(tiles, dtype=np.int64).reshape(-1, 4)
+    n = len(scores)
+    if n < 2:
+        return polygons, scores, classes
+
+    # 1. 标记贴着切片内部边界 (非影像边界) 的截断框
+    img_w, img_h = image_size
+    bboxes = polygons_to_bboxes(polygons)
+    tx, ty, tw, th = tiles.T
+    truncated = ((bboxes[:, 0] <= tx + margin) & (tx > 0)) | \
+                ((bboxes[:, 1] <= ty + margin) & (ty > 0)) | \
+                ((bboxes[:, 2] >= tx + tw - margin) & (tx + tw < img_w)) | \
+                ((bboxes[:, 3] >= ty + th - margin) & (ty + th < img_h))
+    if not truncated.any():
+        return polygons, scores, classes
+
+    # 2. 只考虑来自不同切片、且至少一个被截断的同类候选对
+    i, j = candidate_pairs(bboxes, classes)
+    mask = (truncated[i] | truncated[j]) & np.any(tiles[i] != tiles[j], axis=1)
+    i, j = i[mask], j[mask]
+    if rotated:
+        areas = _polygon_area(polygons.astype(np.float64))
+        inter = rotated_intersection_pairs(polygons, i, j)
+    else:
+        areas = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
+        a, b = bboxes[i], bboxes[j]
+        inter = np.clip(np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0]), 0, None) * \
+                np.clip(np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]), 0, None)
+    cover_i = inter / np.maximum(areas[i], 1e-9)
+    cover_j = inter / np.maximum(areas[j], 1e-9)
+
+    # 3. 被完整检测覆盖的截断框直接丢弃
+    drop = np.zeros(n, dtype=bool)
+    drop[i[truncated[i] & ~truncated[j] & (cover_i >= contain_thr)]] = True
+    drop[j[truncated[j] & ~truncated[i] & (cover_j >= contain_thr)]] = True
+
+    # 4. 双方都被截断的同一目标合并 (重叠大的优先)，合并结果不超过切片尺寸 + 重叠
+    link = truncated[i] & truncated[j] & (np.maximum(cover_i, cover_j) >= merge_thr) & ~drop[i] & ~drop[j]
+    root = _bounded_components(n, i[link], j[link], bboxes, _seam_limits(tiles),
+                               np.maximum(cover_i, cover_j)[link])
+    polygons = polygons.copy()
+    scores = scores.copy()
+    merged_roots = np.unique(root[root != np.arange(n)])
+    if len(merged_roots) > 0:
+        np.maximum.at(scores, root, scores.copy())
+        if rotated:
+            # 旋转框取所有顶点的最小外接旋转矩形
+            for r in merged_roots:
+                pts = polygons[root == r].reshape(-1, 2)
+                polygons[r] = cv2.boxPoints(cv2.minAreaRect(pts))
+        else:
+            union = bboxes.copy()
+            np.minimum.at(union[:, 0], root, bboxes[:, 0])
+            np.minimum.at(union[:, 1], root, bboxes[:, 1])
+            np.maximum.at(union[:, 2], root, bboxes[:, 2])
+            np.maximum.at(union[:, 3], root, bboxes[:, 3])
+            x1, y1, x2, y2 = union[merged_roots].T
+            polygons[merged_roots] = np.stack([
+                np.stack([x1, y1], axis=1), np.stack([x2, y1], axis=1),
+                np.stack([x2, y2], axis=1), np.stack([x1, y2], axis=1)
+            ], axis=1)
+
+    keep = ~drop & (root == np.arange(n))
+    return polygons[keep], scores[keep], classes[keep]
+
+# --- 切片规划 ---
+def _axis_starts(length, size, min_overlap, block=1):
+    """ 单轴切片起点: 以最少切片覆盖 [0, length)，相邻重叠不少于 min_overlap，末块向内贴齐边缘 (不产生窄条)。
+    切片数不变时起点按数据块对齐，返回 (起点列表, 是否已对齐) """
+    if length <= size:
+        return [0], False
+    span = length - size
+    max_step = max(1, size - min_overlap)
+    count = math.ceil(span / max_step) + 1
+    step = max_step // block * block
+    if block > 1 and step > 0 and math.ceil(span / step) + 1 == count:
+        return [i * step for i in range(count - 1)] + [span], True
+    # 无法对齐时均匀分布，步长不超过 max_step
+    return [i * span // (count - 1) for i in range(count)], False
+
+def check_stride(slice_size, stride):
+    """ 校验切片参数: 0 < stride <= slice_size (步长为 0 时切片数爆炸，大于切片尺寸时切片之间留下漏检的空隙) """
+    if slice_size <= 0:
+        raise ValueError(f"切片尺寸需大于 0: {slice_size}")
+    if not 0 < stride <= slice_size:
+        raise ValueError(f"切片步长需满足 0 < stride ≤ slice_size ({slice_size}): {stride}")
+
+class TilePlan:
+    """
+    切片规划: 用最少的固定尺寸切片覆盖整幅影像，相邻切片重叠不少于 min_overlap (0 ≤ min_overlap < size)，
+    最后一行/列向内贴齐影像边缘。只有不增加切片数时才按 GeoTIFF 内部数据块 (block = (宽, 高)) 对齐起点
+    (推理代价远高于多解码几个数据块)；默认 640px 切片、500px 步长配合 256/512 数据块时通常不会对齐
+    """
+    def __init__(self, width, height, size, min_overlap=0, block=(1, 1)):
+        if not 0 <= min_overlap < size:
+            raise ValueError(f"切片重叠需满足 0 ≤ 重叠 < 切片尺寸 ({size}): {min_overlap}")
+        self.width = width
+        self.height = height
+        self.size = size
+        self.min_overlap = min_overlap
+        self.block = tuple(block)
+        self.xs, x_aligned = _axis_starts(width, size, min_overlap, self.block[0])
+        self.ys, y_aligned = _axis_starts(height, size, min_overlap, self.block[1])
+        self.aligned = x_aligned or y_aligned
+        self.tiles = [(x, y, min(size, width - x), min(size, height - y)) for y in self.ys for x in self.xs]
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def describe(self):
+        aligned = f", 对齐 {self.block[0]}x{self.block[1]} 数据块" if self.aligned else ""
+        return f"{len(self.xs)} x {len(self.ys)} = {len(self)} 个 {self.size}px 切片 (重叠 ≥ {self.min_overlap}px{aligned})"
+
+# --- 粗到细检测 ---
+# 先在降采样影像 (优先使用 GeoTIFF 内部金字塔) 上快速扫描候选区域，再只对候选区域内的切片做全分辨率推理
+COARSE_FACTOR = 4 # 粗扫描的降采样倍率
+COARSE_CELL = 32 # 候选区域栅格化的单元尺寸 (像素)
+
+def decimated_shape(window, factor):
+    """ 降采样读取窗口的输出尺寸 (rows, cols)；factor=1 时返回 None 表示原始分辨率 """
+    if factor == 1:
+        return None
+    return max(1, math.ceil(window[3] / factor)), max(1, math.ceil(window[2] / factor))
+
+def coarse_windows(width, height, slice_size, stride, factor=COARSE_FACTOR):
+    """ 粗扫描窗口: 原始分辨率下按 factor 倍放大的切片规划，读取时再降采样到约 slice_size """
+    return TilePlan(width, height, slice_size * factor, (slice_size - stride) * factor).tiles
+
+def select_tiles_by_regions(tiles, boxes, image_size, pad, cell=COARSE_CELL):
+    """ 保留与候选区域 (外扩 pad 像素) 相交的切片，返回 (保留的切片, 跳过数量) """
+    if not tiles:
+        return tiles, 0
+    width, height = image_size
+    mask = np.zeros((math.ceil(height / cell), math.ceil(width / cell)), dtype=bool)
+    if len(boxes):
+        cells = np.asarray(boxes, dtype=np.float64) + np.array([-pad, -pad, pad, pad])
+        cells = np.clip(cells / cell, 0, [mask.shape[1], mask.shape[0], mask.shape[1], mask.shape[0]])
+        for x0, y0, x1, y1 in np.stack([np.floor(cells[:, :2]), np.ceil(cells[:, 2:])], axis=1).reshape(-1, 4).astype(np.int64):
+            mask[y0:y1, x0:x1] = True
+    # 与无数据过滤共用积分图统计，只要覆盖到候选区域就保留
+    return filter_nodata_tiles(tiles, mask, 1.0 / cell, min_fraction=1e-9)
+
+# --- 检测结果后处理 ---
+def refine_detections(polygons, scores, classes, tiles, image_size, conf, iou, merge_method='nms',
+                      rotated=False, tiled=True, renms=False):
+    """ 置信度过滤 -> 切片边界拼接 -> 合并重复目标；返回 (polygons, scores, classes, 拼接去除数量)
+    renms=True 表示输入是宽松阈值下的原始预测，整图 (非切片) 也需要按 iou 重新做一次 NMS """
+    keep = scores >= conf
+    if not keep.all():
+        polygons, scores, classes = polygons[keep], scores[keep], classes[keep]
+        tiles = tiles[keep] if tiled else tiles
+    stitched = 0
+    if tiled and len(polygons) > 1:
+        # 按切片行列排序 (稳定排序保留切片内顺序)，多进程分组完成顺序不同也得到相同结果
+        order = np.lexsort((tiles[:, 0], tiles[:, 1]))
+        polygons, scores, classes, tiles = polygons[order], scores[order], classes[order], tiles[order]
+        raw_count = len(polygons)
+        polygons, scores, classes = stitch_tile_edges(polygons, scores, classes, tiles, image_size, rotated=rotated)
+        stitched = raw_count - len(polygons)
+    if (tiled or renms) and len(polygons) > 1:
+        polygons, scores, classes = merge_detections(polygons, scores, classes, method=merge_method,
+                                                     iou_thr=iou, score_thr=conf, rotated=rotated)
+    return polygons, scores, classes, stitched
+
+class DetectionTable:
+    """
+    列式检测结果 (前端与结果回放共用): polygons (N, 4, 2) / bboxes (N, 4) 像素坐标、scores (N,) 均为 float32，
+    codes (N,) int32 为类别名称表 names 的下标。过滤/排序/掩码均为 NumPy 向量化操作，返回共享名称表的新表；
+    作为普通 Python 对象经 Qt 信号按引用传递，不逐条转换为 QVariant
+    """
+    __slots__ = ('polygons', 'bboxes', 'scores', 'codes', 'names')
+
+    def __init__(self, polygons, scores, codes, names, bboxes=None):
+        self.polygons = np.asarray(polygons, dtype=np.float32).reshape(-1, 4, 2)
+        self.scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        self.codes = np.asarray(codes, dtype=np.int32).reshape(-1)
+        self.names = list(names)
+        self.bboxes = polygons_to_bboxes(self.polygons) if bboxes is None else np.asarray(bboxes, dtype=np.float32)
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty((0, 4, 2)), [], [], [])
+
+    @classmethod
+    def from_names(cls, polygons, scores, names):
+        """ 由逐目标的类别名称构建 (名称表按字母序) """
+        if len(names) == 0:
+            return cls.empty()
+        table, codes = np.unique(np.asarray(names, dtype=object), return_inverse=True)
+        return cls(polygons, scores, codes, table.tolist())
+
+    def to_json(self):
+        """ 列式 JSON (任务清单/结果缓存) """
+        return {'names': self.names, 'codes': self.codes.tolist(), 'scores': self.scores.tolist(),
+                'polygons': self.polygons.reshape(-1).tolist()}
+
+    @classmethod
+    def from_json(cls, data):
+        """ 读取 to_json() 的结果；兼容旧版逐目标记录列表 [{'name', 'bbox', 'polygon', 'score'}] """
+        if isinstance(data, list):
+            return cls.from_names([d['polygon'] for d in data] or np.empty((0, 4, 2)),
+                                  [d['score'] for d in data], [d['name'] for d in data])
+        return cls(data['polygons'], data['scores'], data['codes'], data['names'])
+
+    def __len__(self):
+        return len(self.scores)
+
+    def take(self, index):
+        """ 按下标数组或布尔掩码选取，返回新表 """
+        return DetectionTable(self.polygons[index], self.scores[index], self.codes[index], self.names,
+                              bboxes=self.bboxes[index])
+
+    def code_of(self, name):
+        """ 类别名称对应的编码，不存在时返回 -1 """
+        return self.names.index(name) if name in self.names else -1
+
+    def mask(self, min_score=None, name=None):
+        """ 置信度下限与类别的布尔掩码 """
+        keep = np.ones(len(self), dtype=bool)
+        if min_score is not None:
+            keep &= self.scores >= min_score
+        if name is not None:
+            keep &= self.codes == self.code_of(name)
+        return keep
+
+    def filter(self, min_score=None, name=None):
+        return self.take(self.mask(min_score, name))
+
+    def sort(self, descending=True):
+        """ 按置信度排序 """
+        order = np.argsort(-self.scores if descending else self.scores, kind='stable')
+        return self.take(order)
+
+    @property
+    def class_names(self):
+        """ 逐目标的类别名称列表 """
+        return np.asarray(self.names, dtype=object)[self.codes].tolist() if len(self) else []
+
+    def counts(self):
+        """ 各类别的目标数量 {名称: 数量} (按名称表顺序，只含出现的类别) """
+        counts = np.bincount(self.codes, minlength=len(self.names))
+        return {name: int(n) for name, n in zip(self.names, counts) if n > 0}
+
+    def class_list(self):
+        """ 出现的类别名称 (排序) """
+        return sorted(self.counts())
+
+    def centers(self):
+        """ 外接框中心 (N, 2) """
+        return (self.bboxes[:, :2] + self.bboxes[:, 2:]) / 2
+
+def detection_stats(base_name, names):
+    """ 按类别计数的统计文本 """
+    stats_summary = f"【{base_name} 统计】\n"
+    for cls_name, count in Counter(names).items():
+        stats_summary += f"- {cls_name}: {count} 个\n"
+    return stats_summary
+
+# --- 原始预测旁车文件 ---
+# 以宽松阈值保存合并前的原始预测，调整置信度/IoU 时只需重新过滤合并，无需模型和影像
+RAW_CONF = 0.01
+RAW_IOU = 0.7
+RAW_MAX_DET = 1000 # 宽松 NMS 下每个切片保留更多候选，避免被默认的 300 截断
+
+def raw_sidecar_path(output_dir, image_path):
+    base_name = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(output_dir, f"{base_name}_raw.npz")
+
+def save_raw_predictions(path, polygons, scores, classes, tiles, names, task, image_size, tiled, thresholds=(RAW_CONF, RAW_IOU)):
+    """ 保存原始预测旁车文件 (压缩)；thresholds 为推理时实际使用的 (conf, iou)，事后调整阈值不能超出该范围 """
+    np.savez_compressed(path,
+             polygons=polygons.astype(np.float32), scores=scores.astype(np.float32),
+             classes=classes.astype(np.int32), tiles=tiles.astype(np.int32),
+             names=np.array(json.dumps({int(k): v for k, v in names.items()}, ensure_ascii=False)),
+             task=np.array(task), image_size=np.array(image_size, dtype=np.int64),
+             tiled=np.array(tiled), thresholds=np.array(thresholds, dtype=np.float64))
+
+def load_raw_predictions(path):
+    """ 读取旁车文件，返回 dict (数组 + names/task/image_size/tiled) """
+    with np.load(path, allow_pickle=False) as data:
+        raw = {key: data[key] for key in ('polygons', 'scores', 'classes', 'tiles', 'thresholds')}
+        raw['names'] = {int(k): v for k, v in json.loads(str(data['names'])).items()}
+        raw['task'] = str(data['task'])
+        raw['image_size'] = tuple(int(v) for v in data['image_size'])
+        raw['tiled'] = bool(data['tiled'])
+    raw['classes'] = raw['classes'].astype(np.int64)
+    return raw
+
+def clamp_raw_thresholds(raw, conf, iou):
+    """ 原始预测只包含推理阈值范围内的结果: 置信度不能低于、IoU 不能高于推理时的阈值，返回实际可用的 (conf, iou) """
+    raw_conf, raw_iou = (float(v) for v in raw['thresholds'])
+    return max(conf, raw_conf), min(iou, raw_iou)
+
+def rethreshold_raw(raw, conf, iou, merge_method='nms'):
+    """ 在原始预测上重新应用置信度/IoU 阈值与合并 (阈值按 clamp_raw_thresholds 限制在推理范围内)，返回 DetectionTable """
+    conf, iou = clamp_raw_thresholds(raw, conf, iou)
+    polygons, scores, classes, _ = refine_detections(
+        raw['polygons'], raw['scores'], raw['classes'], raw['tiles'], raw['image_size'],
+        conf, iou, merge_method, rotated=(raw['task'] == 'obb'), tiled=raw['tiled'], renms=True)
+    return DetectionTable(polygons, scores, classes, [raw['names'][k] for k in sorted(raw['names'])])
+
+# --- 空白切片过滤 ---
+MIN_VALID_FRACTION = 0.02 # 有效像素占比低于此值的切片视为无数据
+FLAT_TILE_STD = 2.0 # 抽样标准差低于此值的切片视为纹理均一 (填充/云/平静水面)
+
+def valid_mask_overview(src, max_size=1024, bands=None):
+    """ 读取降采样的有效像素掩膜 (nodata / alpha / mask 波段)，只统计参与推理的波段，返回 (mask, scale)；影像没有掩膜信息时返回 None """
+    indexes = sorted(set(band_indexes(src, bands)))
+    if all(MaskFlags.all_valid in src.mask_flag_enums[i - 1] for i in indexes):
+        return None
+    scale = min(1.0, max_size / max(src.height, src.width))
+    out_shape = (max(1, round(src.height * scale)), max(1, round(src.width * scale)))
+    return (src.read_masks(indexes, out_shape=(len(indexes),) + out_shape) > 0).any(axis=0), scale
+
+def filter_nodata_tiles(tiles, mask, scale, min_fraction=MIN_VALID_FRACTION):
+    """ 用积分图一次性计算每个切片的有效像素占比，返回 (保留的切片, 跳过数量) """
+    if not tiles:
+        return tiles, 0
+    integral = np.pad(mask.astype(np.int64).cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+    mh, mw = mask.shape
+    t = np.asarray(tiles, dtype=np.float64)
+    x0 = np.clip(np.floor(t[:, 0] * scale).astype(np.int64), 0, mw - 1)
+    y0 = np.clip(np.floor(t[:, 1] * scale).astype(np.int64), 0, mh - 1)
+    x1 = np.clip(np.maximum(x0 + 1, np.ceil((t[:, 0] + t[:, 2]) * scale).astype(np.int64)), 1, mw)
+    y1 = np.clip(np.maximum(y0 + 1, np.ceil((t[:, 1] + t[:, 3]) * scale).astype(np.int64)), 1, mh)
+    valid = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+    fraction = valid / ((x1 - x0) * (y1 - y0))
+    keep = fraction >= min_fraction
+    return [tile for tile, k in zip(tiles, keep) if k], int((~keep).sum())
+
+def is_flat_tile(crop, std_thr=FLAT_TILE_STD):
+    """ 抽样计算像素标准差，判断切片是否没有可检测的纹理 """
+    return float(crop[::4, ::4].std()) < std_thr
+
+class TileReaderPool:
+    """ 切片读取线程池：每个线程持有独立的 rasterio 句柄 (句柄不能跨线程共享) """
+
+    def __init__(self, workers=2, bands=None):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="tile-reader")
+        self.bands = bands # R, G, B 对应的源波段 (None 为自动)
+        self._local = threading.local()
+        self._handles = []
+        self._lock = threading.Lock()
+
+    def _dataset(self, path):
+        datasets = getattr(self._local, 'datasets', None)
+        if datasets is None:
+            datasets = self._local.datasets = {}
+        src = datasets.get(path)
+        if src is None:
+            # 每个线程只保留当前影像的句柄
+            for old in datasets.values():
+                old.close()
+            datasets.clear()
+            src = datasets[path] = rasterio.open(path)
+            with self._lock:
+                self._handles.append(src)
+        return src
+
+    def _read_tiles(self, path, windows, skip_flat=False, factor=1):
+        src = self._dataset(path)
+        crops = [read_rgb(src, window=Window(*win), out_shape=decimated_shape(win, factor), bands=self.bands) for win in windows]
+        if skip_flat:
+            # 纹理均一的切片以 None 占位，推理阶段直接跳过
+            crops = [None if is_flat_tile(crop) else crop for crop in crops]
+        return crops
+
+    def _read_full(self, path):
+        return read_rgb(self._dataset(path), bands=self.bands)
+
+    def submit_tiles(self, path, windows, skip_flat=False, factor=1):
+        return self.executor.submit(self._read_tiles, path, windows, skip_flat, factor)
+
+    def submit_full(self, path):
+        return self.executor.submit(self._read_full, path)
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            for src in self._handles:
+                src.close()
+            self._handles.clear()
+
+class OutputWriterPool:
+    """
+    后台写出线程池: 结果文件 (Shapefile / 可视化图等) 的编码写盘交给后台线程，下一幅影像的推理无需等待；
+    在途任务数有上限 (背压，限制待写影像占用的内存)，flush() 等待全部写完，失败通过 on_error(label, error) 报告
+    """
+    def __init__(self, workers=2, max_pending=4, on_error=None):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="output-writer")
+        self.on_error = on_error
+        self.errors = []
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._futures = set()
+        self._lock = threading.Lock()
+
+    def submit(self, label, fn, *args, **kwargs):
+        """ 提交写出任务；在途任务已满时阻塞直到有空位 """
+        self._slots.acquire()
+        try:
+            future = self.executor.submit(self._run, label, fn, args, kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._discard)
+        return future
+
+    def _run(self, label, fn, args, kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            with self._lock:
+                self.errors.append((label, e))
+            if self.on_error:
+                self.on_error(label, e)
+        finally:
+            self._slots.release()
+
+    def _discard(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def flush(self):
+        """ 等待所有已提交的写出任务完成，返回累计的失败列表 [(label, error)] """
+        with self._lock:
+            futures = list(self._futures)
+        wait(futures)
+        return list(self.errors)
+
+    def close(self):
+        self.flush()
+        self.executor.shutdown(wait=True)
+
+# --- 汇总矢量输出 ---
+# 'shp' 为每幅影像一个 Shapefile；gpkg / fgb 将整个任务的检测结果写入一个带空间索引的图层
+VECTOR_FORMATS = {
+    'shp': "Shapefile (逐幅)",
+    'gpkg': "GeoPackage (汇总)",
+    'fgb': "FlatGeobuf (汇总)",
+}
+DETECTION_LAYER = 'detections'
+
+def copy_layer(src_path, dst_path, driver, layer=None, dst_layer=None, **kwargs):
+    """ 以 Arrow 流逐批复制一个图层 (不整体读入内存) """
+    with pyogrio.open_arrow(src_path, layer=layer) as (meta, reader):
+        pyogrio.write_arrow(reader, dst_path, layer=dst_layer, driver=driver,
+                            geometry_name=meta['geometry_name'] or 'geometry',
+                            geometry_type=meta['geometry_type'], crs=meta['crs'], **kwargs)
+
+# 固定的属性表结构 (列名, 类型)；缺失的值写入 NULL
+DETECTION_FIELDS = (('run_id', object), ('image', object), ('image_path', object), ('class', object), ('score', np.float64))
+IMAGE_FIELDS = (('run_id', object), ('image', object), ('image_path', object), ('detections', np.int64), ('crs', object),
+                ('width', np.int64), ('height', np.int64), ('detect_seconds', np.float64), ('finished', np.float64))
+RUN_FIELDS = (('run_id', object), ('started', np.float64), ('finished', np.float64), ('status', object),
+              ('images', np.int64), ('detections', np.int64), ('model', object), ('params', object))
+
+def _gpkg_envelope(blob):
+    """ GeoPackage 几何 BLOB 的外接框 (minx, maxx, miny, maxy)；头部不带外接框时解析 WKB """
+    flags = blob[3]
+    kind = (flags >> 1) & 7
+    if kind:
+        return struct.unpack_from('<4d' if flags & 1 else '>4d', blob, 8)
+    minx, miny, maxx, maxy = shapely.from_wkb(bytes(blob[8:])).bounds
+    return minx, maxx, miny, maxy
+
+def _gpkg_blobs(geometries, srs_id):
+    """ shapely 几何 -> GeoPackage 几何 BLOB (小端头部 + [minx, maxx, miny, maxy] 外接框 + WKB) """
+    header = struct.pack('<2sBBi', b'GP', 0, 0x03, srs_id)
+    bounds = shapely.bounds(geometries)
+    return [header + struct.pack('<4d', b[0], b[2], b[1], b[3]) + wkb
+            for b, wkb in zip(bounds.tolist(), shapely.to_wkb(geometries, byte_order=1))]
+
+def _register_gpkg_functions(conn):
+    """ R-tree 触发器用到的 ST_* 函数 (GDAL 之外的 sqlite 连接需自行注册) """
+    def envelope_part(i):
+        return lambda blob: None if blob is None else _gpkg_envelope(blob)[i]
+    conn.create_function('ST_IsEmpty', 1, lambda blob: None if blob is None else (blob[3] >> 4) & 1, deterministic=True)
+    for i, name in enumerate(('ST_MinX', 'ST_MaxX', 'ST_MinY', 'ST_MaxY')):
+        conn.create_function(name, 1, envelope_part(i), deterministic=True)
+
+class DetectionLayerWriter:
+    """
+    汇总检测图层: 一次任务的检测结果逐幅追加到同一个 GeoPackage (R-tree 空间索引) 或 FlatGeobuf 文件。
+    图层与 images (逐幅) / runs (任务级) 属性表在打开时按固定结构由 GDAL 创建，之后每幅影像的检测要素、
+    images 行与图层范围在同一个 sqlite 事务中写入 (要么全部写入，要么全部回滚)。
+    图层坐标系在打开时确定 (通常取第一幅输入影像)，坐标系不同的影像写入时重投影并提示。
+    FlatGeobuf 不支持追加写入，先写入 .aigis_job 下的临时 GeoPackage，close() 时流式转换并建立空间索引 (只含检测图层)
+    """
+    def __init__(self, output_dir, fmt, run_id, crs=None, run_attrs=None, append=False, log=None):
+        self.fmt = fmt
+        self.path = os.path.join(output_dir, f"{DETECTION_LAYER}.{fmt}")
+        self.stage_path = self.path
+        if fmt == 'fgb':
+            self.stage_path = os.path.join(output_dir, JOB_DIRNAME, f"{DETECTION_LAYER}_staging.gpkg")
+            os.makedirs(os.path.dirname(self.stage_path), exist_ok=True)
+        self.run_id = run_id
+        self.run_attrs = run_attrs or {}
+        self.log = log or (lambda msg: None)
+        self.started = time.time()
+        self.images = 0
+        self.count = 0
+        self.crs = crs
+        self.present = set() # 图层中已有结果的影像 (续跑时跳过重复写入)
+        self._warned = set()
+        self._lock = threading.Lock()
+        if append:
+            self._reopen()
+        else:
+            for path in {self.path, self.stage_path}:
+                if os.path.exists(path):
+                    os.remove(path)
+        self._create_missing()
+        self._conn = sqlite3.connect(self.stage_path, check_same_thread=False)
+        _register_gpkg_functions(self._conn)
+        self._srs_id = self._conn.execute("SELECT srs_id FROM gpkg_geometry_columns WHERE table_name = ?",
+                                          (DETECTION_LAYER,)).fetchone()[0]
+        self._columns = {layer: {row[1] for row in self._conn.execute(f'PRAGMA table_info("{layer}")')}
+                         for layer in (DETECTION_LAYER, 'images', 'runs')}
+
+    def _reopen(self):
+        """ 续跑: 沿用已有图层 (FlatGeobuf 先转回临时 GeoPackage)，读取坐标系与已写入的影像 """
+        if self.stage_path != self.path and not os.path.exists(self.stage_path) and os.path.exists(self.path):
+            copy_layer(self.path, self.stage_path, 'GPKG', dst_layer=DETECTION_LAYER)
+        if not os.path.exists(self.stage_path):
+            return
+        layers = {name for name, _ in pyogrio.list_layers(self.stage_path)}
+        if DETECTION_LAYER in layers:
+            crs = pyogrio.read_info(self.stage_path, layer=DETECTION_LAYER)['crs']
+            self.crs = CRS.from_user_input(crs) if crs else None
+        for layer in layers & {DETECTION_LAYER, 'images'}:
+            _, _, _, fields = pyogrio.raw.read(self.stage_path, layer=layer, columns=['image_path'], read_geometry=False)
+            self.present.update(fields[0].tolist())
+
+    def _create_missing(self):
+        """ 按固定结构创建尚不存在的检测图层与属性表 (空表) """
+        layers = set()
+        if os.path.exists(self.stage_path):
+            layers = {name for name, _ in pyogrio.list_layers(self.stage_path)}
+        for layer, fields in ((DETECTION_LAYER, DETECTION_FIELDS), ('images', IMAGE_FIELDS), ('runs', RUN_FIELDS)):
+            if layer in layers:
+                continue
+            spatial = layer == DETECTION_LAYER
+            pyogrio.raw.write(self.stage_path, np.empty(0, dtype=object) if spatial else None,
+                              [np.empty(0, dtype=dtype) for _, dtype in fields], [name for name, _ in fields],
+                              layer=layer, driver='GPKG', geometry_type='Polygon' if spatial else None,
+                              crs=self.crs.to_wkt() if spatial and self.crs else None,
+                              append=os.path.exists(self.stage_path))
+
+    def _insert(self, layer, rows, fields):
+        """ 按固定列插入多行 (续跑时旧版表中不存在的列跳过) """
+        names = [name for name in fields if name in self._columns[layer]]
+        columns = ', '.join(f'"{name}"' for name in names)
+        placeholders = ', '.join('?' for _ in names)
+        self._conn.executemany(f'INSERT INTO "{layer}" ({columns}) VALUES ({placeholders})',
+                               ([row[name] for name in names] for row in rows))
+
+    def add(self, image_path, polygons, scores, names, transform, crs, width=None, height=None, detect_seconds=None):
+        """ 追加一幅影像的检测结果 (像素坐标多边形)：检测要素与 images 行在同一事务中写入 """
+        geometries = polygons_to_geometries(polygons, transform)
+        n = len(geometries)
+        base_name = os.path.splitext(os.path.basename(image_path))[0]
+        with self._lock:
+            if n > 0 and crs is not None and self.crs is not None and crs != self.crs:
+                geometries = shapely.transform(geometries, lambda xy: np.column_stack(
+                    warp_transform(crs, self.crs, xy[:, 0], xy[:, 1])))
+            if n > 0 and crs != self.crs and crs not in self._warned:
+                self._warned.add(crs)
+                action = "已重投影" if crs is not None and self.crs is not None else "按原坐标写入"
+                self.log(f"⚠️ {base_name}: 坐标系 {crs.to_string() if crs else '无'} 与汇总图层 "
+                         f"{self.crs.to_string() if self.crs else '无'} 不同，{action}")
+            scores = np.asarray(scores, dtype=np.float64).tolist()
+            with self._conn:
+                if n > 0:
+                    self._insert(DETECTION_LAYER, (
+                        {'geom': blob, 'run_id': self.run_id, 'image': base_name, 'image_path': image_path,
+                         'class': name, 'score': score}
+                        for blob, name, score in zip(_gpkg_blobs(geometries, self._srs_id), names, scores)),
+                        ['geom'] + [name for name, _ in DETECTION_FIELDS])
+                    minx, miny, maxx, maxy = shapely.total_bounds(geometries).tolist()
+                    self._conn.execute(
+                        "UPDATE gpkg_contents SET min_x = COALESCE(MIN(min_x, ?), ?), min_y = COALESCE(MIN(min_y, ?), ?), "
+                        "max_x = COALESCE(MAX(max_x, ?), ?), max_y = COALESCE(MAX(max_y, ?), ?), "
+                        "last_change = strftime('%Y-%m-%dT%H:%M:%fZ', 'now') WHERE table_name = ?",
+                        (minx, minx, miny, miny, maxx, maxx, maxy, maxy, DETECTION_LAYER))
+                self._insert('images', [{
+                    'run_id': self.run_id, 'image': base_name, 'image_path': image_path, 'detections': n,
+                    'crs': crs.to_string() if crs else None, 'width': width, 'height': height,
+                    'detect_seconds': None if detect_seconds is None else round(detect_seconds, 3),
+                    'finished': time.time(),
+                }], [name for name, _ in IMAGE_FIELDS])
+            self.present.add(image_path)
+            self.images += 1
+            self.count += n
+
+    def close(self, status='finished'):
+        """ 写入任务级属性 (runs 表) 并完成输出；FlatGeobuf 在此转换并删除临时文件，返回输出路径 """
+        run = {'run_id': self.run_id, 'started': self.started, 'finished': time.time(), 'status': status,
+               'images': self.images, 'detections': self.count}
+        with self._lock:
+            with self._conn:
+                self._insert('runs', [{**run, 'model': self.run_attrs.get('model'),
+                                       'params': json.dumps(self.run_attrs.get('params'), ensure_ascii=False)}],
+                             [name for name, _ in RUN_FIELDS])
+            self._conn.close()
+            if self.fmt == 'fgb':
+                # FlatGeobuf 单图层: 任务级属性写入图层描述
+                tmp_path = self.path[:-len('.fgb')] + '.tmp.fgb'
+                copy_layer(self.stage_path, tmp_path, 'FlatGeobuf', layer=DETECTION_LAYER, dst_layer=DETECTION_LAYER,
+                           SPATIAL_INDEX='YES', TITLE=self.run_id,
+                           DESCRIPTION=json.dumps({**run, **self.run_attrs}, ensure_ascii=False))
+                os.replace(tmp_path, self.path)
+                os.remove(self.stage_path)
+        return self.path
+
+def collect_result(result, off_x, off_y, tile, acc, scale=1, extent=None):
+    """ 将单个切片 (或整图) 的推理结果整体拷贝到主机内存，批量平移到全图坐标后追加到 acc
+    scale: 降采样读取时的倍率，坐标先放大回原始分辨率再平移
+    extent: 窗口的有效范围 (w, h)，默认取切片尺寸；中心落在填充区域的检测被丢弃 """
+    # Process OBB
+    if result.obb is not None and len(result.obb) > 0:
+        det = result.obb
+        points = det.xyxyxyxy.cpu().numpy()
+    # Process HBB
+    elif result.boxes is not None and len(result.boxes) > 0:
+        det = result.boxes
+        xyxy = det.xyxy.cpu().numpy()
+        # (n, 4) -> (n, 4, 2): 左上, 右上, 右下, 左下
+        points = xyxy[:, [[0, 1], [2, 1], [2, 3], [0, 3]]]
+    else:
+        return
+
+    scores = det.conf.cpu().numpy()
+    classes = det.cls.cpu().numpy().astype(np.int64)
+    if scale != 1:
+        points = points * scale
+    if extent is None and tile is not None:
+        extent = tile[2:]
+    if extent is not None:
+        # 固定尺寸张量批处理时边缘切片带有填充，去掉中心落在填充区域的检测并裁剪到有效范围
+        center = points.mean(axis=1)
+        keep = (center[:, 0] < extent[0]) & (center[:, 1] < extent[1])
+        if not keep.all():
+            points, scores, classes = points[keep], scores[keep], classes[keep]
+            if len(points) == 0:
+                return
+        points = np.clip(points, 0, np.array(extent, dtype=points.dtype))
+    points = points + np.array([off_x, off_y], dtype=points.dtype)
+    acc['polygons'].append(points)
+    acc['scores'].append(scores)
+    acc['classes'].append(classes)
+    if tile is not None:
+        acc['tiles'].append(np.broadcast_to(np.asarray(tile, dtype=np.int64), (len(points), 4)))
+
+# --- 固定尺寸张量批处理 ---
+TILE_PAD_VALUE = 114 # 与 ultralytics letterbox 相同的灰色填充
+
+def model_input_size(model):
+    """ ultralytics 列表输入路径 letterbox 的目标尺寸 (h, w): 权重中记录的训练尺寸，未记录时为默认配置 (按步长 32 取整) """
+    imgsz = model.overrides.get('imgsz') or DEFAULT_CFG.imgsz
+    if isinstance(imgsz, int):
+        imgsz = (imgsz, imgsz)
+    elif len(imgsz) == 1:
+        imgsz = (imgsz[0], imgsz[0])
+    return tuple(math.ceil(v / 32) * 32 for v in imgsz)
+
+class TileTensorBatcher:
+    """
+    固定尺寸批量张量: 切片就地写入复用的 uint8 缓冲区 (NHWC)，边缘切片填充到固定尺寸，
+    再一次性拷贝到设备并转为 NCHW 浮点张量直接送入模型，绕过 ultralytics 的逐张 letterbox 预处理。
+    张量输入不经过 letterbox 缩放，只有模型推理尺寸与切片尺寸一致时才与列表输入路径等价 (见 matches)
+    """
+    def __init__(self, tile_size, device='cpu', pad_mode='constant'):
+        self.size = math.ceil(tile_size / 32) * 32 # 模型步长的整数倍
+        self.device = device
+        self.pad_mode = pad_mode # 'constant' 灰色填充 / 'reflect' 镜像填充
+        self._host = None
+        self._device_buf = None
+
+    def _ensure(self, n):
+        if self._host is not None and self._host.shape[0] >= n:
+            return
+        s = self.size
+        self._host = torch.empty((n, s, s, 3), dtype=torch.uint8, pin_memory=(self.device == 'cuda'))
+        self._device_buf = torch.empty((n, 3, s, s), dtype=torch.float32, device=self.device)
+
+    def matches(self, model):
+        """ 模型的推理尺寸与批量张量尺寸一致 (例如 1024 训练的模型在 640 切片上需要 letterbox 放大，不能走张量路径) """
+        return model_input_size(model) == (self.size, self.size)
+
+    def accepts(self, crops, model=None):
+        if model is not None and not self.matches(model):
+            return False
+        return all(c.dtype == np.uint8 and c.shape[0] <= self.size and c.shape[1] <= self.size for c in crops)
+
+    def __call__(self, crops):
+        n = len(crops)
+        self._ensure(n)
+        s = self.size
+        host = self._host[:n].numpy()
+        for i, crop in enumerate(crops):
+            h, w = crop.shape[:2]
+            # 通道顺序与列表输入路径一致 (ultralytics 将 numpy 输入视为 BGR 并在内部翻转)
+            crop = crop[..., ::-1]
+            if h == s and w == s:
+                host[i] = crop
+            elif self.pad_mode == 'reflect':
+                host[i] = np.pad(crop, ((0, s - h), (0, s - w), (0, 0)), mode='reflect')
+            else:
+                host[i, :h, :w] = crop
+                host[i, h:] = TILE_PAD_VALUE
+                host[i, :h, w:] = TILE_PAD_VALUE
+        batch = self._device_buf[:n]
+        batch.copy_(self._host[:n].to(self.device, non_blocking=True).permute(0, 3, 1, 2))
+        return batch.div_(255)
+
+def predict_crops(model, crops, batcher=None, **kwargs):
+    """ 批量推理切片: 提供 batcher、模型推理尺寸与之一致且切片均为 uint8 时走固定尺寸张量路径，否则交给 ultralytics 逐张预处理 """
+    images = batcher(crops) if batcher is not None and batcher.accepts(crops, model) else crops
+    return model.predict(images, save=False, augment=False, verbose=False, **kwargs)
+
+# --- 自适应批量大小 ---
+AUTO_BATCH_INITIAL = 8 # 自动调节的起始批量
+AUTO_BATCH_MAX = 64
+AUTO_BATCH_PROBE = 2 # 每个候选批量测量的批次数 (不含首批预热)
+AUTO_BATCH_GAIN = 1.05 # 吞吐提升超过 5% 才继续加大批量
+MEMORY_BUDGET = 0.85 # 内存/显存占用上限 (占总量比例)
+
+def is_oom_error(e):
+    """ 是否为显存/内存不足 (CUDA / MPS / CPU) """
+    if isinstance(e, (torch.cuda.OutOfMemoryError, MemoryError)):
+        return True
+    return isinstance(e, RuntimeError) and 'out of memory' in str(e).lower()
+
+def memory_usage(device):
+    """ 显存占用比例 (0~1，CUDA 为上次调用以来的峰值)；CPU 或无法获取时返回 None (CPU 见 process_memory) """
+    try:
+        if device == 'cuda':
+            free, total = torch.cuda.mem_get_info()
+            peak = torch.cuda.max_memory_reserved()
+            torch.cuda.reset_peak_memory_stats()
+            return max(peak / total, 1 - free / total)
+        if device == 'mps':
+            return torch.mps.driver_allocated_memory() / torch.mps.recommended_max_memory()
+    except (RuntimeError, AttributeError):
+        pass
+    return None
+
+def process_memory():
+    """ 本进程常驻内存与系统可用内存 (rss, available，字节)，没有 psutil 时返回 None """
+    if not HAS_PSUTIL:
+        return None
+    return psutil.Process().memory_info().rss, psutil.virtual_memory().available
+
+def release_memory(device):
+    """ OOM 后释放缓存的显存 """
+    if device == 'cuda':
+        torch.cuda.empty_cache()
+    elif device == 'mps':
+        torch.mps.empty_cache()
+
+class BatchAutotuner:
+    """
+    自适应批量大小: 起步阶段逐级倍增批量并实测吞吐 (切片/秒)，吞吐不再明显提升或内存余量不足时停在最优值；
+    之后持续监测显存占用，超出预算或 OOM 时减半并下调上限。指定固定 batch_size 时只保留 OOM 回退
+    """
+    def __init__(self, batch_size=None, device='cpu', max_size=AUTO_BATCH_MAX, budget=MEMORY_BUDGET):
+        self.adaptive = batch_size is None
+        self.size = batch_size or AUTO_BATCH_INITIAL
+        self.max_size = max(max_size, self.size)
+        self.device = device
+        self.budget = budget
+        self.settled = not self.adaptive
+        self.throughput = {} # 批量大小 -> 实测吞吐 (切片/秒)
+        self.tiles = 0
+        self.seconds = 0.0
+        self.oom_count = 0
+        self._samples = []
+        self._warm = set()
+        self._events = []
+        self._lock = threading.Lock()
+        # CPU: 以模型加载后的常驻内存为基线，统计推理批次带来的内存增长
+        mem = process_memory() if device == 'cpu' else None
+        self._rss_base = self._rss_peak = mem[0] if mem else None
+
+    def record(self, n, seconds):
+        """ 记录一个批次的推理耗时，按吞吐与内存余量调整后续批量大小 """
+        with self._lock:
+            self.tiles += n
+            self.seconds += seconds
+            usage = memory_usage(self.device)
+            if self._rss_base is not None:
+                self._rss_peak = max(self._rss_peak, process_memory()[0])
+            # 显存是独占资源，超出预算时主动收缩；CPU 内存与其他程序共享，只用于限制增长
+            if usage is not None and usage > self.budget and self.device != 'cpu' and self.size > 1:
+                self._shrink(self.size, 'memory')
+                return
+            if self.settled or n != self.size:
+                return # 队列中残留的旧尺寸批次/影像末尾的不完整批次不参与测量
+            if self.size not in self._warm:
+                self._warm.add(self.size) # 新尺寸的首批包含算法选择与内存分配，不计入
+                return
+            self._samples.append(seconds)
+            if len(self._samples) < AUTO_BATCH_PROBE:
+                return
+            self.throughput[self.size] = self.size * len(self._samples) / sum(self._samples)
+            self._samples = []
+            previous = self.throughput.get(self.size // 2)
+            improved = previous is None or self.throughput[self.size] > previous * AUTO_BATCH_GAIN
+            if improved and self._has_room(usage) and self.size * 2 <= self.max_size:
+                self.size *= 2
+            else:
+                self.size = max(self.throughput, key=self.throughput.get)
+                self.settled = True
+                self._events.append(('settled', self.size, self.throughput[self.size]))
+
+    def _has_room(self, usage):
+        """ 批量翻倍前的内存余量检查 """
+        if self._rss_base is not None:
+            # CPU: 批量翻倍约再增加一份当前批量带来的内存增长，要求不超过系统可用内存的预算比例 (与其他程序的占用无关)
+            growth = self._rss_peak - self._rss_base
+            return growth < process_memory()[1] * self.budget
+        return usage is None or usage < self.budget / 2 # 显存: 批量翻倍前要求当前占用不超过预算的一半
+
+    def on_oom(self, n):
+        """ n 张切片的批次 OOM: 批量减半并下调上限，之后不再增长到该尺寸 """
+        with self._lock:
+            self.oom_count += 1
+            self._shrink(n, 'oom')
+        release_memory(self.device)
+
+    def _shrink(self, n, reason):
+        limit = max(1, min(self.max_size, n // 2))
+        if limit == self.max_size and self.settled:
+            return # 同一批次拆分后的重复 OOM
+        self.max_size = limit
+        self.size = min(self.size, self.max_size)
+        if not self.settled:
+            measured = [size for size in self.throughput if size <= self.max_size]
+            if measured:
+                self.size = max(measured, key=self.throughput.get)
+            self.settled = True
+        self._events.append((reason, self.size, None))
+
+    def drain_events(self):
+        """ 取出调整事件 [(原因 'settled'/'memory'/'oom', 批量大小, 吞吐)]，供调用方输出日志 """
+        with self._lock:
+            events, self._events = self._events, []
+        return events
+
+    def summary(self):
+        """ 本次运行的批量大小与实测吞吐 (写入任务清单) """
+        return {
+            'batch_size': self.size,
+            'adaptive': self.adaptive,
+            'tiles_per_sec': round(self.tiles / self.seconds, 2) if self.seconds else None,
+            'probed': {str(size): round(tps, 2) for size, tps in self.throughput.items()},
+            'oom': self.oom_count,
+        }
+
+def tuned_batches(tiles, tuner):
+    """ 按调参器的当前批量大小切分切片列表 (批量大小可在运行中变化) """
+    start = 0
+    while start < len(tiles):
+        batch = tiles[start:start + tuner.size]
+        start += len(batch)
+        yield batch
+
+def predict_tuned(model, crops, tuner, batcher=None, measure=True, **kwargs):
+    """ 批量推理并向调参器汇报耗时；OOM 时拆成两半重试，单张切片仍 OOM 才抛出 """
+    start = time.perf_counter()
+    try:
+        results = predict_crops(model, crops, batcher, **kwargs)
+    except Exception as e:
+        if not is_oom_error(e) or len(crops) == 1:
+            raise
+        tuner.on_oom(len(crops))
+        half = len(crops) // 2
+        return (predict_tuned(model, crops[:half], tuner, batcher, measure, **kwargs)
+                + predict_tuned(model, crops[half:], tuner, batcher, measure, **kwargs))
+    if measure:
+        tuner.record(len(crops), time.perf_counter() - start)
+    return results
+
+def detect_device():
+    """ 自动选择推理设备: MPS (Apple Silicon) > CUDA > CPU """
+    if torch.backends.mps.is_available():
+        return 'mps'
+    if torch.cuda.is_available():
+        return 'cuda'
+    return 'cpu'
+
+# 模型池常驻内存上限 (按参数字节数估算)
+MODEL_POOL_BUDGET = 2 * 1024 ** 3
+
+class ModelPool:
+    """ 进程级模型池：按 (权重路径, 设备, 文件大小与修改时间) 缓存已加载并预热的模型，超出内存预算时按 LRU 淘汰；
+    权重文件在磁盘上被替换后重新加载 """
+
+    def __init__(self, budget_bytes=MODEL_POOL_BUDGET, log=None):
+        self.budget_bytes = budget_bytes
+        self.log = log # 后台预加载失败等消息的回调 (None 时不输出，正式运行时加载失败仍会报告)
+        self._models = OrderedDict() # (path, device, stamp) -> (model, nbytes)
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    @staticmethod
+    def _model_bytes(model):
+        if isinstance(model.model, torch.nn.Module):
+            return sum(p.numel() * p.element_size() for p in model.model.parameters())
+        return _path_bytes(model.model) # 导出模型 (ONNX/OpenVINO) 按文件大小估算
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is None:
+                return None
+            self._models.move_to_end(key)
+            return entry[0]
+
+    def get(self, model_path, device, warmup_size=640):
+        """ 返回 (model, cached)。未缓存时加载模型并做一次空推理预热 """
+        stamp = file_stamp(model_path)
+        key = (model_path, device, tuple(stamp) if stamp else None)
+        model = self._lookup(key)
+        if model is not None:
+            return model, True
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        # 同一模型只加载一次 (例如后台预加载尚未完成时)
+        with key_lock:
+            model = self._lookup(key)
+            if model is not None:
+                return model, True
+
+            model = YOLO(model_path)
+            # 预热: 首次推理会初始化 predictor / 融合卷积层 / 分配显存
+            dummy = np.zeros((warmup_size, warmup_size, 3), dtype=np.uint8)
+            model.predict(dummy, save=False, verbose=False, device=device)
+
+            with self._lock:
+                # 同一路径的旧版本权重不再使用，直接释放
+                for stale in [k for k in self._models if k[:2] == key[:2]]:
+                    del self._models[stale]
+                    self._key_locks.pop(stale, None)
+                self._models[key] = (model, self._model_bytes(model))
+                self._evict()
+        return model, False
+
+    def preload(self, model_path, device, log=None):
+        """ 在后台线程中预加载模型；log 为本次预加载的消息回调 (默认使用模型池的 log) """
+        thread = threading.Thread(target=self._preload, args=(model_path, device, log or self.log), daemon=True)
+        thread.start()
+        return thread
+
+    def _preload(self, model_path, device, log):
+        try:
+            self.get(model_path, device)
+        except Exception as e:
+            if log:
+                log(f"⚠️ 模型预加载失败: {os.path.basename(model_path)}: {e}")
+
+    def _evict(self):
+        # 至少保留最近使用的一个模型
+        total = sum(nbytes for _, nbytes in self._models.values())
+        while total > self.budget_bytes and len(self._models) > 1:
+            _, (model, nbytes) = self._models.popitem(last=False)
+            total -= nbytes
+            del model
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+MODEL_POOL = ModelPool()
+
+def _path_bytes(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(f) for f in glob.glob(os.path.join(path, '*')) if os.path.isfile(f))
+    return os.path.getsize(path) if os.path.isfile(path) else 0
+
+# --- CPU 推理后端 (ONNX Runtime / OpenVINO) ---
+BACKENDS = {
+    'auto': '自动',
+    'torch': 'PyTorch',
+    'onnx': 'ONNX Runtime',
+    'openvino': 'OpenVINO',
+}
+BACKEND_MODULES = {'onnx': 'onnxruntime', 'openvino': 'openvino'}
+CALIBRATION_TILES = 16 # INT8 校准使用的切片数
+PARITY_TILES = 4 # 一致性校验使用的样本切片数
+PARITY_MIN_RECALL = 0.9 # 导出模型至少要找回的 torch 检测框比例
+PARITY_IOU = 0.8
+PARITY_TOP_K = 100
+
+def available_backends():
+    """ 当前环境可用的推理后端 """
+    return ['torch'] + [name for name, module in BACKEND_MODULES.items() if importlib.util.find_spec(module)]
+
+def resolve_backend(backend, device):
+    """ 解析 'auto': GPU/MPS 上使用 torch，纯 CPU 时依次优先 OpenVINO > ONNX Runtime > torch """
+    available = available_backends()
+    if backend == 'auto':
+        if device != 'cpu':
+            return 'torch'
+        return next((name for name in ('openvino', 'onnx') if name in available), 'torch')
+    if backend not in available:
+        raise RuntimeError(f"推理后端 {BACKENDS.get(backend, backend)} 不可用，请安装 {BACKEND_MODULES.get(backend, backend)}")
+    return backend
+
+def export_path(model_path, backend, int8=False):
+    """ 导出模型的缓存路径 (与权重文件同目录，与 ultralytics 导出命名一致) """
+    stem = os.path.splitext(model_path)[0] + ('_int8' if int8 else '')
+    return stem + '.onnx' if backend == 'onnx' else stem + '_openvino_model'
+
+def _is_fresh(path, source):
+    """ 导出产物存在且不早于源文件 (权重更新后自动重新导出) """
+    return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(source)
+
+def calibration_batches(image_paths, slice_size, batcher, limit=CALIBRATION_TILES, bands=None):
+    """ 从待处理影像中均匀抽取非平坦切片，返回 (切片列表, 与推理一致预处理后的 NCHW 数组列表)；
+    校准数组只取 batcher 能接收的 uint8 切片 (非 8 位影像写入 uint8 缓冲区会溢出回绕)，切片列表全部保留用于一致性校验 """
+    per_image = max(1, math.ceil(limit / max(1, len(image_paths))))
+    crops = []
+    for path in image_paths:
+        with rasterio.open(path) as src:
+            tiles = TilePlan(src.width, src.height, slice_size).tiles
+            step = max(1, len(tiles) // per_image)
+            for tile in tiles[::step][:per_image]:
+                crop = read_rgb(src, window=Window(*tile), bands=bands)
+                if not is_flat_tile(crop):
+                    crops.append(crop)
+        if len(crops) >= limit:
+            break
+    crops = crops[:limit]
+    return crops, [batcher([crop]).cpu().numpy().copy() for crop in crops if batcher.accepts([crop])]
+
+def _quantize_onnx(fp32_path, int8_path, batches, head):
+    """ ONNX Runtime 静态 INT8 量化 (QDQ)，检测头保持 FP32 以保证框坐标精度 """
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    graph = onnx.load(fp32_path).graph
+    input_name = graph.input[0].name
+
+    class _Reader(CalibrationDataReader):
+        def __init__(self):
+            self._feeds = iter({input_name: batch} for batch in batches)
+
+        def get_next(self):
+            return next(self._feeds, None)
+
+    head_nodes = [node.name for node in graph.node if node.name.startswith(f'/model.{head}/')]
+    quantize_static(fp32_path, int8_path, _Reader(), quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, nodes_to_exclude=head_nodes)
+
+def _quantize_openvino(fp32_dir, int8_dir, batches, head):
+    """ OpenVINO (NNCF) 训练后 INT8 量化，检测头保持 FP32 """
+    import nncf
+    import openvino as ov
+
+    xml_path = glob.glob(os.path.join(fp32_dir, '*.xml'))[0]
+    model = ov.Core().read_model(xml_path)
+    quantized = nncf.quantize(model, nncf.Dataset(batches), preset=nncf.QuantizationPreset.MIXED,
+                              subset_size=len(batches),
+                              ignored_scope=nncf.IgnoredScope(patterns=[rf'.*model\.{head}/.*'], validate=False))
+    os.makedirs(int8_dir, exist_ok=True)
+    ov.save_model(quantized, os.path.join(int8_dir, os.path.basename(xml_path)))
+    shutil.copy(os.path.join(fp32_dir, 'metadata.yaml'), int8_dir) # ultralytics 依赖元数据识别任务/类别
+
+def export_model(model_path, backend, imgsz, int8=False, calibration=None, log=print):
+    """ 导出 (或复用已缓存的) ONNX / OpenVINO 模型并返回路径；INT8 量化失败时退回 FP32 导出
+    calibration: 返回 INT8 校准数组列表的函数，只在需要重新量化时调用 """
+    fp32_path = export_path(model_path, backend)
+    if _is_fresh(fp32_path, model_path):
+        log(f"♻️ 复用已导出的 {BACKENDS[backend]} 模型: {os.path.basename(fp32_path)}")
+    else:
+        log(f"📦 正在导出 {BACKENDS[backend]} 模型 (仅首次，结果缓存在权重目录)...")
+        YOLO(model_path).export(format=backend, dynamic=True, imgsz=imgsz)
+    if not int8:
+        return fp32_path
+
+    int8_path = export_path(model_path, backend, int8=True)
+    if _is_fresh(int8_path, fp32_path):
+        return int8_path
+    calibration = calibration() if calibration else None
+    if not calibration:
+        log("⚠️ 没有可用于 INT8 校准的 8 位切片，使用 FP32 模型")
+        return fp32_path
+    log(f"🔧 正在进行 INT8 量化 (校准切片 {len(calibration)} 张)...")
+    head = len(YOLO(model_path).model.model) - 1 # 检测头 (Detect/OBB) 为最后一层
+    try:
+        if backend == 'onnx':
+            _quantize_onnx(fp32_path, int8_path, calibration, head)
+        else:
+            _quantize_openvino(fp32_path, int8_path, calibration, head)
+    except Exception as e:
+        log(f"⚠️ INT8 量化失败，使用 FP32 模型: {e}")
+        return fp32_path
+    return int8_path
+
+def _result_boxes(result, top_k=None):
+    boxes = result.obb if result.obb is not None else result.boxes
+    if boxes is None or len(boxes) == 0:
+        return torch.empty((0, 4)), torch.empty(0)
+    order = boxes.conf.argsort(descending=True)[:top_k]
+    return boxes.xyxy[order].float().cpu(), boxes.cls[order].cpu()
+
+def backend_parity(reference, candidate, crops, batcher=None, conf=RAW_CONF, **kwargs):
+    """ 一致性校验: 在样本切片上比较两个模型的输出，返回参考模型前 K 个检测框被找回 (同类且 IoU 达标) 的比例
+    两个模型使用同一 batcher 预处理，保证输入完全一致 (导出模型的 letterbox 规则与 torch 不同)。
+    在低置信度阈值下比较 (用户阈值下可能一个框都没有)，候选模型阈值再放宽一半，避免阈值附近的框因量化误差被误判为丢失；
+    参考模型在样本上没有任何检测框时无法判断，返回 None """
+    matched = total = 0
+    for ref, cand in zip(predict_crops(reference, crops, batcher, conf=conf, **kwargs),
+                         predict_crops(candidate, crops, batcher, conf=conf / 2, **kwargs)):
+        ref_boxes, ref_cls = _result_boxes(ref, PARITY_TOP_K)
+        cand_boxes, cand_cls = _result_boxes(cand)
+        total += len(ref_boxes)
+        if len(ref_boxes) and len(cand_boxes):
+            ious = box_iou(ref_boxes, cand_boxes)
+            ious[ref_cls[:, None] != cand_cls[None, :]] = 0
+            matched += int((ious.max(dim=1).values >= PARITY_IOU).sum())
+    return matched / total if total else None
+
+# --- 结果缓存 ---
+# 以影像内容哈希 + 模型权重哈希 + 推理/切片参数为键，未变化的影像重跑时直接复用上次的输出
+RESULT_CACHE_DIRNAME = '.aigis_cache'
+RESULT_CACHE_VERSION = 1
+
+def file_digest(path, chunk_size=4 * 1024 * 1024):
+    """ 计算文件内容哈希 (blake2b) """
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class ResultCache:
+    """ 输出目录下的持久化结果缓存；文件大小+修改时间未变时跳过重新计算哈希 """
+    def __init__(self, output_dir):
+        self.root = os.path.join(output_dir, RESULT_CACHE_DIRNAME)
+        os.makedirs(self.root, exist_ok=True)
+        self._index_path = os.path.join(self.root, 'digests.json')
+        self._lock = threading.Lock()
+        try:
+            with open(self._index_path, 'r', encoding='utf-8') as f:
+                self._digests = json.load(f)
+        except (OSError, ValueError):
+            self._digests = {}
+
+    def digest(self, path):
+        """ 文件内容哈希 (size+mtime 快速路径) """
+        if not os.path.exists(path):
+            return os.path.basename(path) # 例如尚未下载的官方模型名
+        st = os.stat(path)
+        abs_path = os.path.abspath(path)
+        with self._lock:
+            entry = self._digests.get(abs_path)
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            return entry[2]
+        digest = file_digest(path)
+        with self._lock:
+            self._digests[abs_path] = [st.st_size, st.st_mtime_ns, digest]
+        return digest
+
+    def save_index(self):
+        with self._lock:
+            data = dict(self._digests)
+        tmp_path = self._index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self._index_path)
+
+    def key(self, image_path, model_digest, params):
+        payload = json.dumps({'version': RESULT_CACHE_VERSION, 'image': self.digest(image_path),
+                              'model': model_digest, 'params': params}, sort_keys=True)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=20).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.root, f"{key}.json")
+
+    def get(self, key):
+        """ 命中且输出文件仍然存在时返回缓存记录，否则返回 None """
+        try:
+            with open(self._entry_path(key), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # 输出文件被删除或被其他参数的运行覆盖时视为失效
+        if entry.get('stamps') != [self._stamp(p) for p in entry.get('outputs', [])]:
+            return None
+        return entry
+
+    @staticmethod
+    def _stamp(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return [st.st_size, st.st_mtime_ns]
+
+    def put(self, key, entry):
+        entry['stamps'] = [self._stamp(p) for p in entry['outputs']]
+        path = self._entry_path(key)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+# --- 断点续跑 ---
+# 输出目录下的追加式任务清单 (JSON Lines) + 大图切片级检查点，任务中断或崩溃后可从断点继续
+JOB_MANIFEST_NAME = 'job_manifest.jsonl'
+JOB_DIRNAME = '.aigis_job'
+CHECKPOINT_INTERVAL = 60 # 大图切片结果的检查点间隔 (秒)
+
+def file_stamp(path):
+    """ 文件大小 + 修改时间，用于判断输入/输出是否变化 """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+class JobManifest:
+    """ 记录每幅影像的状态、输出与耗时；resume=True 时读取已有清单，跳过已完成的影像 """
+    def __init__(self, output_dir, signature, resume=False):
+        self.path = os.path.join(output_dir, JOB_MANIFEST_NAME)
+        self.job_dir = os.path.join(output_dir, JOB_DIRNAME)
+        os.makedirs(self.job_dir, exist_ok=True)
+        self.signature = signature
+        self._lock = threading.Lock()
+        self._last_checkpoint = {}
+        self.completed = self._load() if resume else {}
+        self._file = open(self.path, 'a' if resume else 'w', encoding='utf-8')
+        self.record('job', signature=signature, resume=resume)
+
+    def _load(self):
+        completed = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except OSError:
+            return completed
+        for line in lines:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue # 崩溃时可能留下写了一半的最后一行
+            if rec.get('event') == 'job' and rec.get('signature') != self.signature:
+                completed.clear() # 参数变化后之前的输出已被覆盖
+            elif rec.get('event') == 'done':
+                completed[rec['image']] = rec
+        return completed
+
+    def record(self, event, **fields):
+        line = json.dumps({'event': event, 'time': time.time(), **fields}, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def _job_file(self, image_path, suffix):
+        base_name = os.path.splitext(os.path.basename(image_path))[0]
+        return os.path.join(self.job_dir, f"{base_name}{suffix}")
+
+    def completed_result(self, image_path):
+        """ 影像已完成且输入/输出均未变化时返回 (vis_path, stats, detections)，否则返回 None；未输出可视化图时 vis_path 为空 """
+        rec = self.completed.get(image_path)
+        if rec is None or rec.get('image_stamp') != file_stamp(image_path):
+            return None
+        if not all(os.path.exists(p) for p in rec['outputs']):
+            return None
+        try:
+            with open(rec['result'], 'r', encoding='utf-8') as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return rec.get('vis', ''), result['stats'], DetectionTable.from_json(result['detections'])
+
+    def finish(self, image_path, outputs, stats, detections, elapsed, vis_path='', **timing):
+        result_path = self._job_file(image_path, '_result.json')
+        with open(result_path, 'w', encoding='utf-8') as f:
+            json.dump({'stats': stats, 'detections': detections.to_json()}, f, ensure_ascii=False)
+        self.record('done', image=image_path, image_stamp=file_stamp(image_path),
+                    outputs=outputs, vis=vis_path, result=result_path, count=len(detections), elapsed=round(elapsed, 3),
+                    **{key: round(value, 3) for key, value in timing.items()})
+        try:
+            os.remove(self._job_file(image_path, '_checkpoint.npz'))
+        except OSError:
+            pass
+
+    def load_checkpoint(self, image_path):
+        """ 读取大图的切片级检查点 (参数与影像均未变化时)，返回 acc 格式的部分结果 """
+        path = self._job_file(image_path, '_checkpoint.npz')
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if str(data['signature']) != self.signature or data['image_stamp'].tolist() != file_stamp(image_path):
+                    return None
+                acc = {key: [] for key in ('polygons', 'scores', 'classes', 'tiles')}
+                if len(data['scores']) > 0:
+                    acc['polygons'].append(data['polygons'])
+                    acc['scores'].append(data['scores'])
+                    acc['classes'].append(data['classes'].astype(np.int64))
+                    acc['tiles'].append(data['tiles'].astype(np.int64))
+                acc['done'] = [tuple(t) for t in data['done'].tolist()]
+        except (OSError, KeyError, ValueError):
+            return None
+        return acc
+
+    def save_checkpoint(self, image_path, acc, force=False):
+        """ 按时间间隔保存已完成切片的结果；force=True 时立即保存 (任务终止时) """
+        now = time.time()
+        last = self._last_checkpoint.setdefault(image_path, now)
+        if not acc.get('done') or (not force and now - last < CHECKPOINT_INTERVAL):
+            return
+        self._last_checkpoint[image_path] = now
+        path = self._job_file(image_path, '_checkpoint.npz')
+        tmp_path = path + '.tmp.npz'
+        arrays = {key: np.concatenate(acc[key]) if acc[key] else np.empty(0) for key in ('polygons', 'scores', 'classes', 'tiles')}
+        np.savez(tmp_path, **arrays, done=np.asarray(acc['done'], dtype=np.int64).reshape(-1, 4),
+                 signature=np.array(self.signature), image_stamp=np.asarray(file_stamp(image_path), dtype=np.int64))
+        os.replace(tmp_path, path)
+        self.record('checkpoint', image=image_path, tiles_done=len(acc['done']))
+
+# --- 多进程检测 (纯 CPU 主机) ---
+# 单次 predict 在小批量上无法占满多核 CPU，按影像/切片组分发到多个进程，每个进程独立加载模型
+_worker_state = {}
+
+def resolve_process_layout(num_workers=None, threads_per_worker=None):
+    """ 计算进程数与每进程 torch 线程数，未指定时按 CPU 核数自动分配 """
+    cpus = os.cpu_count() or 1
+    if not threads_per_worker:
+        threads_per_worker = max(1, min(4, cpus // (num_workers or 1)))
+    if not num_workers:
+        num_workers = max(1, cpus // threads_per_worker)
+    return num_workers, threads_per_worker
+
+def init_detect_worker(model_path, device, threads, tile_size=None, pad_mode='constant', batch_size=None, bands=None):
+    """ 子进程初始化: 限定 torch 线程数并加载 (预热) 模型；tile_size 不为空时启用固定尺寸张量批处理
+    batch_size 为 None 时各进程独立自动调节批量大小 """
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(1)
+    model, _ = MODEL_POOL.get(model_path, device)
+    _worker_state['model'] = model
+    _worker_state['device'] = device
+    batcher = TileTensorBatcher(tile_size, device, pad_mode) if tile_size else None
+    _worker_state['batcher'] = batcher if batcher is not None and batcher.matches(model) else None
+    _worker_state['tuner'] = BatchAutotuner(batch_size, device)
+    _worker_state['bands'] = bands
+
+def _worker_part(acc, skipped=0, infer=None):
+    """ 子进程结果: 原始结果数组 + 类别/任务信息 + 本进程的批量调节状态
+    infer: 推理时间范围 (开始, 结束)，没有切片进入推理时为 None """
+    model = _worker_state['model']
+    part = {key: np.concatenate(arrays) if arrays else np.empty(0) for key, arrays in acc.items()}
+    part['names'] = model.names
+    part['task'] = model.task
+    part['skipped'] = skipped
+    part['infer'] = infer
+    part['tuning'] = dict(_worker_state['tuner'].summary(), worker=os.getpid())
+    return part
+
+def model_info_task():
+    """ 子进程任务: 返回模型的类别表与任务类型 (没有切片需要推理的影像直接汇总时使用) """
+    model = _worker_state['model']
+    return model.names, model.task
+
+def detect_worker_task(image_path, tiles, conf, iou, skip_flat=False, max_det=300, factor=1):
+    """ 子进程任务: 检测大图的一组切片，返回原始结果数组 (拼接合并由主进程完成)
+    factor > 1 时为粗扫描: 切片按 factor 降采样读取，结果坐标放大回原始分辨率 """
+    model = _worker_state['model']
+    device = _worker_state['device']
+    tuner = _worker_state['tuner']
+    bands = _worker_state['bands']
+    acc = {'polygons': [], 'scores': [], 'classes': [], 'tiles': []}
+    skipped = 0
+    infer = None
+    with rasterio.open(image_path) as src:
+        for batch in tuned_batches(tiles, tuner):
+            crops = [read_rgb(src, window=Window(*tile), out_shape=decimated_shape(tile, factor), bands=bands) for tile in batch]
+            if skip_flat:
+                kept = [(crop, tile) for crop, tile in zip(crops, batch) if not is_flat_tile(crop)]
+                skipped += len(batch) - len(kept)
+                if not kept:
+                    continue
+                crops, batch = [c for c, _ in kept], [t for _, t in kept]
+            start = time.time()
+            results = predict_tuned(model, crops, tuner, _worker_state['batcher'], measure=(factor == 1),
+                                    conf=conf, iou=iou, max_det=max_det, device=device)
+            infer = (infer[0] if infer else start, time.time())
+            for r, tile in zip(results, batch):
+                collect_result(r, tile[0], tile[1], tile, acc, scale=factor)
+    return _worker_part(acc, skipped, infer)
+
+def detect_chips_task(image_paths, conf, iou, max_det=300):
+    """ 子进程任务: 一组同尺寸小图整图批量推理，按输入顺序返回每幅影像的结果 """
+    model = _worker_state['model']
+    tuner = _worker_state['tuner']
+    images = []
+    for path in image_paths:
+        with rasterio.open(path) as src:
+            images.append(read_rgb(src, bands=_worker_state['bands']))
+    parts = []
+    for batch in tuned_batches(images, tuner):
+        start = time.time()
+        results = predict_tuned(model, batch, tuner, conf=conf, iou=iou, max_det=max_det, device=_worker_state['device'])
+        infer = (start, time.time())
+        for r in results:
+            acc = {'polygons': [], 'scores': [], 'classes': [], 'tiles': []}
+            collect_result(r, 0, 0, None, acc)
+            parts.append(_worker_part(acc, infer=infer))
+    return parts
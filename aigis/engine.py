@@ -0,0 +1,978 @@
+"""
+AI GIS 批量检测引擎: 读取 -> 推理 -> 后处理/写出 流水线 (线程模式) 与多进程模式
+"""
+import os
+import time
+import math
+import json
+import hashlib
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeoutError
+
+import rasterio
+from rasterio.transform import Affine
+import numpy as np
+import geopandas as gpd
+import cv2
+
+from .core import (
+    VIS_SUFFIXES, MERGE_METHODS, RAW_CONF, RAW_IOU, RAW_MAX_DET, MODEL_POOL,
+    read_rgb, preview_shape, write_preview, polygons_to_geometries, TilePlan, valid_mask_overview, filter_nodata_tiles,
+    refine_detections, check_stride, DetectionTable, detection_stats, raw_sidecar_path, save_raw_predictions,
+    TileReaderPool, OutputWriterPool, VECTOR_FORMATS, DetectionLayerWriter, collect_result, detect_device, ResultCache, JobManifest, file_stamp,
+    COARSE_FACTOR, coarse_windows, select_tiles_by_regions, polygons_to_bboxes,
+    TileTensorBatcher, model_input_size,
+    AUTO_BATCH_INITIAL, BatchAutotuner, tuned_batches, predict_tuned,
+    BACKENDS, PARITY_TILES, PARITY_MIN_RECALL, resolve_backend, calibration_batches, export_model, backend_parity,
+    resolve_process_layout, init_detect_worker, model_info_task, detect_worker_task, detect_chips_task,
+)
+
+# Optional: psutil for system monitoring
+try:
+    import psutil
+    HAS_PSUTIL = True
+except ImportError:
+    HAS_PSUTIL = False
+
+# 已通过一致性校验的导出模型 (路径, 修改时间)，同一进程内不重复校验
+_VERIFIED_EXPORTS = set()
+
+# 流水线: 读取线程池 (预取切片批次) -> 推理 (本线程) -> 后处理/写出线程，阶段之间使用有界队列实现背压
+class DetectionEngine:
+    """
+    批量检测引擎 (无界面依赖)，桌面端 DetectionThread 与命令行共用。
+    通过回调输出日志/进度/结果: on_log(msg), on_progress(percent, eta, usage),
+    on_result(image_path, vis_path, stats, detections), on_finish(msg)；detections 为 DetectionTable，未输出可视化图时 vis_path 为空字符串
+    """
+    def __init__(self, model_path, image_paths, output_dir, conf=0.25, iou=0.45, merge_method='nms',
+                 slice_size=640, stride=500, batch_size=None, reader_workers=2, prefetch_batches=4, write_workers=2,
+                 execution='thread', num_workers=None, threads_per_worker=None, shard_tiles=True,
+                 skip_empty=True, skip_flat=False, use_cache=True, keep_raw=False, resume=False,
+                 coarse_to_fine=False, coarse_factor=COARSE_FACTOR, coarse_conf=None,
+                 tensor_batching=True, pad_mode='constant', backend='auto', int8=False, bands=None, vector_format='shp',
+                 vis_format='jpeg', on_log=None, on_progress=None, on_result=None, on_finish=None):
+        self.model_path = model_path
+        self.image_paths = image_paths
+        self.output_dir = output_dir
+        self.conf = conf
+        self.iou = iou
+        self.merge_method = merge_method
+        check_stride(slice_size, stride)
+        self.slice_size = slice_size
+        self.stride = stride # 最大步长: 相邻切片至少重叠 slice_size - stride，实际步长由切片规划按影像尺寸确定
+        self.batch_size = batch_size # 批量大小；None 时按实测吞吐与显存余量自动调节
+        self._tuner = None
+        self._worker_tuning = {} # 多进程模式: 进程号 -> 批量调节结果
+        self.reader_workers = reader_workers
+        self.prefetch_batches = prefetch_batches
+        self.write_workers = write_workers # 后台写出线程数 (Shapefile / 可视化图编码写盘与推理并行)
+        self._outputs = None
+        # 执行模式: 'thread' 单模型流水线; 'process' 多进程 (适合纯 CPU 服务器)
+        self.execution = execution
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker
+        self.shard_tiles = shard_tiles
+        self.skip_empty = skip_empty # 推理前跳过无数据 (nodata / 掩膜) 的切片
+        self.skip_flat = skip_flat # 可选: 跳过纹理均一的切片 (抽样方差判断，平静水面上的单个小目标可能被一并跳过)
+        self.use_cache = use_cache # 复用未变化影像的历史结果
+        self.keep_raw = keep_raw # 保存原始预测旁车文件 (可选)，支持事后快速调整阈值；推理阶段阈值放宽，开销更大
+        # 保存原始预测时推理阶段使用宽松阈值，最终阈值在合并阶段统一应用
+        self.predict_conf = min(conf, RAW_CONF) if keep_raw else conf
+        self.predict_iou = max(iou, RAW_IOU) if keep_raw else iou
+        self.predict_max_det = RAW_MAX_DET if keep_raw else 300
+        self.pending_paths = image_paths # 缓存未命中、需要实际推理的影像
+        self._cache = None
+        self._cache_keys = {}
+        self.resume = resume # 断点续跑: 跳过任务清单中已完成的影像，大图从切片检查点继续
+        self._manifest = None
+        # 粗到细: 先在降采样影像上找候选区域，只对候选区域内的切片做全分辨率推理 (适合稀疏目标)
+        self.coarse_to_fine = coarse_to_fine
+        self.coarse_factor = coarse_factor
+        self.coarse_conf = self.conf if coarse_conf is None else coarse_conf # 默认使用用户设定的阈值，而非保存原始预测时放宽的阈值
+        # 切片填充到固定尺寸后以张量批量送入模型 (复用缓冲区，绕过逐张预处理)
+        self.tensor_batching = tensor_batching
+        self.pad_mode = pad_mode
+        # 推理后端: 'auto' / 'torch' / 'onnx' / 'openvino'，导出模型缓存在权重文件旁，int8 启用训练后量化
+        self.backend = backend
+        self.int8 = int8
+        self.bands = bands # 多光谱影像 R, G, B 对应的源波段 (从 1 开始)，None 时按颜色解释/前三个波段
+        # 矢量输出: 'shp' 每幅影像一个 Shapefile; 'gpkg' / 'fgb' 整个任务汇总到一个带空间索引的图层
+        self.vector_format = vector_format
+        self._layer = None
+        self._replayed = [] # 缓存命中/续跑回放的影像 (image_path, DetectionTable)，汇总图层中缺失时补写
+        # 可视化输出: 'jpeg' / 'cog' / 'png' / 'none' (见 VIS_FORMATS)
+        self.vis_format = vis_format
+        self.on_log = on_log
+        self.on_progress = on_progress
+        self.on_result = on_result
+        self.on_finish = on_finish
+        self.is_interrupted = False
+        self.status = None # 运行结果: 'finished' / 'stopped' (已终止) / 'failed' (部分影像写出失败) / 'error'
+        self._halt = threading.Event()
+        self._writer_error = None
+
+    def _log(self, msg):
+        if self.on_log:
+            self.on_log(msg)
+
+    def _progress(self, percent, eta, usage):
+        if self.on_progress:
+            self.on_progress(percent, eta, usage)
+
+    def _result(self, image_path, vis_path, stats, detections):
+        if self.on_result:
+            self.on_result(image_path, vis_path, stats, detections)
+
+    def _finish(self, msg):
+        if self.on_finish:
+            self.on_finish(msg)
+
+    def stop(self):
+        self.is_interrupted = True
+
+    def _should_stop(self):
+        return self.is_interrupted or self._halt.is_set()
+
+    def _put(self, q, item):
+        """ 带背压的入队：队列满时阻塞，直到有空位或任务被终止 """
+        while not self._should_stop():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        """ 出队：任务被终止时返回 None """
+        while not self._should_stop():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def _emit_progress(self, idx, total_files, processed_count, total_slices, file_start_time):
+        elapsed = time.time() - file_start_time
+        if processed_count > 0:
+            avg_time_per_slice = elapsed / processed_count
+            remaining_slices = total_slices - processed_count
+            eta_seconds = remaining_slices * avg_time_per_slice
+            eta_str = time.strftime("%M:%S", time.gmtime(eta_seconds))
+        else:
+            eta_str = "--:--"
+
+        usage_str = "CPU: ?%"
+        if HAS_PSUTIL:
+            cpu_p = psutil.cpu_percent()
+            mem_p = psutil.virtual_memory().percent
+            usage_str = f"CPU: {cpu_p}% | MEM: {mem_p}%"
+
+        current_file_progress = processed_count / total_slices
+        total_progress = int(((idx + current_file_progress) / total_files) * 100)
+        self._progress(total_progress, f"ETA: {eta_str} (File {idx+1}/{total_files})", usage_str)
+
+    def _plan_image(self, idx, image_path):
+        """ 读取影像元数据并规划切片，返回 (meta, tiles)；小图 tiles 为 None """
+        with rasterio.open(image_path) as src:
+            meta = {
+                'idx': idx, 'path': image_path,
+                'transform': src.transform, 'crs': src.crs,
+                'width': src.width, 'height': src.height,
+                'skipped_nodata': 0, 'resume': None, 'started': time.time(),
+            }
+            w, h = meta['width'], meta['height']
+
+            # --- 智能切片扫描逻辑 ---
+            if h > 1000 or w > 1000:
+                plan = TilePlan(w, h, self.slice_size, self.slice_size - self.stride, src.block_shapes[0][::-1])
+                meta['plan'] = plan
+                tiles = plan.tiles
+                checkpoint = self._manifest.load_checkpoint(image_path) if self.resume else None
+                if checkpoint is not None:
+                    done = set(checkpoint['done'])
+                    tiles = [tile for tile in tiles if tile not in done]
+                    meta['resume'] = checkpoint
+                    self._log(f"⏯️ 从检查点继续: {os.path.basename(image_path)} 已完成 {len(done)} 个切片")
+                if self.skip_empty:
+                    # 依据降采样掩膜剔除无数据切片，连读取都可以省掉
+                    overview = valid_mask_overview(src, bands=self.bands)
+                    if overview is not None:
+                        tiles, meta['skipped_nodata'] = filter_nodata_tiles(tiles, *overview)
+                # 进度/ETA 只计算真正需要处理的切片
+                meta['total_slices'] = max(len(tiles), 1)
+                self._manifest.record('start', image=image_path, tiles=len(tiles))
+                return meta, tiles
+
+        meta['total_slices'] = 0
+        self._manifest.record('start', image=image_path, tiles=0)
+        return meta, None
+
+    def _coarse_pass(self, meta, tiles, tile_queue, reader_pool):
+        """ 线程模式粗扫描: 降采样窗口交给推理线程检测，等待候选区域后筛选切片；任务终止时返回 None """
+        windows = coarse_windows(meta['width'], meta['height'], self.slice_size, self.stride, self.coarse_factor)
+        regions = Future()
+        meta['coarse_acc'] = {'polygons': [], 'scores': [], 'classes': [], 'tiles': []}
+        for batch in tuned_batches(windows, self._tuner):
+            future = reader_pool.submit_tiles(meta['path'], batch, skip_flat=self.skip_flat, factor=self.coarse_factor)
+            if not self._put(tile_queue, ('coarse', meta, future, batch)):
+                return None
+        if not self._put(tile_queue, ('coarse_end', meta, regions)):
+            return None
+        while True:
+            try:
+                boxes = regions.result(timeout=0.2)
+                break
+            except FutureTimeoutError:
+                if self._should_stop():
+                    return None
+        return self._apply_regions(meta, tiles, boxes, len(windows))
+
+    def _apply_regions(self, meta, tiles, boxes, num_windows):
+        """ 只保留与粗扫描候选区域相交的切片，更新进度所用的切片总数 """
+        total = len(tiles)
+        tiles, skipped = select_tiles_by_regions(tiles, boxes, (meta['width'], meta['height']),
+                                                 pad=self.slice_size - self.stride)
+        meta['total_slices'] = max(len(tiles), 1)
+        self._log(f"🔭 粗扫描 ({num_windows} 个 1/{self.coarse_factor} 降采样窗口): {len(boxes)} 个候选目标, "
+                  f"精细推理 {len(tiles)}/{total} 个切片, 跳过 {skipped} 个")
+        return tiles
+
+    def _produce(self, tile_queue, reader_pool):
+        """ 读取阶段：按顺序规划每幅影像的切片批次，提交给读取线程池预取；连续的同尺寸小图合并为一个批次 """
+        chips = []
+
+        def flush_chips():
+            if chips:
+                batch = chips[:]
+                chips.clear()
+                return self._put(tile_queue, ('chips', [m for m, _ in batch], [f for _, f in batch]))
+            return True
+
+        try:
+            for idx, image_path in enumerate(self.pending_paths):
+                if self._should_stop():
+                    break
+
+                meta, tiles = self._plan_image(idx, image_path)
+                if tiles is None:
+                    shape = (meta['width'], meta['height'])
+                    if chips and ((chips[0][0]['width'], chips[0][0]['height']) != shape or len(chips) >= self._tuner.size):
+                        if not flush_chips():
+                            break
+                    chips.append((meta, reader_pool.submit_full(image_path)))
+                    continue
+                if not flush_chips():
+                    break
+                if self.coarse_to_fine:
+                    tiles = self._coarse_pass(meta, tiles, tile_queue, reader_pool)
+                    if tiles is None:
+                        break
+                if not self._put(tile_queue, ('start', meta)):
+                    break
+                for batch in tuned_batches(tiles, self._tuner):
+                    future = reader_pool.submit_tiles(image_path, batch, skip_flat=self.skip_flat)
+                    if not self._put(tile_queue, ('batch', meta, future, batch)):
+                        break
+
+                self._put(tile_queue, ('end', meta))
+            else:
+                flush_chips()
+        except Exception as e:
+            self._put(tile_queue, ('error', e))
+        self._put(tile_queue, None)
+
+    def _consume_results(self, result_queue, model):
+        """ 后处理/写出阶段：解析推理结果，整幅影像结束后拼接合并并写出 """
+        pending = {}
+        try:
+            while True:
+                item = self._get(result_queue)
+                if item is None:
+                    break
+
+                kind, meta = item[0], item[1]
+                acc = pending.setdefault(meta['idx'], self._new_acc(meta))
+                if kind == 'tiles':
+                    for r, tile in zip(item[2], item[3]):
+                        collect_result(r, tile[0], tile[1], tile, acc)
+                    acc['done'].extend(item[3])
+                    self._manifest.save_checkpoint(meta['path'], acc)
+                elif kind == 'full':
+                    collect_result(item[2][0], 0, 0, None, acc)
+                    acc['image'] = item[3]
+                elif kind == 'end':
+                    self._finish_image(meta, pending.pop(meta['idx']), model.names, model.task)
+            if self._should_stop():
+                # 终止时保存未完成大图的切片检查点
+                for acc in pending.values():
+                    self._manifest.save_checkpoint(acc['path'], acc, force=True)
+        except Exception as e:
+            self._writer_error = e
+            self._halt.set()
+
+    @staticmethod
+    def _mark_inference(meta, start, end):
+        """ 记录影像推理的时间范围: 第一个切片进入推理 -> 最后一个切片推理完成 """
+        meta['infer_start'] = min(meta.get('infer_start', start), start)
+        meta['infer_end'] = max(meta.get('infer_end', end), end)
+
+    @staticmethod
+    def _new_acc(meta):
+        """ 单幅影像的结果累加器；断点续跑时预先填入检查点中的结果 """
+        acc = {'polygons': [], 'scores': [], 'classes': [], 'tiles': [], 'image': None,
+               'done': [], 'path': meta['path']}
+        if meta['resume'] is not None:
+            acc.update(meta['resume'])
+        return acc
+
+    def _finish_image(self, meta, acc, names, task):
+        """ 单幅影像的切片结果拼接合并；Shapefile / 可视化图等结果文件交给后台写出线程池 """
+        image_path = meta['path']
+        w, h = meta['width'], meta['height']
+        base_name = os.path.splitext(os.path.basename(image_path))[0]
+
+        # 整幅影像的结果拼成连续数组
+        if acc['polygons']:
+            final_polygons = np.concatenate(acc['polygons']).astype(np.float32)
+            final_scores = np.concatenate(acc['scores']).astype(np.float32)
+            final_classes = np.concatenate(acc['classes'])
+        else:
+            final_polygons = np.empty((0, 4, 2), dtype=np.float32)
+            final_scores = np.empty(0, dtype=np.float32)
+            final_classes = np.empty(0, dtype=np.int64)
+
+        tiled = bool(meta['total_slices'])
+        final_tiles = np.concatenate(acc['tiles']) if acc['tiles'] else np.empty((0, 4), dtype=np.int64)
+        raw = (final_polygons, final_scores, final_classes, final_tiles) if self.keep_raw else None
+
+        # --- 置信度过滤 + 切片边界拼接 + 跨切片合并重叠区域的重复目标 ---
+        raw_count = len(final_polygons)
+        final_polygons, final_scores, final_classes, stitched = refine_detections(
+            final_polygons, final_scores, final_classes, final_tiles, (w, h),
+            self.conf, self.iou, self.merge_method, rotated=(task == 'obb'), tiled=tiled, renms=self.keep_raw)
+        if stitched:
+            self._log(f"✂️ 切片边界拼接: 去除/合并 {stitched} 个截断目标")
+        if tiled and raw_count > 1:
+            self._log(f"🧩 跨切片合并 ({MERGE_METHODS[self.merge_method]}): {raw_count} → {len(final_polygons)} 个目标")
+
+        # 前端数据: 列式检测结果表，类别名称只在最后查表一次
+        table = DetectionTable(final_polygons, final_scores, final_classes, [names[k] for k in sorted(names)])
+        final_names = table.class_names
+
+        if len(final_polygons) > 0:
+            self._log(f"确认 {len(final_polygons)} 个目标...")
+        else:
+            self._log("⚠️ 未检测到任何目标。")
+
+        # Stats
+        stats_summary = detection_stats(base_name, final_names)
+
+        detections = (final_polygons, final_scores, final_names)
+        img_array = acc['image'] if self.vis_format != 'none' else None
+        self._outputs.submit(base_name, self._write_outputs, meta, img_array, detections, raw,
+                             names, task, stats_summary, table, time.time())
+
+    def _on_write_error(self, label, error):
+        self._log(f"❌ 写出失败: {label}: {error}")
+
+    def _write_outputs(self, meta, img_array, detections, raw, names, task, stats_summary, table, submitted):
+        """ 后台写出线程: 原始预测旁车 -> Shapefile / 汇总图层 -> 可视化图，全部写完后再登记任务清单/缓存并通知结果 """
+        write_start = time.time()
+        image_path = meta['path']
+        transform, crs = meta['transform'], meta['crs']
+        w, h = meta['width'], meta['height']
+        base_name = os.path.splitext(os.path.basename(image_path))[0]
+        final_polygons, final_scores, final_names = detections
+
+        raw_path = None
+        if raw is not None:
+            raw_path = raw_sidecar_path(self.output_dir, image_path)
+            save_raw_predictions(raw_path, *raw, names, task, (w, h), bool(meta['total_slices']),
+                                 (self.predict_conf, self.predict_iou))
+
+        vector_outputs = []
+        if self.vector_format == 'shp':
+            # 导出 Shapefile (几何全部顶点一次性转换)
+            geometries = polygons_to_geometries(final_polygons, transform)
+            output_shp_path = os.path.join(self.output_dir, f"{base_name}_result.shp")
+            if len(geometries) > 0:
+                gdf = gpd.GeoDataFrame({
+                    'Class': final_names,
+                    'Score': final_scores
+                }, geometry=geometries, crs=crs)
+                gdf.to_file(output_shp_path, driver='ESRI Shapefile', encoding='utf-8')
+            else:
+                gdf = gpd.GeoDataFrame({'Class': [], 'Score': []}, geometry=[], crs=crs)
+                gdf.to_file(output_shp_path, driver='ESRI Shapefile', encoding='utf-8')
+            vector_outputs.append(output_shp_path)
+
+        # --- 生成可视化结果 ---
+        # 界面按检测结果动态重绘，这里只保存一份原图预览 (按 vis_format 选择格式，'none' 时跳过)
+        temp_vis_path = ''
+        if self.vis_format != 'none':
+            out_h, out_w = preview_shape(w, h, self.vis_format)
+            if img_array is None:
+                # 切片模式下不保留整幅影像，按降采样尺寸读取一份预览
+                with rasterio.open(image_path) as src:
+                    img_array = read_rgb(src, out_shape=(out_h, out_w), bands=self.bands)
+            elif img_array.shape[:2] != (out_h, out_w):
+                img_array = cv2.resize(img_array, (out_w, out_h), interpolation=cv2.INTER_AREA)
+            temp_vis_path = os.path.join(self.output_dir, base_name + VIS_SUFFIXES[self.vis_format])
+            write_preview(temp_vis_path, self.vis_format, img_array,
+                          transform * Affine.scale(w / out_w, h / out_h), crs)
+
+        # 检测耗时: 第一个切片进入推理到最后一个切片推理完成 (不含排队/读取等待)；elapsed 为规划到写出完成的总耗时
+        detect_seconds = meta['infer_end'] - meta['infer_start'] if 'infer_start' in meta else 0.0
+        if self._layer is not None:
+            # 汇总图层最后写入: 失败时该影像不会登记为完成
+            self._layer.add(image_path, final_polygons, final_scores, final_names, transform, crs,
+                            width=w, height=h, detect_seconds=round(detect_seconds, 3))
+        write_seconds = time.time() - write_start
+        elapsed = time.time() - meta['started']
+        self._log(f"⏱️ {base_name}: 检测 {detect_seconds:.1f}s, 写出 {write_seconds:.1f}s"
+                  + (f" (排队 {write_start - submitted:.1f}s)" if write_start - submitted >= 0.1 else "")
+                  + f", 总计 {elapsed:.1f}s")
+
+        outputs = ([raw_path] if raw_path else []) + vector_outputs + ([temp_vis_path] if temp_vis_path else [])
+        self._manifest.finish(image_path, outputs, stats_summary, table, elapsed,
+                              vis_path=temp_vis_path, detect_seconds=detect_seconds, write_seconds=write_seconds)
+        if image_path in self._cache_keys:
+            self._cache.put(self._cache_keys[image_path], {
+                'image': image_path,
+                'outputs': outputs,
+                'vis': temp_vis_path,
+                'stats': stats_summary,
+                'detections': table.to_json(),
+            })
+
+        self._result(image_path, temp_vis_path, stats_summary, table)
+
+    def _job_params(self):
+        """ 影响输出结果的全部参数 (缓存键与任务清单签名共用) """
+        return {
+            'conf': self.conf, 'iou': self.iou, 'merge': self.merge_method,
+            'slice_size': self.slice_size, 'stride': self.stride,
+            'skip_empty': self.skip_empty, 'skip_flat': self.skip_flat,
+            'keep_raw': self.keep_raw, 'tile_grid': 'min-overlap',
+            'coarse': [self.coarse_factor, self.coarse_conf] if self.coarse_to_fine else None,
+            'tensor_batching': [self.tensor_batching, self.pad_mode],
+            'backend': [self.backend, self.int8],
+            'bands': list(self.bands) if self.bands else None,
+            'vector': self.vector_format,
+            'vis': self.vis_format,
+        }
+
+    def _open_manifest(self):
+        """ 打开任务清单；续跑时回放已完成影像的结果，返回仍需处理的影像列表 """
+        signature = hashlib.blake2b(json.dumps({
+            'model': [os.path.basename(self.model_path), file_stamp(self.model_path)],
+            'params': self._job_params(),
+        }, sort_keys=True).encode('utf-8'), digest_size=16).hexdigest()
+        self._manifest = JobManifest(self.output_dir, signature, resume=self.resume)
+        if not self.resume:
+            return self.pending_paths
+        pending = []
+        for image_path in self.pending_paths:
+            result = self._manifest.completed_result(image_path)
+            if result is None:
+                pending.append(image_path)
+            else:
+                self._result(image_path, *result)
+                self._replayed.append((image_path, result[2]))
+        skipped = len(self.pending_paths) - len(pending)
+        if skipped:
+            self._log(f"⏯️ 断点续跑: 跳过任务清单中已完成的 {skipped} 个文件")
+        return pending
+
+    def _apply_cache(self, model_path):
+        """ 查询结果缓存: 命中的影像直接回放结果，返回仍需推理的影像列表 """
+        self._cache = ResultCache(self.output_dir)
+        self._cache_keys = {}
+        model_digest = self._cache.digest(model_path)
+        params = self._job_params()
+        pending = []
+        hits = 0
+        for image_path in self.image_paths:
+            if self.is_interrupted:
+                break
+            key = self._cache.key(image_path, model_digest, params)
+            entry = self._cache.get(key)
+            if entry is None:
+                self._cache_keys[image_path] = key
+                pending.append(image_path)
+                continue
+            hits += 1
+            table = DetectionTable.from_json(entry['detections'])
+            self._result(image_path, entry['vis'], entry['stats'], table)
+            self._replayed.append((image_path, table))
+        self._cache.save_index()
+        if hits:
+            self._log(f"💾 结果缓存命中 {hits} 个文件 (影像与参数均未变化)，跳过推理")
+        return pending
+
+    def _open_layer(self, model_path):
+        """ 汇总输出模式: 打开检测图层 (续跑时沿用已有图层)，补写缓存命中/续跑回放但图层中缺失的影像 """
+        if self.vector_format == 'shp':
+            return
+        run_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{self._manifest.signature[:8]}"
+        # 图层坐标系取第一幅输入影像 (与写出完成顺序无关)，其余影像坐标系不同时重投影
+        try:
+            with rasterio.open(self.image_paths[0]) as src:
+                crs = src.crs
+        except Exception:
+            crs = None
+        self._layer = DetectionLayerWriter(self.output_dir, self.vector_format, run_id, crs,
+                                           {'model': os.path.basename(model_path), 'params': self._job_params()},
+                                           append=self.resume and bool(self._manifest.completed), log=self._log)
+        self._log(f"🗂️ 汇总输出: {VECTOR_FORMATS[self.vector_format]} {os.path.basename(self._layer.path)} (run_id {run_id})")
+        for image_path, table in self._replayed:
+            if image_path not in self._layer.present:
+                self._outputs.submit(os.path.basename(image_path), self._replay_layer, image_path, table)
+
+    def _replay_layer(self, image_path, table):
+        """ 由回放的检测结果表 (像素坐标) 补写汇总图层 """
+        with rasterio.open(image_path) as src:
+            transform, crs, w, h = src.transform, src.crs, src.width, src.height
+        self._layer.add(image_path, table.polygons, table.scores, table.class_names, transform, crs, width=w, height=h)
+
+    def _close_layer(self, status):
+        """ 完成汇总图层 (写入任务级属性，FlatGeobuf 在此生成) """
+        layer, self._layer = self._layer, None
+        if layer is None:
+            return
+        path = layer.close(status)
+        self._log(f"🗂️ 汇总图层已写出: {os.path.basename(path)} (本次 {layer.images} 幅影像, {layer.count} 个目标)")
+
+    def _run_pipeline(self, model, device, total_files):
+        """ 线程流水线模式: 读取 -> 推理 -> 后处理/写出 """
+        reader_pool = None
+        producer = None
+        writer = None
+        try:
+            self._halt.clear()
+            self._writer_error = None
+            tile_queue = queue.Queue(maxsize=self.prefetch_batches)
+            result_queue = queue.Queue(maxsize=self.prefetch_batches)
+            reader_pool = TileReaderPool(self.reader_workers, self.bands)
+            batcher = TileTensorBatcher(self.slice_size, device, self.pad_mode) if self.tensor_batching else None
+            if batcher is not None and not batcher.matches(model):
+                self._log(f"ℹ️ 模型推理尺寸 {model_input_size(model)[1]} 与切片尺寸 {batcher.size} 不一致，"
+                          f"关闭张量批处理 (由 ultralytics letterbox 缩放)")
+                batcher = None
+            self._tuner = BatchAutotuner(self.batch_size, device)
+            producer = threading.Thread(target=self._produce, args=(tile_queue, reader_pool), daemon=True)
+            writer = threading.Thread(target=self._consume_results, args=(result_queue, model), daemon=True)
+            producer.start()
+            writer.start()
+
+            file_start_time = time.time()
+            processed_count = 0
+            skipped_flat = 0
+
+            while True:
+                item = self._get(tile_queue)
+                if self._writer_error is not None:
+                    raise self._writer_error
+                if item is None:
+                    break
+
+                kind, meta = item[0], item[1]
+                if kind == 'error':
+                    raise meta
+                if kind == 'chips':
+                    self._predict_chips(model, device, meta, item[2], result_queue, total_files)
+                    continue
+                idx = meta['idx']
+
+                if kind == 'start':
+                    file_start_time = time.time()
+                    processed_count = 0
+                    skipped_flat = 0
+                    base_name = os.path.splitext(os.path.basename(meta['path']))[0]
+                    self._log(f"[{idx+1}/{total_files}] 正在读取影像: {base_name}...")
+                    self._log(f"影像尺寸: {meta['width']} x {meta['height']}")
+                    self._log("🚀 启用高精度切片扫描模式 (Sliding Window)...")
+                    self._log(f"🧮 切片规划: {meta['plan'].describe()}")
+                    self._log("⚡️ 已启用批量推理 (Batch Inference) 以最大化性能...")
+                    self._log("📦 使用窗口流式读取，内存占用与影像尺寸无关...")
+
+                elif kind == 'batch':
+                    crops = item[2].result()
+                    processed_count += len(crops)
+                    kept = [(crop, tile) for crop, tile in zip(crops, item[3]) if crop is not None]
+                    skipped_flat += len(crops) - len(kept)
+                    if kept:
+                        # Run Batch Inference
+                        infer_start = time.time()
+                        results = predict_tuned(model, [c for c, _ in kept], self._tuner, batcher, conf=self.predict_conf, iou=self.predict_iou, max_det=self.predict_max_det, device=device)
+                        self._mark_inference(meta, infer_start, time.time())
+                        self._put(result_queue, ('tiles', meta, results, [t for _, t in kept]))
+                        self._log_tuning()
+                    self._emit_progress(idx, total_files, processed_count, meta['total_slices'], file_start_time)
+
+                elif kind == 'coarse':
+                    crops = item[2].result()
+                    kept = [(crop, tile) for crop, tile in zip(crops, item[3]) if crop is not None]
+                    if kept:
+                        infer_start = time.time()
+                        results = predict_tuned(model, [c for c, _ in kept], self._tuner, batcher, measure=False, conf=self.coarse_conf, iou=self.predict_iou, max_det=self.predict_max_det, device=device)
+                        self._mark_inference(meta, infer_start, time.time())
+                        for r, (_, tile) in zip(results, kept):
+                            collect_result(r, tile[0], tile[1], None, meta['coarse_acc'], scale=self.coarse_factor, extent=tile[2:])
+
+                elif kind == 'coarse_end':
+                    polygons = meta.pop('coarse_acc')['polygons']
+                    item[2].set_result(polygons_to_bboxes(np.concatenate(polygons)) if polygons else np.empty((0, 4)))
+
+                elif kind == 'end':
+                    if meta['skipped_nodata'] or skipped_flat:
+                        self._log(f"⏭️ 跳过空白切片: 无数据 {meta['skipped_nodata']} 个, 纹理均一 {skipped_flat} 个")
+                    self._put(result_queue, ('end', meta))
+                    self._progress(int(((idx + 1) / total_files) * 100), "Done", "Processing...")
+
+            if not self.is_interrupted:
+                # 等待后处理/写出阶段处理完剩余结果
+                self._put(result_queue, None)
+                writer.join()
+                if self._writer_error is not None:
+                    raise self._writer_error
+
+        finally:
+            self._halt.set()
+            for t in (producer, writer):
+                if t is not None:
+                    t.join()
+            if reader_pool is not None:
+                reader_pool.close()
+
+    def _predict_chips(self, model, device, metas, futures, result_queue, total_files):
+        """ 同尺寸小图 (全图模式) 合并为一次批量推理，结果按影像分发给后处理/写出阶段 """
+        images = [future.result() for future in futures]
+        first, last = metas[0]['idx'] + 1, metas[-1]['idx'] + 1
+        span = f"{first}-{last}" if last > first else f"{first}"
+        self._log(f"[{span}/{total_files}] 小图全图模式批量推理: {len(metas)} 幅 {metas[0]['width']} x {metas[0]['height']} 影像")
+        infer_start = time.time()
+        results = predict_tuned(model, images, self._tuner, conf=self.predict_conf, iou=self.predict_iou,
+                                max_det=self.predict_max_det, device=device)
+        infer_end = time.time()
+        self._log_tuning()
+        for meta, img_array, result in zip(metas, images, results):
+            self._mark_inference(meta, infer_start, infer_end)
+            self._put(result_queue, ('full', meta, [result], img_array))
+            self._put(result_queue, ('end', meta))
+        self._progress(int(last / total_files * 100), "Done", "Processing...")
+
+    def _coarse_pass_pool(self, executor, planned, num_workers):
+        """ 多进程模式粗扫描: 各大图的降采样窗口分组提交到进程池，汇总候选区域后筛选切片；任务终止时返回 None """
+        futures = {}
+        metas = {meta['idx']: meta for meta, _ in planned}
+        for meta, tiles in planned:
+            if tiles is None:
+                continue
+            windows = coarse_windows(meta['width'], meta['height'], self.slice_size, self.stride, self.coarse_factor)
+            meta['coarse_windows'] = len(windows)
+            chunk = max(self.batch_size or AUTO_BATCH_INITIAL, math.ceil(len(windows) / num_workers))
+            for i in range(0, len(windows), chunk):
+                future = executor.submit(detect_worker_task, meta['path'], windows[i:i + chunk],
+                                         self.coarse_conf, self.predict_iou, self.skip_flat,
+                                         self.predict_max_det, self.coarse_factor)
+                futures[future] = meta['idx']
+        boxes = {}
+        waiting = set(futures)
+        while waiting:
+            if self.is_interrupted:
+                return None
+            done, waiting = wait(waiting, timeout=0.2, return_when=FIRST_COMPLETED)
+            for future in done:
+                part = future.result()
+                if part['infer'] is not None:
+                    self._mark_inference(metas[futures[future]], *part['infer'])
+                if len(part['polygons']) > 0:
+                    boxes.setdefault(futures[future], []).append(polygons_to_bboxes(part['polygons']))
+        result = []
+        for meta, tiles in planned:
+            if tiles is not None:
+                found = np.concatenate(boxes[meta['idx']]) if meta['idx'] in boxes else np.empty((0, 4))
+                tiles = self._apply_regions(meta, tiles, found, meta.pop('coarse_windows'))
+            result.append((meta, tiles))
+        return result
+
+    def _run_process_pool(self, model_path, device, total_files):
+        """ 多进程模式: 影像 (及大图的切片组) 分发到多个子进程，各自加载模型并限定 torch 线程数 """
+        num_workers, threads = resolve_process_layout(self.num_workers, self.threads_per_worker)
+        self._log(f"🧵 多进程模式: {num_workers} 个进程 x {threads} 个线程")
+
+        ctx = multiprocessing.get_context('spawn')
+        executor = ProcessPoolExecutor(max_workers=num_workers, mp_context=ctx,
+                                       initializer=init_detect_worker,
+                                       initargs=(model_path, device, threads,
+                                                 self.slice_size if self.tensor_batching else None, self.pad_mode,
+                                                 self.batch_size, self.bands))
+        try:
+            # 1. 规划任务: 小图整图一个任务；大图切片可按进程数分组
+            planned = [self._plan_image(idx, image_path) for idx, image_path in enumerate(self.pending_paths)]
+            if self.coarse_to_fine:
+                planned = self._coarse_pass_pool(executor, planned, num_workers)
+                if planned is None:
+                    return
+
+            def complete(idx, entry, names, task):
+                meta = entry['meta']
+                base_name = os.path.splitext(os.path.basename(meta['path']))[0]
+                self._log(f"[{idx+1}/{total_files}] 检测完成: {base_name} ({meta['width']} x {meta['height']})")
+                if meta['skipped_nodata'] or entry['skipped_flat']:
+                    self._log(f"⏭️ 跳过空白切片: 无数据 {meta['skipped_nodata']} 个, 纹理均一 {entry['skipped_flat']} 个")
+                self._finish_image(meta, entry['acc'], names, task)
+
+            tasks = []
+            pending = {}
+            empty = [] # 没有切片需要推理的大图 (全部无数据 / 粗扫描无候选 / 检查点已完成)，不提交空任务
+            chip_batch = self.batch_size or AUTO_BATCH_INITIAL
+            for meta, tiles in planned:
+                idx = meta['idx']
+                if tiles is not None and not tiles:
+                    empty.append((idx, {'meta': meta, 'skipped_flat': 0, 'acc': self._new_acc(meta)}))
+                    continue
+                if tiles is not None:
+                    chunk = max(len(tiles), 1)
+                    if self.shard_tiles:
+                        chunk = max(chip_batch, math.ceil(len(tiles) / num_workers))
+                    groups = [tiles[i:i + chunk] for i in range(0, len(tiles), chunk)]
+                    tasks.extend((idx, group) for group in groups)
+                else:
+                    # 连续的同尺寸小图合并为一个任务 (idx 为影像序号列表)，子进程内批量推理
+                    groups = [None]
+                    last = tasks[-1] if tasks else None
+                    if (last is not None and last[1] is None and len(last[0]) < chip_batch
+                            and (pending[last[0][-1]]['meta']['width'], pending[last[0][-1]]['meta']['height'])
+                            == (meta['width'], meta['height'])):
+                        last[0].append(idx)
+                    else:
+                        tasks.append(([idx], None))
+                pending[idx] = {'meta': meta, 'remaining': len(groups), 'skipped_flat': 0, 'acc': self._new_acc(meta)}
+
+            total_units = max(sum(len(g) if g is not None else len(i) for i, g in tasks), 1)
+            done_units = 0
+            finished_files = 0
+            start_time = time.time()
+
+            if empty:
+                # 直接汇总 (检查点中可能已有结果，类别表向子进程查询)
+                names, task = executor.submit(model_info_task).result()
+                for idx, entry in empty:
+                    complete(idx, entry, names, task)
+                    finished_files += 1
+
+            # 2. 提交到进程池，按完成顺序汇总；一幅影像的全部任务完成后拼接合并并写出
+            futures = {}
+            for idx, group in tasks:
+                if group is None:
+                    future = executor.submit(detect_chips_task, [self.pending_paths[i] for i in idx],
+                                             self.predict_conf, self.predict_iou, self.predict_max_det)
+                else:
+                    future = executor.submit(detect_worker_task, self.pending_paths[idx], group,
+                                             self.predict_conf, self.predict_iou, self.skip_flat,
+                                             self.predict_max_det)
+                futures[future] = (idx, group)
+            waiting = set(futures)
+            while waiting:
+                if self.is_interrupted:
+                    # 终止时保存未完成大图的切片检查点
+                    for entry in pending.values():
+                        self._manifest.save_checkpoint(entry['meta']['path'], entry['acc'], force=True)
+                    break
+                done, waiting = wait(waiting, timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in done:
+                    idx, group = futures.pop(future)
+                    # 小图任务返回每幅影像的结果列表
+                    parts = zip(idx, future.result()) if group is None else [(idx, future.result())]
+                    for idx, part in parts:
+                        entry = pending[idx]
+                        for key in ('polygons', 'scores', 'classes', 'tiles'):
+                            if len(part[key]) > 0:
+                                entry['acc'][key].append(part[key])
+                        entry['remaining'] -= 1
+                        entry['skipped_flat'] += part['skipped']
+                        if part['infer'] is not None:
+                            self._mark_inference(entry['meta'], *part['infer'])
+                        self._worker_tuning[part['tuning']['worker']] = part['tuning']
+                        if group is not None:
+                            entry['acc']['done'].extend(group)
+                            if entry['remaining'] > 0:
+                                self._manifest.save_checkpoint(entry['meta']['path'], entry['acc'])
+                        done_units += len(group) if group is not None else 1
+
+                        if entry['remaining'] == 0:
+                            complete(idx, pending.pop(idx), part['names'], part['task'])
+                            finished_files += 1
+
+                    elapsed = time.time() - start_time
+                    eta_str = "--:--"
+                    if done_units > 0:
+                        eta_seconds = elapsed / done_units * (total_units - done_units)
+                        eta_str = time.strftime("%M:%S", time.gmtime(eta_seconds))
+                    usage_str = "CPU: ?%"
+                    if HAS_PSUTIL:
+                        usage_str = f"CPU: {psutil.cpu_percent()}% | MEM: {psutil.virtual_memory().percent}%"
+                    self._progress(int(done_units / total_units * 100),
+                                   f"ETA: {eta_str} (File {finished_files}/{total_files})", usage_str)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _log_tuning(self):
+        """ 输出批量大小的调整事件 (自动确定 / 显存超预算 / OOM 回退) """
+        for reason, size, throughput in self._tuner.drain_events():
+            if reason == 'settled':
+                self._log(f"📐 自动批量大小: {size} (实测吞吐 {throughput:.1f} 切片/秒)")
+            elif reason == 'memory':
+                self._log(f"⚠️ 显存占用超出预算，批量大小降为 {size}")
+            else:
+                self._log(f"⚠️ 显存/内存不足 (OOM)，批量大小降为 {size} 并拆分重试")
+
+    def _record_tuning(self):
+        """ 将本次运行的批量大小与实测吞吐写入任务清单 """
+        summaries = list(self._worker_tuning.values())
+        if self._tuner is not None:
+            summaries.append(self._tuner.summary())
+        for summary in summaries:
+            self._manifest.record('batch_tuning', **summary)
+            if summary['tiles_per_sec']:
+                worker = f"进程 {summary['worker']}: " if 'worker' in summary else ""
+                self._log(f"📐 {worker}批量大小 {summary['batch_size']}, 平均吞吐 {summary['tiles_per_sec']} 切片/秒")
+
+    def _prepare_backend(self, model_path, device):
+        """ 解析推理后端，按需导出模型并与 torch 输出做一致性校验；返回 (实际加载的模型路径, 设备) """
+        backend = resolve_backend(self.backend, device)
+        if backend == 'torch':
+            self._log("🧠 推理后端: PyTorch")
+            return model_path, device
+        if not (model_path.endswith('.pt') and os.path.exists(model_path)):
+            self._log(f"⚠️ {BACKENDS[backend]} 需要本地 .pt 权重进行导出，改用 PyTorch")
+            return model_path, device
+
+        try:
+            batcher = TileTensorBatcher(self.slice_size)
+            samples = []
+
+            def sample_tiles():
+                # 校准/校验切片只在需要 INT8 量化或一致性校验时才读取
+                if not samples:
+                    samples.extend(calibration_batches(self.pending_paths, self.slice_size, batcher, bands=self.bands))
+                return samples
+
+            exported = export_model(model_path, backend, math.ceil(self.slice_size / 32) * 32,
+                                    self.int8, lambda: sample_tiles()[1], log=self._log)
+            key = (exported, os.path.getmtime(exported))
+            if key not in _VERIFIED_EXPORTS:
+                reference, _ = MODEL_POOL.get(model_path, 'cpu')
+                candidate, _ = MODEL_POOL.get(exported, 'cpu')
+                recall = backend_parity(reference, candidate, sample_tiles()[0][:PARITY_TILES],
+                                        batcher if self.tensor_batching else None,
+                                        conf=min(self.conf, RAW_CONF), iou=self.iou, device='cpu')
+                if recall is None:
+                    # 无法校验: 不记为已通过；auto 模式不冒险切换后端，显式指定时照用并提示
+                    if self.backend == 'auto':
+                        self._log(f"⚠️ 样本切片上 PyTorch 没有检测结果，无法校验 {BACKENDS[backend]} 输出一致性，改用 PyTorch")
+                        return model_path, device
+                    self._log(f"⚠️ 样本切片上 PyTorch 没有检测结果，{BACKENDS[backend]} 输出一致性未经校验")
+                elif recall < PARITY_MIN_RECALL:
+                    self._log(f"⚠️ {BACKENDS[backend]} 输出与 PyTorch 不一致 (检测框找回率 {recall:.0%})，改用 PyTorch")
+                    return model_path, device
+                else:
+                    _VERIFIED_EXPORTS.add(key)
+                    self._log(f"✅ 一致性校验通过 (检测框找回率 {recall:.0%})")
+        except Exception as e:
+            self._log(f"⚠️ {BACKENDS[backend]} 后端准备失败，改用 PyTorch: {e}")
+            return model_path, device
+
+        quant = " INT8" if '_int8' in os.path.basename(exported) else ""
+        self._log(f"🧠 推理后端: {BACKENDS[backend]}{quant} ({os.path.basename(exported)})")
+        return exported, 'cpu'
+
+    def run(self):
+        try:
+            # 1. 硬件加速配置
+            device = detect_device()
+            if device == 'mps':
+                self._log("🍎 检测到 Apple Silicon 芯片，已启用 MPS (Metal) 神经网络加速！")
+            elif device == 'cuda':
+                self._log("🚀 检测到 NVIDIA GPU，已启用 CUDA 加速！")
+            else:
+                self._log("🐢 未检测到专用加速硬件，使用 CPU 运行...")
+
+            # Load Model
+            self._log(f"正在加载模型: {os.path.basename(self.model_path)}...")
+            # Auto download check
+            model_to_load = self.model_path
+            if not os.path.exists(self.model_path):
+                model_name = os.path.basename(self.model_path)
+                self._log(f"⚠️ 本地未找到 {model_name}，尝试自动下载...")
+                model_to_load = model_name
+
+            if not os.path.exists(self.output_dir):
+                try:
+                    os.makedirs(self.output_dir, exist_ok=True)
+                except Exception as e:
+                    self.status = 'error'
+                    self._finish(f"❌ 无法创建输出目录: {e}")
+                    return
+
+            self._outputs = OutputWriterPool(self.write_workers, on_error=self._on_write_error)
+            self._replayed = []
+            self.pending_paths = self._apply_cache(self.model_path) if self.use_cache else self.image_paths
+            self.pending_paths = self._open_manifest()
+            self._open_layer(self.model_path)
+            total_files = len(self.pending_paths)
+
+            if total_files > 0:
+                model_to_load, device = self._prepare_backend(model_to_load, device)
+
+            # 2. 执行检测
+            if total_files == 0:
+                pass # 全部命中缓存，无需加载模型
+            elif self.execution == 'process':
+                # 子进程各自加载模型，主进程只负责汇总与写出
+                self._run_process_pool(model_to_load, device, total_files)
+            else:
+                model, cached = MODEL_POOL.get(model_to_load, device)
+                if cached:
+                    self._log("♻️ 复用已加载的模型 (已预热)，直接开始推理")
+                self._run_pipeline(model, device, total_files)
+
+            # 等待后台写出全部完成 (终止时也写完已提交的影像)
+            write_errors = self._outputs.flush()
+            self.status = 'stopped' if self.is_interrupted else 'failed' if write_errors else 'finished'
+            self._close_layer(self.status)
+            self._record_tuning()
+            self._manifest.record(self.status, **({'write_errors': len(write_errors)} if write_errors else {}))
+            if write_errors:
+                self._log(f"⚠️ {len(write_errors)} 幅影像的结果写出失败，详见上方日志")
+            if self.status == 'stopped':
+                self._finish("🛑 任务已终止。")
+            elif self.status == 'failed':
+                self._finish(f"❌ 批量处理结束，但有 {len(write_errors)} 幅影像的结果写出失败 (共 {len(self.image_paths)} 个文件)。")
+            else:
+                self._finish(f"✅ 批量处理完成！共处理 {len(self.image_paths)} 个文件。")
+
+        except Exception as e:
+            import traceback
+            error_msg = traceback.format_exc()
+            print(error_msg)
+            self.status = 'error'
+            if self._manifest is not None:
+                self._manifest.record('error', message=str(e))
+            if self._outputs is not None:
+                self._outputs.flush()
+            try:
+                self._close_layer('error')
+            except Exception as layer_error:
+                print(layer_error)
+            self._finish(f"❌ 出错: {str(e)}")
+        finally:
+            if self._outputs is not None:
+                self._outputs.close()
+            if self._manifest is not None:
+                self._manifest.close()
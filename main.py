@@ -1,6 +1,6 @@
 import sys
 import os
-import time
+import multiprocessing
 
 # --- Fix for Qt Platform Plugin Error on macOS ---
 import PyQt6
@@ -25,14 +25,17 @@ from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                              QTabWidget, QToolBox, QMenuBar, QDockWidget, QGraphicsItemGroup, QGraphicsTextItem)
 from PyQt6.QtCore import QThread, pyqtSignal, Qt, QRectF, QPointF, QSize, QEvent, QSettings
 from PyQt6.QtGui import QPixmap, QImage, QPainter, QPen, QColor, QWheelEvent, QPolygonF, QAction, QIcon, QFont, QBrush, QCursor
-from ultralytics import YOLO
 import cv2
-import torch
-from torchvision.ops import nms
 import webbrowser
 from PyQt6.QtCore import QDate
 from PyQt6.QtWidgets import QDateEdit, QDialog, QFormLayout, QDoubleSpinBox, QSpinBox
 
+# 检测核心与引擎 (无界面依赖，命令行共用)
+from aigis.core import (IMAGE_EXTENSIONS, MERGE_METHODS, MODEL_POOL, BACKENDS, VECTOR_FORMATS, VIS_FORMATS, available_backends,
+                        parse_bands, read_rgb, detect_device, pixel_to_geo, polygons_to_geometries, raw_sidecar_path, load_raw_predictions,
+                        clamp_raw_thresholds, rethreshold_raw, DetectionTable, detection_stats)
+from aigis.engine import DetectionEngine
+
 # Matplotlib integration
 import matplotlib
 matplotlib.use('QtAgg')
@@ -40,13 +43,6 @@ from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 import matplotlib.pyplot as plt
 
-# Optional: psutil for system monitoring
-try:
-    import psutil
-    HAS_PSUTIL = True
-except ImportError:
-    HAS_PSUTIL = False
-
 def resource_path(relative_path):
     """ Get absolute path to resource, works for dev and for PyInstaller """
     try:
@@ -57,6 +53,7 @@ def resource_path(relative_path):
 
     return os.path.join(base_path, relative_path)
 
+
 # --- Matplotlib Widget ---
 class MplCanvas(FigureCanvas):
     def __init__(self, parent=None, width=5, height=4, dpi=100):
@@ -119,282 +116,32 @@ class ZoomableGraphicsView(QGraphicsView):
             self.fitInView(self.scene().itemsBoundingRect(), Qt.AspectRatioMode.KeepAspectRatio)
 
 # --- 后台 AI 线程 ---
+# 检测逻辑位于无界面依赖的 aigis.engine.DetectionEngine (命令行共用)，这里只负责把回调转为 Qt 信号
 class DetectionThread(QThread):
     log_signal = pyqtSignal(str)
     finish_signal = pyqtSignal(str)
-    result_signal = pyqtSignal(str, str, str, list) # original_path, vis_path, stats, detections
+    result_signal = pyqtSignal(str, str, str, object) # original_path, vis_path, stats, detections (DetectionTable，按引用传递)
     progress_signal = pyqtSignal(int, str, str) # percent, eta, usage
 
-    def __init__(self, model_path, image_paths, output_dir, conf=0.25, iou=0.45):
+    def __init__(self, model_path, image_paths, output_dir, **kwargs):
         super().__init__()
-        self.model_path = model_path
-        self.image_paths = image_paths
-        self.output_dir = output_dir
-        self.conf = conf
-        self.iou = iou
-        self.is_interrupted = False
+        self.engine = DetectionEngine(
+            model_path, image_paths, output_dir,
+            on_log=self.log_signal.emit, on_progress=self.progress_signal.emit,
+            on_result=self.result_signal.emit, on_finish=self.finish_signal.emit,
+            **kwargs)
 
     def stop(self):
-        self.is_interrupted = True
+        self.engine.stop()
 
     def run(self):
-        try:
-            # 1. 硬件加速配置
-            device = 'cpu'
-            if torch.backends.mps.is_available():
-                device = 'mps'
-                self.log_signal.emit("🍎 检测到 Apple Silicon 芯片，已启用 MPS (Metal) 神经网络加速！")
-            elif torch.cuda.is_available():
-                device = 'cuda'
-                self.log_signal.emit("🚀 检测到 NVIDIA GPU，已启用 CUDA 加速！")
-            else:
-                self.log_signal.emit("🐢 未检测到专用加速硬件，使用 CPU 运行...")
-
-            # Load Model
-            self.log_signal.emit(f"正在加载模型: {os.path.basename(self.model_path)}...")
-            # Auto download check
-            model_to_load = self.model_path
-            if not os.path.exists(self.model_path):
-                model_name = os.path.basename(self.model_path)
-                self.log_signal.emit(f"⚠️ 本地未找到 {model_name}，尝试自动下载...")
-                model_to_load = model_name
-            
-            model = YOLO(model_to_load)
-            
-            if not os.path.exists(self.output_dir):
-                try:
-                    os.makedirs(self.output_dir, exist_ok=True)
-                except Exception as e:
-                    self.log_signal.emit(f"⚠️ 无法创建输出目录: {e}")
-                    return
-
-            total_files = len(self.image_paths)
-            
-            for idx, image_path in enumerate(self.image_paths):
-                if self.is_interrupted:
-                    self.log_signal.emit("🛑 任务已终止。")
-                    break
-
-                file_start_time = time.time()
-                base_name = os.path.splitext(os.path.basename(image_path))[0]
-                
-                self.log_signal.emit(f"[{idx+1}/{total_files}] 正在读取影像: {base_name}...")
-                
-                with rasterio.open(image_path) as src:
-                    transform = src.transform
-                    crs = src.crs
-                    
-                    img_data = src.read()
-                    img_array = np.transpose(img_data, (1, 2, 0))
-                    
-                    # Ensure 3 channels (RGB) for YOLO
-                    if img_array.shape[2] > 3:
-                        img_array = img_array[:, :, :3]
-                    elif img_array.shape[2] == 1:
-                        img_array = np.repeat(img_array, 3, axis=2)
-                        
-                    img_array = np.ascontiguousarray(img_array)
-                    
-                    h, w = img_array.shape[:2]
-                    self.log_signal.emit(f"影像尺寸: {w} x {h}")
-
-                    final_polygons = [] 
-                    final_scores = []
-                    final_classes = []
-                    final_names = []
-
-                    # --- 智能切片扫描逻辑 ---
-                    if h > 1000 or w > 1000:
-                        self.log_signal.emit("🚀 启用高精度切片扫描模式 (Sliding Window)...")
-                        self.log_signal.emit("⚡️ 已启用批量推理 (Batch Inference) 以最大化性能...")
-                        slice_size = 640
-                        stride = 500
-                        batch_size = 8 # 批量大小，根据显存调整
-                        
-                        total_slices = ((h // stride) + 1) * ((w // stride) + 1)
-                        processed_count = 0
-                        
-                        batch_crops = []
-                        batch_coords = [] # (x, y)
-
-                        def process_batch(crops, coords):
-                            if not crops: return
-                            # Run Batch Inference
-                            results = model.predict(crops, save=False, conf=self.conf, iou=self.iou, augment=False, verbose=False, device=device)
-                            
-                            for i, r in enumerate(results):
-                                off_x, off_y = coords[i]
-                                
-                                # Process OBB
-                                if r.obb is not None and len(r.obb) > 0:
-                                    for obb in r.obb:
-                                        points = obb.xyxyxyxy[0].cpu().numpy()
-                                        points[:, 0] += off_x
-                                        points[:, 1] += off_y
-                                        final_polygons.append(points)
-                                        final_scores.append(float(obb.conf.cpu().numpy()[0]))
-                                        cls_id = int(obb.cls.cpu().numpy()[0])
-                                        final_classes.append(cls_id)
-                                        final_names.append(model.names[cls_id])
-                                
-                                # Process HBB
-                                elif r.boxes is not None and len(r.boxes) > 0:
-                                    for box_data in r.boxes:
-                                        bx1, by1, bx2, by2 = box_data.xyxy[0].cpu().numpy()
-                                        points = np.array([
-                                            [bx1+off_x, by1+off_y], [bx2+off_x, by1+off_y], 
-                                            [bx2+off_x, by2+off_y], [bx1+off_x, by2+off_y]
-                                        ])
-                                        final_polygons.append(points)
-                                        final_scores.append(float(box_data.conf.cpu().numpy()[0]))
-                                        cls_id = int(box_data.cls.cpu().numpy()[0])
-                                        final_classes.append(cls_id)
-                                        final_names.append(model.names[cls_id])
-                        
-                        for y in range(0, h, stride):
-                            if self.is_interrupted: break
-
-                            for x in range(0, w, stride):
-                                if self.is_interrupted: break
-
-                                h_slice = min(slice_size, h - y)
-                                w_slice = min(slice_size, w - x)
-                                crop = img_array[y:y+h_slice, x:x+w_slice]
-                                
-                                batch_crops.append(crop)
-                                batch_coords.append((x, y))
-                                
-                                if len(batch_crops) >= batch_size:
-                                    process_batch(batch_crops, batch_coords)
-                                    processed_count += len(batch_crops)
-                                    batch_crops = []
-                                    batch_coords = []
-                                    
-                                    # 更新进度
-                                    elapsed = time.time() - file_start_time
-                                    if processed_count > 0:
-                                        avg_time_per_slice = elapsed / processed_count
-                                        remaining_slices = total_slices - processed_count
-                                        eta_seconds = remaining_slices * avg_time_per_slice
-                                        eta_str = time.strftime("%M:%S", time.gmtime(eta_seconds))
-                                    else:
-                                        eta_str = "--:--"
-                                    
-                                    usage_str = "CPU: ?%"
-                                    if HAS_PSUTIL:
-                                        cpu_p = psutil.cpu_percent()
-                                        mem_p = psutil.virtual_memory().percent
-                                        usage_str = f"CPU: {cpu_p}% | MEM: {mem_p}%"
-                                    
-                                    current_file_progress = processed_count / total_slices
-                                    total_progress = int(((idx + current_file_progress) / total_files) * 100)
-                                    self.progress_signal.emit(total_progress, f"ETA: {eta_str} (File {idx+1}/{total_files})", usage_str)
-                        
-                        # Process remaining
-                        if batch_crops and not self.is_interrupted:
-                            process_batch(batch_crops, batch_coords)
-                            processed_count += len(batch_crops)
-                            self.progress_signal.emit(int(((idx + 1) / total_files) * 100), "Done", "Processing...")
-                            
-                    else:
-                        self.log_signal.emit("影像较小，使用全图模式...")
-                        results = model.predict(img_array, save=False, conf=self.conf, iou=self.iou, augment=False, device=device)
-                        result = results[0]
-                        
-                        if result.obb is not None and len(result.obb) > 0:
-                            for obb in result.obb:
-                                points = obb.xyxyxyxy[0].cpu().numpy()
-                                final_polygons.append(points)
-                                final_scores.append(float(obb.conf.cpu().numpy()[0]))
-                                cls_id = int(obb.cls.cpu().numpy()[0])
-                                final_classes.append(cls_id)
-                                final_names.append(result.names[cls_id])
-                        elif result.boxes is not None and len(result.boxes) > 0:
-                            for box_data in result.boxes:
-                                x1, y1, x2, y2 = box_data.xyxy[0].cpu().numpy()
-                                points = np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]])
-                                final_polygons.append(points)
-                                final_scores.append(float(box_data.conf.cpu().numpy()[0]))
-                                cls_id = int(box_data.cls.cpu().numpy()[0])
-                                final_classes.append(cls_id)
-                                final_names.append(result.names[cls_id])
-                        
-                        self.progress_signal.emit(int(((idx + 1) / total_files) * 100), "Done", "Processing...")
-
-                    if self.is_interrupted:
-                        self.log_signal.emit("🛑 任务已终止。")
-                        break
-
-                    # --- 准备数据 ---
-                    geometries = []
-                    all_detections_list = []
-                    
-                    if len(final_polygons) > 0:
-                        self.log_signal.emit(f"确认 {len(final_polygons)} 个目标...")
-                        for i, points in enumerate(final_polygons):
-                            # points shape: (4, 2)
-                            # 1. 生成 Shapefile 几何 (Polygon)
-                            geo_points = []
-                            for px, py in points:
-                                gx, gy = rasterio.transform.xy(transform, py, px, offset='center')
-                                geo_points.append((gx, gy))
-                            
-                            geometries.append(Polygon(geo_points))
-                            
-                            # 2. 收集前端数据
-                            min_x, min_y = np.min(points, axis=0)
-                            max_x, max_y = np.max(points, axis=0)
-                            
-                            all_detections_list.append({
-                                'name': final_names[i],
-                                'bbox': [float(min_x), float(min_y), float(max_x), float(max_y)], 
-                                'polygon': points.tolist(), 
-                                'score': float(final_scores[i])
-                            })
-                    else:
-                        self.log_signal.emit("⚠️ 未检测到任何目标。")
-
-                    # 导出 Shapefile
-                    output_shp_path = os.path.join(self.output_dir, f"{base_name}_result.shp")
-                    if len(geometries) > 0:
-                        gdf = gpd.GeoDataFrame({
-                            'Class': final_names,
-                            'Score': final_scores
-                        }, geometry=geometries, crs=crs)
-                        gdf.to_file(output_shp_path, driver='ESRI Shapefile', encoding='utf-8')
-                    else:
-                        gdf = gpd.GeoDataFrame({'Class': [], 'Score': []}, geometry=[], crs=crs)
-                        gdf.to_file(output_shp_path, driver='ESRI Shapefile', encoding='utf-8')
-                    
-                    # Stats
-                    from collections import Counter
-                    count_stats = Counter(final_names)
-                    stats_summary = f"【{base_name} 统计】\n"
-                    for cls_name, count in count_stats.items():
-                        stats_summary += f"- {cls_name}: {count} 个\n"
-
-                    # --- 生成可视化结果 (Combined) ---
-                    # For simplicity, we just save the original image as "vis" or maybe draw Model A?
-                    # Actually, the UI redraws everything dynamically now, so this static image is less critical.
-                    # We'll just save a clean copy or maybe draw the first model's result.
-                    
-                    vis_img = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-                    temp_vis_path = os.path.join(self.output_dir, f"{base_name}_vis.png")
-                    cv2.imwrite(temp_vis_path, vis_img)
-                    
-                    self.result_signal.emit(image_path, temp_vis_path, stats_summary, all_detections_list)
-
-            self.finish_signal.emit(f"✅ 批量处理完成！共处理 {total_files} 个文件。")
-
-        except Exception as e:
-            import traceback
-            error_msg = traceback.format_exc()
-            print(error_msg) 
-            self.finish_signal.emit(f"❌ 出错: {str(e)}")
+        self.engine.run()
 
 
 # --- 界面部分 ---
 class AI_GIS_App(QMainWindow):
+    preload_log_signal = pyqtSignal(str) # 后台预加载线程的消息转到界面线程
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("AI GIS 遥感智能解译系统")
@@ -405,10 +152,11 @@ class AI_GIS_App(QMainWindow):
         
         self.img_paths = [] 
         self.results = {} 
+        self.current_result_path = None
         
         # 导航数据
-        self.all_detections = []
-        self.current_filtered_detections = []
+        self.all_detections = DetectionTable.empty()
+        self.current_filtered_detections = DetectionTable.empty()
         self.current_index = -1
         self.highlight_item = None 
         self.current_cv_img = None # Cache for heatmap
@@ -528,6 +276,10 @@ class AI_GIS_App(QMainWindow):
         self.lbl_model_desc.setStyleSheet("font-size: 12px; color: #98c379; margin-bottom: 10px;")
         config_layout.addWidget(self.lbl_model_desc)
         
+        self.chk_preload = QCheckBox("后台预加载所选模型")
+        self.chk_preload.setChecked(True)
+        config_layout.addWidget(self.chk_preload)
+        
         # 推理参数
         param_group = QGroupBox("推理参数微调")
         param_layout = QVBoxLayout(param_group)
@@ -541,6 +293,8 @@ class AI_GIS_App(QMainWindow):
         iou_layout.addWidget(self.spin_iou)
         self.lbl_iou_val = QLabel("0.45")
         self.spin_iou.valueChanged.connect(lambda v: self.lbl_iou_val.setText(f"{v/100:.2f}"))
+        self.spin_iou.valueChanged.connect(self.on_infer_params_changed)
+        self.spin_iou.sliderReleased.connect(self.on_infer_params_changed)
         iou_layout.addWidget(self.lbl_iou_val)
         param_layout.addLayout(iou_layout)
         
@@ -553,9 +307,94 @@ class AI_GIS_App(QMainWindow):
         conf_layout.addWidget(self.spin_conf_infer)
         self.lbl_conf_infer_val = QLabel("0.25")
         self.spin_conf_infer.valueChanged.connect(lambda v: self.lbl_conf_infer_val.setText(f"{v/100:.2f}"))
+        self.spin_conf_infer.valueChanged.connect(self.on_infer_params_changed)
+        self.spin_conf_infer.sliderReleased.connect(self.on_infer_params_changed)
         conf_layout.addWidget(self.lbl_conf_infer_val)
         param_layout.addLayout(conf_layout)
         
+        # 切片结果合并方式
+        merge_layout = QHBoxLayout()
+        merge_layout.addWidget(QLabel("切片合并:"))
+        self.combo_merge = QComboBox()
+        for key, label in MERGE_METHODS.items():
+            self.combo_merge.addItem(label, key)
+        self.combo_merge.currentIndexChanged.connect(self.on_infer_params_changed)
+        merge_layout.addWidget(self.combo_merge)
+        param_layout.addLayout(merge_layout)
+        
+        # 执行模式 (多进程适合无 GPU 的多核服务器)
+        exec_layout = QHBoxLayout()
+        exec_layout.addWidget(QLabel("执行模式:"))
+        self.combo_exec = QComboBox()
+        self.combo_exec.addItem("单进程 (GPU/默认)", 'thread')
+        self.combo_exec.addItem("多进程 (多核 CPU)", 'process')
+        exec_layout.addWidget(self.combo_exec)
+        self.spin_workers = QSpinBox()
+        self.spin_workers.setRange(0, os.cpu_count() or 1)
+        self.spin_workers.setSpecialValueText("自动")
+        self.spin_workers.setPrefix("进程: ")
+        exec_layout.addWidget(self.spin_workers)
+        param_layout.addLayout(exec_layout)
+        
+        # 推理后端: 纯 CPU 时可导出为 ONNX/OpenVINO 加速 (首次导出后缓存在权重目录)
+        backend_layout = QHBoxLayout()
+        backend_layout.addWidget(QLabel("推理后端:"))
+        self.combo_backend = QComboBox()
+        available = available_backends()
+        for key, label in BACKENDS.items():
+            if key == 'auto' or key in available:
+                self.combo_backend.addItem(label, key)
+        backend_layout.addWidget(self.combo_backend)
+        self.chk_int8 = QCheckBox("INT8 量化")
+        self.chk_int8.setChecked(False)
+        backend_layout.addWidget(self.chk_int8)
+        param_layout.addLayout(backend_layout)
+        
+        # 波段映射: 多光谱影像指定 R,G,B 对应的源波段，留空按颜色解释/前三个波段 (推理与结果查看共用)
+        band_layout = QHBoxLayout()
+        band_layout.addWidget(QLabel("波段 (R,G,B):"))
+        self.edit_bands = QLineEdit()
+        self.edit_bands.setPlaceholderText("自动 (如 4,3,2)")
+        band_layout.addWidget(self.edit_bands)
+        param_layout.addLayout(band_layout)
+        
+        # 矢量输出: 逐幅 Shapefile，或整个任务汇总为一个带空间索引的 GeoPackage / FlatGeobuf
+        vector_layout = QHBoxLayout()
+        vector_layout.addWidget(QLabel("矢量输出:"))
+        self.combo_vector = QComboBox()
+        for key, label in VECTOR_FORMATS.items():
+            self.combo_vector.addItem(label, key)
+        vector_layout.addWidget(self.combo_vector)
+        param_layout.addLayout(vector_layout)
+        
+        # 可视化预览: 界面按检测结果动态重绘，预览文件仅供外部查看，可选轻量格式或不输出
+        vis_layout = QHBoxLayout()
+        vis_layout.addWidget(QLabel("可视化预览:"))
+        self.combo_vis = QComboBox()
+        for key, label in VIS_FORMATS.items():
+            self.combo_vis.addItem(label, key)
+        vis_layout.addWidget(self.combo_vis)
+        param_layout.addLayout(vis_layout)
+        
+        # 结果缓存: 影像、模型与参数均未变化时直接复用上次结果
+        self.chk_cache = QCheckBox("复用未变化影像的缓存结果")
+        self.chk_cache.setChecked(True)
+        param_layout.addWidget(self.chk_cache)
+        
+        # 原始预测: 保存宽松阈值下的全部候选，之后调整阈值无需重新推理 (推理与后处理更慢)
+        self.chk_raw = QCheckBox("保存原始预测 (支持事后快速调整阈值)")
+        self.chk_raw.setChecked(False)
+        param_layout.addWidget(self.chk_raw)
+        # 断点续跑: 依据输出目录中的任务清单跳过已完成影像，大图从切片检查点继续
+        self.chk_resume = QCheckBox("断点续跑 (跳过已完成影像)")
+        self.chk_resume.setChecked(False)
+        param_layout.addWidget(self.chk_resume)
+        
+        # 粗到细检测: 先在降采样影像上找候选区域，只精细推理候选区域内的切片
+        self.chk_coarse = QCheckBox("粗到细检测 (稀疏目标大图)")
+        self.chk_coarse.setChecked(False)
+        param_layout.addWidget(self.chk_coarse)
+        
         config_layout.addWidget(param_group)
         config_layout.addStretch()
         
@@ -645,6 +484,7 @@ class AI_GIS_App(QMainWindow):
         self.log_box = QTextEdit()
         self.log_box.setReadOnly(True)
         res_layout.addWidget(self.log_box)
+        self.preload_log_signal.connect(self.log_box.append)
         
         self.toolbox.addItem(page_res, "📊 结果与日志")
         
@@ -926,9 +766,14 @@ class AI_GIS_App(QMainWindow):
         path, _ = QFileDialog.getSaveFileName(self, "保存项目", "project.json", "JSON Files (*.json)")
         if not path: return
         
+        # 检测结果表转为列式 JSON；内存中的原始预测 ('raw') 可从旁车文件重新加载，不写入项目
+        results = {
+            p: {**{k: v for k, v in res.items() if k != 'raw'}, 'detections': res['detections'].to_json()}
+            for p, res in self.results.items()
+        }
         data = {
             "img_paths": self.img_paths,
-            "results": self.results, # Note: results might contain non-serializable data if not careful, but currently dicts/lists
+            "results": results,
             "output_dir": self.line_output.text()
         }
         
@@ -949,6 +794,11 @@ class AI_GIS_App(QMainWindow):
                 
             self.img_paths = data.get("img_paths", [])
             self.results = data.get("results", {})
+            for res in self.results.values():
+                # 兼容旧版项目文件中的逐目标记录列表
+                res['detections'] = DetectionTable.from_json(res['detections'])
+                if 'params' in res:
+                    res['params'] = tuple(res['params'])
             output_dir = data.get("output_dir", "")
             
             # Restore UI
@@ -991,7 +841,7 @@ class AI_GIS_App(QMainWindow):
         
         if self.current_transform:
             # Pixel to Geo
-            gx, gy = rasterio.transform.xy(self.current_transform, px_y, px_x, offset='center')
+            gx, gy = pixel_to_geo(self.current_transform, (px_x, px_y))
             text += f" | Geo: ({gx:.6f}, {gy:.6f})"
             
         self.lbl_coords.setText(text)
@@ -1018,6 +868,10 @@ class AI_GIS_App(QMainWindow):
             self.lbl_model_desc.setText("适合航拍视角，支持旋转目标检测 (如船只、车辆)")
         else:
             self.lbl_model_desc.setText("适合平视/街景视角，仅支持水平框检测 (如行人、普通车辆)")
+        
+        # 后台预加载 (仅本地已有权重，避免触发下载)
+        if self.chk_preload.isChecked() and os.path.exists(data):
+            MODEL_POOL.preload(data, detect_device(), log=self.preload_log_signal.emit)
 
     def add_toolbar_action(self, toolbar, text, callback):
         action = QAction(text, self)
@@ -1168,23 +1022,12 @@ class AI_GIS_App(QMainWindow):
                 
                 base_name = os.path.splitext(os.path.basename(img_path))[0]
                 
-                # 准备 DataFrame
-                data = []
-                geometries = []
-                for d in detections:
-                    data.append({
-                        'Class': d['name'],
-                        'Score': d['score'],
-                        'Image': base_name
-                    })
-                    # 恢复 Polygon
-                    points = d['polygon']
-                    # 注意：这里的 points 是像素坐标，如果需要地理坐标需要 transform
-                    # 由于我们在 DetectionThread 里已经生成了 Shapefile，这里为了简单，
-                    # 我们直接用像素坐标导出 Excel，GeoJSON/KML 需要地理坐标
-                    # 如果要地理坐标，需要重新读取 transform
-                    
-                df = pd.DataFrame(data)
+                # 准备 DataFrame (列式结果表直接整列构建)
+                df = pd.DataFrame({
+                    'Class': detections.class_names,
+                    'Score': detections.scores.astype(np.float64),
+                    'Image': base_name,
+                })
                 
                 if action == action_excel:
                     out_path = os.path.join(save_dir, f"{base_name}_result.xlsx")
@@ -1196,14 +1039,7 @@ class AI_GIS_App(QMainWindow):
                         transform = src.transform
                         crs = src.crs
                     
-                    geo_polys = []
-                    for d in detections:
-                        points = d['polygon']
-                        geo_points = []
-                        for px, py in points:
-                            gx, gy = rasterio.transform.xy(transform, py, px, offset='center')
-                            geo_points.append((gx, gy))
-                        geo_polys.append(Polygon(geo_points))
+                    geo_polys = polygons_to_geometries(detections.polygons, transform)
                         
                     gdf = gpd.GeoDataFrame(df, geometry=geo_polys, crs=crs)
                     
@@ -1261,7 +1097,7 @@ class AI_GIS_App(QMainWindow):
         folder = QFileDialog.getExistingDirectory(self, "选择包含影像的文件夹")
         if folder:
             # 递归查找 .tif, .tiff, .jpg, .png
-            valid_exts = ('.tif', '.tiff', '.jpg', '.png', '.jpeg')
+            valid_exts = IMAGE_EXTENSIONS
             count = 0
             for root, dirs, files in os.walk(folder):
                 for file in files:
@@ -1316,6 +1152,11 @@ class AI_GIS_App(QMainWindow):
         if not output_dir:
             QMessageBox.warning(self, "提示", "请先选择结果保存目录！")
             return
+        try:
+            bands = parse_bands(self.edit_bands.text())
+        except ValueError as e:
+            QMessageBox.warning(self, "提示", str(e))
+            return
             
         self.btn_run.setEnabled(False)
         self.log_box.clear()
@@ -1330,8 +1171,17 @@ class AI_GIS_App(QMainWindow):
         # 获取参数
         conf = self.spin_conf_infer.value() / 100.0
         iou = self.spin_iou.value() / 100.0
-        
-        self.worker = DetectionThread(model_path, self.img_paths, output_dir, conf=conf, iou=iou)
+        merge_method = self.combo_merge.currentData()
+        execution = self.combo_exec.currentData()
+        num_workers = self.spin_workers.value() or None
+        
+        self.worker = DetectionThread(model_path, self.img_paths, output_dir, conf=conf, iou=iou, merge_method=merge_method,
+                                      execution=execution, num_workers=num_workers,
+                                      use_cache=self.chk_cache.isChecked(), keep_raw=self.chk_raw.isChecked(),
+                                      resume=self.chk_resume.isChecked(), coarse_to_fine=self.chk_coarse.isChecked(),
+                                      backend=self.combo_backend.currentData(), int8=self.chk_int8.isChecked(),
+                                      bands=bands, vector_format=self.combo_vector.currentData(),
+                                      vis_format=self.combo_vis.currentData())
         self.worker.log_signal.connect(self.log_box.append)
         self.worker.progress_signal.connect(self.update_progress)
         self.worker.result_signal.connect(self.show_result)
@@ -1360,10 +1210,15 @@ class AI_GIS_App(QMainWindow):
 
     def show_result(self, img_path, vis_path, stats_text, detections_list):
         # Store result
+        raw_path = raw_sidecar_path(self.worker.engine.output_dir, img_path)
         self.results[img_path] = {
             'vis_path': vis_path,
             'stats': stats_text,
-            'detections': detections_list
+            'detections': detections_list,
+            # 原始预测旁车文件 + 生成当前结果所用的阈值，用于事后快速调整阈值
+            'raw_path': raw_path if self.worker.engine.keep_raw and os.path.exists(raw_path) else None,
+            'params': (self.worker.engine.conf, self.worker.engine.iou, self.worker.engine.merge_method),
+            'bands': self.worker.engine.bands, # 本次运行使用的波段映射 (之后修改输入框不影响已有结果的显示)
         }
         
         self.btn_export.setEnabled(True) # Enable export button
@@ -1411,9 +1266,62 @@ class AI_GIS_App(QMainWindow):
                     except:
                         self.current_transform = None
 
+    def current_infer_params(self):
+        return (self.spin_conf_infer.value() / 100.0, self.spin_iou.value() / 100.0, self.combo_merge.currentData())
+
+    def apply_raw_thresholds(self, img_path):
+        """ 若结果带有原始预测，按当前置信度/IoU/合并方式重新过滤，返回结果是否发生变化 """
+        res = self.results.get(img_path)
+        params = self.current_infer_params()
+        if not res or not res.get('raw_path') or res['params'] == params:
+            return False
+        try:
+            if 'raw' not in res:
+                res['raw'] = load_raw_predictions(res['raw_path'])
+        except Exception as e:
+            print(f"Raw prediction load failed: {e}")
+            res['raw_path'] = None
+            return False
+        conf, iou, merge = params
+        limited = clamp_raw_thresholds(res['raw'], conf, iou)
+        if limited != (conf, iou):
+            raw_conf, raw_iou = res['raw']['thresholds']
+            self.log_box.append(f"⚠️ 原始预测按置信度 ≥ {raw_conf:.2g}、IoU ≤ {raw_iou:.2f} 推理保存，"
+                                f"本次按置信度 {limited[0]:.2f}、IoU {limited[1]:.2f} 过滤 (需更宽松的阈值请重新推理)")
+        res['detections'] = rethreshold_raw(res['raw'], conf, iou, merge)
+        res['stats'] = detection_stats(os.path.splitext(os.path.basename(img_path))[0], res['detections'].class_names)
+        res['params'] = params
+        return True
+
+    def on_infer_params_changed(self, *args):
+        # 拖动过程中不重算，松开滑块后再应用
+        if self.spin_conf_infer.isSliderDown() or self.spin_iou.isSliderDown():
+            return
+        path = self.current_result_path
+        if path and self.apply_raw_thresholds(path):
+            res = self.results[path]
+            self.all_detections = res['detections']
+            self.update_class_combo(self.all_detections)
+            self.log_box.append(f"🎚️ 已按新阈值重新过滤 (无需重新推理): {len(self.all_detections)} 个目标")
+            self.refresh_scene()
+
+    def update_class_combo(self, detections):
+        """ 按结果所用模型的类别表 (names) 重建类别下拉框，只列出现的类别，尽量保留当前选择 """
+        current = self.combo_classes.currentText()
+        counts = detections.counts()
+        self.combo_classes.blockSignals(True)
+        self.combo_classes.clear()
+        self.combo_classes.addItem("全部")
+        self.combo_classes.addItems([name for name in detections.names if name in counts])
+        index = self.combo_classes.findText(current)
+        self.combo_classes.setCurrentIndex(max(index, 0))
+        self.combo_classes.blockSignals(False)
+
     def display_result(self, img_path):
         if img_path not in self.results: return
         
+        self.apply_raw_thresholds(img_path)
+        self.current_result_path = img_path
         res = self.results[img_path]
         # vis_path = res['vis_path'] # 不再使用预渲染的图片
         detections_list = res['detections']
@@ -1434,21 +1342,8 @@ class AI_GIS_App(QMainWindow):
             try:
                 with rasterio.open(img_path) as src:
                     self.current_transform = src.transform # Update transform for measurement
-                    img_data = src.read()
-                    # (bands, h, w) -> (h, w, bands)
-                    img_array = np.transpose(img_data, (1, 2, 0))
-                    
-                    # Handle dimensions
-                    if len(img_array.shape) == 2:
-                        img_array = np.expand_dims(img_array, axis=2)
-
-                    # Ensure 3 channels (RGB) for display
-                    if img_array.shape[2] > 3:
-                        img_array = img_array[:, :, :3]
-                    elif img_array.shape[2] == 1:
-                        img_array = np.repeat(img_array, 3, axis=2)
-                    
-                    # 转换为 uint8
+                    # 只读取与推理相同的 R, G, B 波段 (多光谱影像不再读取全部波段)
+                    img_array = read_rgb(src, bands=res.get('bands'))
                     
                     # 转换为 uint8
                     if img_array.dtype != np.uint8:
@@ -1470,12 +1365,7 @@ class AI_GIS_App(QMainWindow):
                 self.current_cv_img = cv2.imread(img_path)
             
             # 更新类别下拉框
-            unique_classes = sorted(list(set([d['name'] for d in detections_list])))
-            self.combo_classes.blockSignals(True)
-            self.combo_classes.clear()
-            self.combo_classes.addItem("全部")
-            self.combo_classes.addItems(unique_classes)
-            self.combo_classes.blockSignals(False)
+            self.update_class_combo(detections_list)
             
             # 触发重绘
             self.refresh_scene()
@@ -1494,14 +1384,10 @@ class AI_GIS_App(QMainWindow):
     def refresh_scene(self):
         if self.current_cv_img is None: return
         
-        # 1. 过滤检测结果
-        filtered = [d for d in self.all_detections if d['score'] >= self.min_conf]
-        
-        # 2. 再次根据类别过滤
+        # 1. 按置信度与类别过滤检测结果 (向量化掩码)
         cls_text = self.combo_classes.currentText()
-        if cls_text != "全部":
-            filtered = [d for d in filtered if d['name'] == cls_text]
-            
+        filtered = self.all_detections.filter(min_score=self.min_conf, name=None if cls_text == "全部" else cls_text)
+        
         self.current_filtered_detections = filtered
         self.update_chart(filtered)
         self.update_nav_ui()
@@ -1522,12 +1408,9 @@ class AI_GIS_App(QMainWindow):
             heatmap = np.zeros((h, w), dtype=np.float32)
             
             # 简单的点累加
-            for d in filtered:
-                bbox = d['bbox']
-                cx = int((bbox[0] + bbox[2]) / 2)
-                cy = int((bbox[1] + bbox[3]) / 2)
-                if 0 <= cx < w and 0 <= cy < h:
-                    heatmap[cy, cx] += 1
+            centers = filtered.centers().astype(np.int64)
+            inside = (centers[:, 0] >= 0) & (centers[:, 0] < w) & (centers[:, 1] >= 0) & (centers[:, 1] < h)
+            np.add.at(heatmap, (centers[inside, 1], centers[inside, 0]), 1)
             
             # 高斯模糊
             if len(filtered) > 0:
@@ -1564,25 +1447,15 @@ class AI_GIS_App(QMainWindow):
             pen = QPen(QColor(255, 0, 0)) # 红色
             pen.setWidth(2)
             
-            for d in filtered:
-                label_x, label_y = 0, 0
-                
-                if 'polygon' in d:
-                    points = d['polygon']
-                    qpoints = [QPointF(p[0], p[1]) for p in points]
-                    poly_item = QGraphicsPolygonItem(QPolygonF(qpoints))
-                    poly_item.setPen(pen)
-                    self.layer_groups['vector'].addToGroup(poly_item)
-                    label_x, label_y = points[0][0], points[0][1]
-                else:
-                    bbox = d['bbox']
-                    rect_item = QGraphicsRectItem(bbox[0], bbox[1], bbox[2]-bbox[0], bbox[3]-bbox[1])
-                    rect_item.setPen(pen)
-                    self.layer_groups['vector'].addToGroup(rect_item)
-                    label_x, label_y = bbox[0], bbox[1]
+            for points, name, score in zip(filtered.polygons.tolist(), filtered.class_names, filtered.scores.tolist()):
+                qpoints = [QPointF(p[0], p[1]) for p in points]
+                poly_item = QGraphicsPolygonItem(QPolygonF(qpoints))
+                poly_item.setPen(pen)
+                self.layer_groups['vector'].addToGroup(poly_item)
+                label_x, label_y = points[0][0], points[0][1]
 
                 # 绘制标签 (背景 + 文字)
-                label_str = f"{d['name']} {d['score']:.2f}"
+                label_str = f"{name} {score:.2f}"
                 
                 text_item = QGraphicsTextItem(label_str)
                 text_item.setDefaultTextColor(QColor("white"))
@@ -1622,23 +1495,8 @@ class AI_GIS_App(QMainWindow):
             self.large_chart_canvas.draw()
             return
 
-        from collections import Counter
-        
-        names = []
-        scores = []
-        # 确保数据格式正确
-        if isinstance(detections, list):
-            if len(detections) > 0:
-                if isinstance(detections[0], dict):
-                    names = [d['name'] for d in detections]
-                    scores = [d['score'] for d in detections]
-                elif isinstance(detections[0], str):
-                    names = detections
-        
-        if not names:
-            return
-
-        counts = Counter(names)
+        counts = detections.counts()
+        scores = detections.scores
         
         labels = list(counts.keys())
         values = list(counts.values())
@@ -1683,7 +1541,7 @@ class AI_GIS_App(QMainWindow):
         if text == "全部":
             self.current_filtered_detections = self.all_detections
         else:
-            self.current_filtered_detections = [d for d in self.all_detections if d['name'] == text]
+            self.current_filtered_detections = self.all_detections.filter(name=text)
         
         self.current_index = -1
         self.update_nav_ui()
@@ -1713,7 +1571,7 @@ class AI_GIS_App(QMainWindow):
         self.update_nav_ui()
         if not self.current_filtered_detections or self.current_index < 0: return
         
-        obj = self.current_filtered_detections[self.current_index]
+        table = self.current_filtered_detections
         
         # 移除旧的高亮框
         if self.highlight_item:
@@ -1725,24 +1583,15 @@ class AI_GIS_App(QMainWindow):
         pen = QPen(QColor(0, 255, 0))
         pen.setWidth(4)
 
-        if 'polygon' in obj:
-            # 绘制多边形
-            points = obj['polygon'] # list of [x, y]
-            qpoints = [QPointF(p[0], p[1]) for p in points]
-            polygon = QPolygonF(qpoints)
-            self.highlight_item = QGraphicsPolygonItem(polygon)
-            
-            # 计算中心点用于聚焦
-            bbox = obj['bbox']
-            center_x = (bbox[0] + bbox[2]) / 2
-            center_y = (bbox[1] + bbox[3]) / 2
-            center_point = QPointF(center_x, center_y)
-        else:
-            # 兼容旧格式 (矩形)
-            bbox = obj['bbox'] # [x1, y1, x2, y2]
-            rect = QRectF(bbox[0], bbox[1], bbox[2]-bbox[0], bbox[3]-bbox[1])
-            self.highlight_item = QGraphicsRectItem(rect)
-            center_point = rect.center()
+        # 绘制多边形
+        points = table.polygons[self.current_index].tolist() # list of [x, y]
+        qpoints = [QPointF(p[0], p[1]) for p in points]
+        polygon = QPolygonF(qpoints)
+        self.highlight_item = QGraphicsPolygonItem(polygon)
+        
+        # 计算中心点用于聚焦
+        center_x, center_y = table.centers()[self.current_index].tolist()
+        center_point = QPointF(center_x, center_y)
 
         self.highlight_item.setPen(pen)
         self.scene.addItem(self.highlight_item)
@@ -1758,6 +1607,8 @@ class AI_GIS_App(QMainWindow):
         QMessageBox.information(self, "状态", msg)
 
 if __name__ == '__main__':
+    # PyInstaller 打包后多进程模式的 spawn 子进程会重新执行入口，需先交给 multiprocessing 处理
+    multiprocessing.freeze_support()
     # try:
     #     import PyQt6
     #     plugin_path = os.path.join(os.path.dirname(PyQt6.__file__), 'Qt6', 'plugins')
@@ -0,0 +1,120 @@
+"""
+汇总检测图层 (DetectionLayerWriter) 的往返测试: 手工写入的 GeoPackage 几何 BLOB / R-tree 由 GDAL 读回校验
+"""
+import sqlite3
+
+import numpy as np
+import pytest
+import shapely
+from rasterio.crs import CRS
+from rasterio.transform import Affine
+
+pyogrio = pytest.importorskip("pyogrio")
+
+from aigis.core import DETECTION_LAYER, DetectionLayerWriter, polygons_to_geometries
+
+UTM = CRS.from_epsg(32650)
+TRANSFORM = Affine(0.5, 0, 500000, 0, -0.5, 3000000)
+
+
+def boxes(*xyxy):
+    """ 像素坐标外接框 -> (n, 4, 2) 多边形 """
+    return np.array([[[x0, y0], [x1, y0], [x1, y1], [x0, y1]] for x0, y0, x1, y1 in xyxy], dtype=np.float32)
+
+
+def open_writer(tmp_path, fmt='gpkg', append=False, log=None):
+    return DetectionLayerWriter(str(tmp_path), fmt, 'run-1', crs=UTM, run_attrs={'model': 'm.pt', 'params': {'conf': 0.25}},
+                                append=append, log=log)
+
+
+def test_gpkg_round_trip(tmp_path):
+    polygons = boxes((0, 0, 10, 20), (100, 100, 110, 104))
+    writer = open_writer(tmp_path)
+    writer.add('/data/a.tif', polygons, [0.9, 0.5], ['ship', 'car'],
+               TRANSFORM, UTM, width=200, height=200, detect_seconds=1.5)
+    writer.add('/data/b.tif', boxes(), [], [], TRANSFORM, UTM, width=200, height=200)
+    path = writer.close()
+
+    df = pyogrio.read_dataframe(path, layer=DETECTION_LAYER)
+    assert len(df) == 2
+    assert df.crs.to_epsg() == 32650
+    assert df['class'].tolist() == ['ship', 'car']
+    assert df['image'].tolist() == ['a', 'a']
+    np.testing.assert_allclose(df['score'], [0.9, 0.5])
+    expected = polygons_to_geometries(polygons, TRANSFORM)
+    assert all(shapely.equals_exact(df.geometry.values, expected, 1e-6))
+
+    images = pyogrio.read_dataframe(path, layer='images')
+    assert images['image'].tolist() == ['a', 'b']
+    assert images['detections'].tolist() == [2, 0]
+    runs = pyogrio.read_dataframe(path, layer='runs')
+    assert runs['status'].tolist() == ['finished']
+    assert runs['detections'].tolist() == [2]
+
+    # 空间过滤走 R-tree: 只返回第二个目标
+    hit = pyogrio.read_dataframe(path, layer=DETECTION_LAYER, bbox=(500049, 2999947, 500056, 2999951))
+    assert hit['class'].tolist() == ['car']
+    with sqlite3.connect(path) as conn:
+        extent = conn.execute("SELECT min_x, min_y, max_x, max_y FROM gpkg_contents WHERE table_name = ?",
+                              (DETECTION_LAYER,)).fetchone()
+    assert extent == pytest.approx(tuple(df.total_bounds))
+
+
+def test_gpkg_rtree_matches_geometries(tmp_path):
+    writer = open_writer(tmp_path)
+    writer.add('/data/a.tif', boxes((0, 0, 10, 20), (30, 40, 50, 60), (5, 5, 6, 6)), [0.9, 0.8, 0.7],
+               ['ship', 'ship', 'car'], TRANSFORM, UTM)
+    path = writer.close()
+
+    df = pyogrio.read_dataframe(path, layer=DETECTION_LAYER, fid_as_index=True)
+    with sqlite3.connect(path) as conn:
+        rtree = {fid: bounds for fid, *bounds in conn.execute(
+            f"SELECT id, minx, miny, maxx, maxy FROM rtree_{DETECTION_LAYER}_geom")}
+    assert sorted(rtree) == sorted(df.index)
+    for fid, geom in df.geometry.items():
+        np.testing.assert_allclose(rtree[fid], geom.bounds, rtol=1e-6)
+
+
+def test_reprojection_warning_only_for_written_features(tmp_path):
+    messages = []
+    writer = open_writer(tmp_path, log=messages.append)
+    wgs84 = CRS.from_epsg(4326)
+    lonlat = Affine(0.0001, 0, 117, 0, -0.0001, 27)
+    writer.add('/data/empty.tif', boxes(), [], [], lonlat, wgs84)
+    assert messages == []
+    writer.add('/data/c.tif', boxes((0, 0, 10, 10)), [0.6], ['ship'], lonlat, wgs84)
+    assert len(messages) == 1 and '已重投影' in messages[0]
+    path = writer.close()
+
+    df = pyogrio.read_dataframe(path, layer=DETECTION_LAYER)
+    assert df.crs.to_epsg() == 32650
+    minx, miny, maxx, maxy = df.total_bounds
+    assert 200000 < minx < maxx < 800000 and 2900000 < miny < maxy < 3100000
+
+
+def test_resume_appends_to_existing_layer(tmp_path):
+    writer = open_writer(tmp_path)
+    writer.add('/data/a.tif', boxes((0, 0, 10, 20)), [0.9], ['ship'], TRANSFORM, UTM)
+    writer.close(status='stopped')
+
+    writer = open_writer(tmp_path, append=True)
+    assert writer.present == {'/data/a.tif'}
+    writer.add('/data/b.tif', boxes((0, 0, 4, 4)), [0.7], ['car'], TRANSFORM, UTM)
+    path = writer.close()
+
+    assert len(pyogrio.read_dataframe(path, layer=DETECTION_LAYER)) == 2
+    assert pyogrio.read_dataframe(path, layer='runs')['status'].tolist() == ['stopped', 'finished']
+
+
+def test_flatgeobuf_round_trip(tmp_path):
+    writer = open_writer(tmp_path, fmt='fgb')
+    writer.add('/data/a.tif', boxes((0, 0, 10, 20), (100, 100, 110, 104)), [0.9, 0.5], ['ship', 'car'],
+               TRANSFORM, UTM)
+    path = writer.close()
+
+    assert path.endswith('.fgb')
+    df = pyogrio.read_dataframe(path)
+    assert sorted(df['class']) == ['car', 'ship'] # 建立空间索引时要素按空间顺序重排
+    assert df.crs.to_epsg() == 32650
+    hit = pyogrio.read_dataframe(path, bbox=(500049, 2999947, 500056, 2999951))
+    assert hit['class'].tolist() == ['car']
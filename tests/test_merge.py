@@ -0,0 +1,140 @@
+"""
+跨切片合并与切片边界拼接的确定性测试: 稠密/稀疏 NMS 一致、旋转 IoU 与 shapely 一致、候选对与暴力枚举一致
+"""
+import numpy as np
+import pytest
+import shapely
+
+import aigis.core as core
+from aigis.core import (candidate_pairs, merge_detections, polygons_to_bboxes, rotated_iou_pairs,
+                        stitch_tile_edges)
+
+
+def boxes(*xyxy):
+    """ 像素坐标外接框 -> (n, 4, 2) 多边形 """
+    return np.array([[[x0, y0], [x1, y0], [x1, y1], [x0, y1]] for x0, y0, x1, y1 in xyxy], dtype=np.float32)
+
+
+def random_boxes(rng, n, image=2000, sizes=(8, 40)):
+    xy = rng.uniform(0, image, (n, 2))
+    wh = rng.uniform(*sizes, (n, 2))
+    return boxes(*np.concatenate([xy, xy + wh], axis=1))
+
+
+def rotated_boxes(rng, n, image=200):
+    """ 随机旋转矩形 (n, 4, 2) """
+    center = rng.uniform(0, image, (n, 1, 2))
+    half = rng.uniform(5, 30, (n, 1, 2))
+    angle = rng.uniform(0, np.pi, n)
+    corners = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]], dtype=np.float64) * half
+    rot = np.stack([np.stack([np.cos(angle), -np.sin(angle)], axis=1),
+                    np.stack([np.sin(angle), np.cos(angle)], axis=1)], axis=1)
+    return (np.einsum('nij,nkj->nki', rot, corners) + center).astype(np.float32)
+
+
+def brute_force_pairs(bboxes, classes):
+    i, j = np.triu_indices(len(bboxes), k=1)
+    a, b = bboxes[i], bboxes[j]
+    mask = (np.minimum(a[:, 2], b[:, 2]) > np.maximum(a[:, 0], b[:, 0])) & \
+           (np.minimum(a[:, 3], b[:, 3]) > np.maximum(a[:, 1], b[:, 1])) & (classes[i] == classes[j])
+    return set(zip(i[mask].tolist(), j[mask].tolist()))
+
+
+def test_candidate_pairs_mixed_sizes_match_brute_force():
+    """ 少量大框不能拉大网格 (否则退化为全部两两比较)，结果仍与暴力枚举一致 """
+    rng = np.random.default_rng(0)
+    polygons = np.concatenate([random_boxes(rng, 3000), random_boxes(rng, 20, sizes=(300, 900)),
+                               boxes((0, 0, 2000, 2000))])
+    bboxes = polygons_to_bboxes(polygons)
+    classes = rng.integers(0, 3, len(bboxes))
+    i, j = candidate_pairs(bboxes, classes)
+    assert np.all(i < j)
+    pairs = set(zip(i.tolist(), j.tolist()))
+    assert len(pairs) == len(i) # 无重复
+    assert pairs == brute_force_pairs(bboxes, classes)
+
+
+def test_candidate_pairs_single_huge_box_stays_sparse():
+    """ 大量小框 + 一个覆盖全图的大框: 候选对数量只随相交的框增长 """
+    rng = np.random.default_rng(1)
+    polygons = np.concatenate([random_boxes(rng, 20000, image=20000), boxes((0, 0, 20000, 20000))])
+    i, j = candidate_pairs(polygons_to_bboxes(polygons))
+    big = len(polygons) - 1
+    assert np.count_nonzero(j == big) == big # 大框与每个小框都相交
+    assert len(i) < 3 * big
+
+
+@pytest.mark.parametrize('rotated', [False, True])
+def test_dense_and_sparse_nms_agree(monkeypatch, rotated):
+    rng = np.random.default_rng(2)
+    polygons = random_boxes(rng, 400, image=300)
+    scores = rng.uniform(0.1, 1.0, len(polygons)).astype(np.float32)
+    classes = rng.integers(0, 2, len(polygons))
+    dense = merge_detections(polygons, scores, classes, iou_thr=0.4)
+    monkeypatch.setattr(core, 'DENSE_NMS_LIMIT', 0)
+    sparse = merge_detections(polygons, scores, classes, iou_thr=0.4, rotated=rotated)
+    for a, b in zip(dense, sparse):
+        np.testing.assert_allclose(a, b, atol=1e-4)
+
+
+def test_rotated_iou_matches_shapely():
+    rng = np.random.default_rng(3)
+    polygons = rotated_boxes(rng, 200)
+    i, j = candidate_pairs(polygons_to_bboxes(polygons))
+    assert len(i) > 50
+    shapes = shapely.polygons(polygons.astype(np.float64))
+    inter = shapely.area(shapely.intersection(shapes[i], shapes[j]))
+    expected = inter / (shapely.area(shapes[i]) + shapely.area(shapes[j]) - inter)
+    np.testing.assert_allclose(rotated_iou_pairs(polygons, i, j), expected, atol=1e-6)
+
+
+def test_soft_nms_decays_overlapping_scores():
+    polygons = boxes((0, 0, 10, 10), (1, 0, 11, 10), (50, 50, 60, 60))
+    scores = np.array([0.9, 0.8, 0.7], dtype=np.float32)
+    out_polygons, out_scores, out_classes = merge_detections(polygons, scores, [0, 0, 0], method='soft-nms',
+                                                             score_thr=0.01, sigma=0.5)
+    decayed = 0.8 * np.exp(-(90 / 110) ** 2 / 0.5) # 高斯衰减: 与最高分框 IoU = 90/110
+    np.testing.assert_allclose(out_scores, [0.9, 0.7, decayed], rtol=1e-5)
+    np.testing.assert_allclose(polygons_to_bboxes(out_polygons)[2], [1, 0, 11, 10])
+    # 分数衰减到阈值以下的框被丢弃
+    _, kept, _ = merge_detections(polygons, scores, [0, 0, 0], method='soft-nms', score_thr=0.5, sigma=0.5)
+    np.testing.assert_allclose(kept, [0.9, 0.7], rtol=1e-6)
+
+
+def test_wbf_fuses_weighted_box():
+    polygons = boxes((0, 0, 10, 10), (2, 0, 12, 10), (50, 50, 60, 60), (0, 0, 10, 10))
+    scores = np.array([0.75, 0.25, 0.5, 0.6], dtype=np.float32)
+    out_polygons, out_scores, out_classes = merge_detections(polygons, scores, [0, 0, 0, 1], method='wbf', iou_thr=0.5)
+    fused = out_classes == 0
+    bboxes = polygons_to_bboxes(out_polygons[fused])
+    order = np.argsort(bboxes[:, 0])
+    # 加权平均: x1 = (0 * 0.75 + 2 * 0.25) / 1.0，得分取簇内平均
+    np.testing.assert_allclose(bboxes[order], [[0.5, 0, 10.5, 10], [50, 50, 60, 60]], atol=1e-5)
+    np.testing.assert_allclose(out_scores[fused][order], [0.5, 0.5], atol=1e-6)
+    assert np.count_nonzero(out_classes == 1) == 1 # 不同类别不参与融合
+
+
+def test_stitch_merges_object_cut_by_seam():
+    """ 两个相邻切片各截断同一目标的一半 -> 合并为一个跨接缝的框 """
+    tiles = [(0, 0, 100, 100), (80, 0, 100, 100)]
+    polygons = boxes((70, 20, 99, 40), (81, 20, 110, 40))
+    out_polygons, out_scores, _ = stitch_tile_edges(polygons, [0.6, 0.8], [0, 0], tiles, (180, 100))
+    assert len(out_polygons) == 1
+    np.testing.assert_allclose(polygons_to_bboxes(out_polygons), [[70, 20, 110, 40]])
+    np.testing.assert_allclose(out_scores, [0.8])
+
+
+def test_stitch_drops_truncated_box_covered_by_full_detection():
+    tiles = [(0, 0, 100, 100), (80, 0, 100, 100), (0, 0, 100, 100)]
+    # 第一个切片中的截断框被第二个切片中的完整检测覆盖
+    polygons = boxes((85, 20, 99, 40), (84, 20, 120, 40), (10, 10, 20, 20))
+    out_polygons, _, _ = stitch_tile_edges(polygons, [0.9, 0.5, 0.7], [0, 0, 0], tiles, (180, 100))
+    np.testing.assert_allclose(polygons_to_bboxes(out_polygons), [[84, 20, 120, 40], [10, 10, 20, 20]])
+
+
+def test_stitch_keeps_boxes_at_image_border():
+    """ 影像外边界上的框不视为截断 """
+    tiles = [(0, 0, 100, 100), (80, 0, 100, 100)]
+    polygons = boxes((0, 0, 10, 10), (170, 0, 180, 10))
+    out_polygons, _, _ = stitch_tile_edges(polygons, [0.9, 0.9], [0, 0], tiles, (180, 100))
+    assert len(out_polygons) == 2
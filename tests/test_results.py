@@ -0,0 +1,104 @@
+"""
+结果缓存 / 断点续跑清单 / 原始预测旁车文件的往返测试
+"""
+import os
+
+import numpy as np
+
+from aigis.core import (DetectionTable, JobManifest, ResultCache, clamp_raw_thresholds, load_raw_predictions,
+                        raw_sidecar_path, rethreshold_raw, save_raw_predictions)
+
+
+def boxes(*xyxy):
+    """ 像素坐标外接框 -> (n, 4, 2) 多边形 """
+    return np.array([[[x0, y0], [x1, y0], [x1, y1], [x0, y1]] for x0, y0, x1, y1 in xyxy], dtype=np.float32)
+
+
+def write_file(path, data=b'image'):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return str(path)
+
+
+def sample_table():
+    return DetectionTable.from_names(boxes((0, 0, 10, 10), (20, 20, 30, 30), (40, 40, 50, 50)),
+                                     [0.9, 0.4, 0.7], ['ship', 'car', 'ship'])
+
+
+def test_detection_table_filter_and_json_round_trip():
+    table = sample_table()
+    assert table.counts() == {'car': 1, 'ship': 2}
+    np.testing.assert_allclose(table.filter(min_score=0.5, name='ship').scores, [0.9, 0.7])
+    assert len(table.filter(name='plane')) == 0
+    restored = DetectionTable.from_json(table.to_json())
+    assert restored.class_names == table.class_names
+    np.testing.assert_array_equal(restored.polygons, table.polygons)
+    np.testing.assert_array_equal(restored.scores, table.scores)
+
+
+def test_result_cache_round_trip(tmp_path):
+    image = write_file(tmp_path / 'a.tif')
+    output = write_file(tmp_path / 'a.shp', b'features')
+    cache = ResultCache(str(tmp_path / 'out'))
+    key = cache.key(image, 'model-digest', {'conf': 0.25})
+    assert cache.get(key) is None
+    cache.put(key, {'outputs': [output], 'stats': [{'Class': 'ship', 'Count': 2}]})
+    cache.save_index()
+
+    reopened = ResultCache(str(tmp_path / 'out'))
+    assert reopened.key(image, 'model-digest', {'conf': 0.25}) == key
+    assert reopened.key(image, 'model-digest', {'conf': 0.3}) != key
+    assert reopened.get(key)['stats'] == [{'Class': 'ship', 'Count': 2}]
+    # 输入内容变化 -> 新的键；输出被删除 -> 缓存失效
+    write_file(image, b'image v2')
+    assert reopened.key(image, 'model-digest', {'conf': 0.25}) != key
+    os.remove(output)
+    assert reopened.get(key) is None
+
+
+def test_job_manifest_resume(tmp_path):
+    out_dir = str(tmp_path / 'out')
+    image = write_file(tmp_path / 'a.tif')
+    pending = write_file(tmp_path / 'b.tif')
+    output = write_file(tmp_path / 'a.shp', b'features')
+    manifest = JobManifest(out_dir, 'sig-1')
+    manifest.finish(image, [output], [{'Class': 'ship', 'Count': 2}], sample_table(), 1.5, detect_seconds=1.2)
+    acc = {'polygons': [boxes((0, 0, 5, 5))], 'scores': [np.array([0.5], dtype=np.float32)],
+           'classes': [np.array([1])], 'tiles': [np.array([[0, 0, 640, 640]])], 'done': [(0, 0, 640, 640)]}
+    manifest.save_checkpoint(pending, acc, force=True)
+    manifest.close()
+
+    resumed = JobManifest(out_dir, 'sig-1', resume=True)
+    vis, stats, detections = resumed.completed_result(image)
+    assert vis == ''
+    assert stats == [{'Class': 'ship', 'Count': 2}]
+    assert detections.class_names == sample_table().class_names
+    assert resumed.completed_result(pending) is None
+    checkpoint = resumed.load_checkpoint(pending)
+    assert checkpoint['done'] == [(0, 0, 640, 640)]
+    np.testing.assert_array_equal(checkpoint['polygons'][0], acc['polygons'][0])
+    resumed.close()
+
+    # 参数变化 (签名不同) 后不复用之前的结果与检查点
+    changed = JobManifest(out_dir, 'sig-2', resume=True)
+    assert changed.completed_result(image) is None
+    assert changed.load_checkpoint(pending) is None
+    changed.close()
+
+
+def test_rethreshold_raw_sidecar(tmp_path):
+    # 两个重叠的船 (IoU 0.6) + 一个低分的车
+    polygons = boxes((0, 0, 10, 10), (0, 0, 10, 6), (50, 50, 60, 60))
+    path = raw_sidecar_path(str(tmp_path), '/data/a.tif')
+    save_raw_predictions(path, polygons, np.array([0.9, 0.8, 0.05]), np.array([0, 0, 1]),
+                         np.zeros((3, 4)), {0: 'ship', 1: 'car'}, 'detect', (100, 100), tiled=False,
+                         thresholds=(0.01, 0.7))
+    raw = load_raw_predictions(path)
+    assert raw['names'] == {0: 'ship', 1: 'car'}
+
+    assert rethreshold_raw(raw, 0.01, 0.7).class_names == ['ship', 'ship', 'car']
+    assert rethreshold_raw(raw, 0.01, 0.5).class_names == ['ship', 'car']
+    assert rethreshold_raw(raw, 0.25, 0.5).class_names == ['ship']
+    # 阈值超出推理时的范围会被限制
+    assert clamp_raw_thresholds(raw, 0.001, 0.9) == (0.01, 0.7)
+    assert len(rethreshold_raw(raw, 0.001, 0.9)) == 3
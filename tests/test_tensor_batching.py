@@ -0,0 +1,60 @@
+"""
+固定尺寸张量批处理 (TileTensorBatcher) 与 ultralytics 列表输入路径的一致性
+"""
+import numpy as np
+import pytest
+from ultralytics import YOLO
+
+from aigis.core import TileTensorBatcher, model_input_size, predict_crops
+
+CONF = 1e-4 # 随机权重的得分很低，放宽阈值保证有可比较的检测框
+
+
+@pytest.fixture(scope='module')
+def obb_model():
+    # 随机初始化的 OBB 模型 (无需下载权重)，只比较两条预处理路径的输出
+    return YOLO('yolov8n-obb.yaml')
+
+
+def crops(n=2, size=640, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 256, (size, size, 3), dtype=np.uint8) for _ in range(n)]
+
+
+def obb_arrays(results):
+    return [(r.obb.xywhr.cpu().numpy(), r.obb.conf.cpu().numpy()) for r in results]
+
+
+def test_tensor_path_matches_list_path_at_model_size(obb_model):
+    batcher = TileTensorBatcher(640)
+    images = crops()
+    assert batcher.accepts(images, obb_model)
+    tensor = obb_arrays(predict_crops(obb_model, images, batcher, conf=CONF, device='cpu'))
+    listed = obb_arrays(predict_crops(obb_model, images, None, conf=CONF, device='cpu'))
+    assert all(len(tc) for _, tc in listed)
+    for (tb, tc), (lb, lc) in zip(tensor, listed):
+        assert len(tc) == len(lc)
+        np.testing.assert_allclose(np.sort(tc), np.sort(lc), atol=1e-4)
+
+
+def test_tensor_path_skipped_when_model_trained_at_other_size(obb_model, monkeypatch):
+    # 例如 1024 训练的 DOTA OBB 模型: 640 切片需要 letterbox 放大，张量路径会改变模型输入
+    monkeypatch.setitem(obb_model.overrides, 'imgsz', 1024)
+    batcher = TileTensorBatcher(640)
+    images = crops()
+    assert model_input_size(obb_model) == (1024, 1024)
+    assert not batcher.accepts(images, obb_model)
+    tensor = obb_arrays(predict_crops(obb_model, images, batcher, conf=CONF, device='cpu'))
+    listed = obb_arrays(predict_crops(obb_model, images, None, conf=CONF, device='cpu'))
+    assert all(len(tc) for _, tc in listed)
+    for (tb, tc), (lb, lc) in zip(tensor, listed):
+        np.testing.assert_array_equal(tb, lb)
+        np.testing.assert_array_equal(tc, lc)
+
+
+def test_accepts_rejects_non_uint8_and_oversize():
+    batcher = TileTensorBatcher(500)
+    assert batcher.size == 512
+    assert batcher.accepts([np.zeros((500, 300, 3), np.uint8)])
+    assert not batcher.accepts([np.zeros((500, 500, 3), np.uint16)])
+    assert not batcher.accepts([np.zeros((600, 500, 3), np.uint8)])
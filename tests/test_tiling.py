@@ -0,0 +1,58 @@
+"""
+切片规划 (TilePlan) 测试: 最少切片数、最小重叠、末块贴边与数据块对齐
+"""
+import math
+
+import pytest
+
+from aigis.core import TilePlan, check_stride
+
+
+@pytest.mark.parametrize('width, height, size, overlap', [
+    (2100, 1500, 640, 140), (640, 640, 640, 140), (641, 5000, 640, 0), (10000, 333, 512, 511),
+])
+def test_tile_count_is_minimal_and_covers_image(width, height, size, overlap):
+    plan = TilePlan(width, height, size, overlap)
+    expected = [1 if n <= size else math.ceil((n - size) / (size - overlap)) + 1 for n in (width, height)]
+    assert (len(plan.xs), len(plan.ys)) == tuple(expected)
+    assert len(plan) == expected[0] * expected[1]
+    for starts, length in ((plan.xs, width), (plan.ys, height)):
+        assert starts[0] == 0
+        assert starts[-1] + min(size, length) == length # 末块贴齐边缘，不产生窄条
+        assert all(a + size - b >= overlap for a, b in zip(starts, starts[1:]))
+
+
+def test_default_plan():
+    plan = TilePlan(2100, 1500, 640, 140)
+    assert plan.xs == [0, 486, 973, 1460]
+    assert plan.ys == [0, 430, 860]
+    assert plan.tiles[0] == (0, 0, 640, 640)
+    assert plan.tiles[-1] == (1460, 860, 640, 640)
+
+
+def test_small_image_single_clipped_tile():
+    plan = TilePlan(600, 500, 640, 140)
+    assert plan.tiles == [(0, 0, 600, 500)]
+
+
+def test_block_alignment_never_adds_tiles():
+    aligned = TilePlan(1400, 1400, 640, 140, block=(128, 128))
+    assert aligned.aligned
+    assert aligned.xs == [0, 384, 760]
+    assert len(aligned) == len(TilePlan(1400, 1400, 640, 140))
+    # 对齐会增加切片数时保持均匀分布
+    plan = TilePlan(2100, 1500, 640, 140, block=(256, 256))
+    assert not plan.aligned
+    assert len(plan) == 12
+
+
+@pytest.mark.parametrize('size, overlap', [(640, 640), (640, -1)])
+def test_invalid_overlap(size, overlap):
+    with pytest.raises(ValueError):
+        TilePlan(1000, 1000, size, overlap)
+
+
+@pytest.mark.parametrize('size, stride', [(640, 0), (640, 641), (0, 0)])
+def test_invalid_stride(size, stride):
+    with pytest.raises(ValueError):
+        check_stride(size, stride)